@@ -52,7 +52,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "planner.middleware.server_timing_middleware",
     "corsheaders.middleware.CorsMiddleware",
+    "django.middleware.gzip.GZipMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -161,3 +163,106 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 # WhiteNoise for serving static files in production
 MIDDLEWARE.insert(1, "whitenoise.middleware.WhiteNoiseMiddleware")
 STATICFILES_STORAGE = "whitenoise.storage.CompressedManifestStaticFilesStorage"
+
+# Planner service caches
+GEOCODE_CACHE_SIZE = int(os.environ.get("GEOCODE_CACHE_SIZE", "2048"))
+GEOCODE_CACHE_TTL = int(os.environ.get("GEOCODE_CACHE_TTL", str(30 * 24 * 3600)))  # seconds
+
+# Offline gazetteer (`manage.py build_gazetteer`): exact "City, ST" matches skip Mapbox,
+# and /api/places/ serves autocomplete from it
+GAZETTEER_PATH = os.environ.get("GAZETTEER_PATH")
+
+# Truck stop index (`manage.py build_poi_index`): fuel, break and rest stops move back to
+# the best truck stop or rest area within POI_DETOUR_M of the route and no more than
+# POI_MAX_BACKTRACK_M short of where they would fall. Unset keeps stops on the route.
+POI_INDEX_PATH = os.environ.get("POI_INDEX_PATH")
+POI_DETOUR_M = float(os.environ.get("POI_DETOUR_M", "3000"))
+POI_MAX_BACKTRACK_M = float(os.environ.get("POI_MAX_BACKTRACK_M", "40000"))
+
+# Outbound I/O for plan requests
+PLANNER_IO_WORKERS = int(os.environ.get("PLANNER_IO_WORKERS", "8"))
+PLAN_REQUEST_TIMEOUT = float(os.environ.get("PLAN_REQUEST_TIMEOUT", "20"))  # seconds, whole request
+
+# Route cache: waypoints are rounded to ROUTE_CACHE_PRECISION decimal places for the key.
+# Entries older than ROUTE_CACHE_TTL are served for up to ROUTE_CACHE_STALE_TTL more
+# seconds while a background refresh runs (0 disables stale-while-revalidate).
+ROUTE_CACHE_SIZE = int(os.environ.get("ROUTE_CACHE_SIZE", "256"))
+ROUTE_CACHE_PRECISION = int(os.environ.get("ROUTE_CACHE_PRECISION", "3"))
+ROUTE_CACHE_TTL = int(os.environ.get("ROUTE_CACHE_TTL", str(7 * 24 * 3600)))
+ROUTE_CACHE_STALE_TTL = int(os.environ.get("ROUTE_CACHE_STALE_TTL", str(24 * 3600)))
+
+# Mapbox endpoint. Point MAPBOX_BASE_URL at `manage.py mock_mapbox` for offline runs;
+# set MAPBOX_RECORD_DIR to save every live response there as a replayable fixture.
+MAPBOX_API_KEY = os.environ.get("MAPBOX_API_KEY")
+MAPBOX_BASE_URL = os.environ.get("MAPBOX_BASE_URL", "https://api.mapbox.com")
+MAPBOX_RECORD_DIR = os.environ.get("MAPBOX_RECORD_DIR")
+
+# Routing backends, tried in order until one returns a route: "local" (the road graph
+# at ROAD_GRAPH_PATH, built with `manage.py build_road_graph`) and "mapbox".
+# Waypoints further than ROAD_GRAPH_MAX_SNAP_M from any road in the graph fall through,
+# as do legs whose search settles more than ROAD_GRAPH_MAX_SETTLED nodes (the local
+# search is plain A*, sized for regional graphs rather than a continent).
+ROUTING_BACKENDS = [
+    b.strip() for b in os.environ.get("ROUTING_BACKENDS", "mapbox").split(",") if b.strip()
+]
+ROAD_GRAPH_PATH = os.environ.get("ROAD_GRAPH_PATH")
+ROAD_GRAPH_MAX_SNAP_M = float(os.environ.get("ROAD_GRAPH_MAX_SNAP_M", "5000"))
+ROAD_GRAPH_MAX_SETTLED = int(os.environ.get("ROAD_GRAPH_MAX_SETTLED", "200000"))
+
+# Shared Mapbox HTTP client: retries with jittered backoff, then a per-endpoint circuit breaker
+HTTP_MAX_RETRIES = int(os.environ.get("HTTP_MAX_RETRIES", "2"))
+HTTP_BACKOFF_BASE = float(os.environ.get("HTTP_BACKOFF_BASE", "0.2"))  # seconds
+HTTP_BACKOFF_CAP = float(os.environ.get("HTTP_BACKOFF_CAP", "2.0"))  # seconds
+HTTP_CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get("HTTP_CIRCUIT_FAILURE_THRESHOLD", "5"))
+HTTP_CIRCUIT_RESET_TIMEOUT = float(os.environ.get("HTTP_CIRCUIT_RESET_TIMEOUT", "30"))  # seconds
+# Client-side rate limits per Mapbox endpoint, requests per second (per process)
+HTTP_RATE_LIMITS = {
+    "geocoding": float(os.environ.get("MAPBOX_GEOCODING_RPS", "10")),
+    "directions": float(os.environ.get("MAPBOX_DIRECTIONS_RPS", "5")),
+}
+
+# Plan request dedupe: a repeat of a plan request (same Idempotency-Key header) within
+# PLAN_DEDUPE_WINDOW seconds gets the trip already planned, and one arriving while that
+# plan is in flight waits for it. 0 disables. PLAN_DEDUPE_INPUTS also dedupes requests
+# without the header by their normalized input, across all clients.
+PLAN_DEDUPE_WINDOW = float(os.environ.get("PLAN_DEDUPE_WINDOW", "300"))
+PLAN_DEDUPE_INPUTS = os.environ.get("PLAN_DEDUPE_INPUTS", "false").lower() in ("1", "true")
+
+# Batch planning
+PLAN_BATCH_MAX_TRIPS = int(os.environ.get("PLAN_BATCH_MAX_TRIPS", "500"))
+PLAN_BATCH_TIMEOUT = float(os.environ.get("PLAN_BATCH_TIMEOUT", "300"))  # seconds, whole batch
+PLANNER_CPU_WORKERS = int(os.environ.get("PLANNER_CPU_WORKERS", str(os.cpu_count() or 1)))
+
+# Plan jobs (/api/plan/jobs/, run by `manage.py run_plan_worker`). A job held longer
+# than PLAN_JOB_LEASE seconds is assumed lost and handed to another worker; failed
+# attempts are retried after PLAN_JOB_RETRY_BACKOFF seconds, doubling each time.
+PLAN_JOB_MAX_ATTEMPTS = int(os.environ.get("PLAN_JOB_MAX_ATTEMPTS", "3"))
+PLAN_JOB_LEASE = float(os.environ.get("PLAN_JOB_LEASE", "120"))
+PLAN_JOB_RETRY_BACKOFF = float(os.environ.get("PLAN_JOB_RETRY_BACKOFF", "5"))
+
+# Trip read API
+TRIPS_PAGE_SIZE = int(os.environ.get("TRIPS_PAGE_SIZE", "50"))
+TRIP_CACHE_SIZE = int(os.environ.get("TRIP_CACHE_SIZE", "512"))  # rendered trip responses
+TRIP_CACHE_TTL = int(os.environ.get("TRIP_CACHE_TTL", "3600"))  # seconds
+
+# Observability: Server-Timing headers are always on; /api/metrics/ requires
+# METRICS_TOKEN as a bearer token, and is disabled without one unless DEBUG.
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "formatters": {
+        "kv": {"format": "ts=%(asctime)s level=%(levelname)s logger=%(name)s msg=%(message)s"},
+    },
+    "handlers": {
+        "console": {"class": "logging.StreamHandler", "formatter": "kv"},
+    },
+    "loggers": {
+        "planner": {
+            "handlers": ["console"],
+            "level": os.environ.get("PLANNER_LOG_LEVEL", "INFO"),
+            "propagate": False,
+        },
+    },
+}
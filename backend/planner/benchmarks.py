@@ -0,0 +1,425 @@
+"""
+Benchmarks for the trip planning pipeline, run by `manage.py bench_planner`.
+
+Every case runs on synthetic routes: a gently winding eastbound line with a
+chosen number of vertices, long enough for a chosen number of driving days.
+Results are plain dicts so runs can be saved as JSON and compared later.
+"""
+
+import json
+import platform
+import statistics
+import subprocess
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timedelta
+from functools import lru_cache
+from math import cos, radians
+
+import numpy as np
+from django.conf import settings
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .models import GeocodeCache, RouteCache, Trip
+from .services import geocoding, road_graph, routing
+from .services.event_planning import create_split_event, plan_trip
+from .services.geometry import RouteGeometry, segment_lengths
+from .services.hos import FUEL_INTERVAL_M, simulate_trip
+from .services.http_client import set_rate_limit
+from .services.mapbox import fixture_key
+from .services.mock_mapbox import make_server
+
+BENCH_SPEED_MPS = 25.0
+DRIVING_HOURS_PER_DAY = 11
+ORIGIN = (35.0, -120.0)
+METERS_PER_DEGREE = 111_320.0
+ROAD_GRID_STEP = 0.01  # degrees between parallel roads in the synthetic road grid, ~1 km
+ROAD_GRID_SIDES = (100, 300)  # roads each way: 10k and 90k junctions
+
+
+def synthetic_route(vertices, days):
+    """get_mapbox_route-shaped dict: `vertices` points covering ~`days` days of driving."""
+    target_m = days * DRIVING_HOURS_PER_DAY * 3600 * BENCH_SPEED_MPS
+    t = np.linspace(0.0, 1.0, vertices)
+    lat = ORIGIN[0] + 0.5 * np.sin(t * 40)
+    lon = ORIGIN[1] + t * target_m / (METERS_PER_DEGREE * cos(radians(ORIGIN[0])))
+    points = np.column_stack([lat, lon])
+    distance_m = float(segment_lengths(points).sum())
+    return {
+        "distance_m": distance_m,
+        "duration_s": distance_m / BENCH_SPEED_MPS,
+        "geometry": points.tolist(),
+    }
+
+
+def trip_waypoints(route):
+    """(current, pickup, dropoff) as (name, (lat, lon)): start, 10% along, end."""
+    geometry = route["geometry"]
+    pick = geometry[len(geometry) // 10]
+    return (
+        ("Bench Start", tuple(geometry[0])),
+        ("Bench Pickup", tuple(pick)),
+        ("Bench Dropoff", tuple(geometry[-1])),
+    )
+
+
+def start_time():
+    return datetime(2025, 1, 6, 7, 0, tzinfo=timezone.get_current_timezone())
+
+
+# ---- Cases ----
+# Each case takes its params and returns (setup, run): setup() builds fresh state
+# outside the timer, run(state) is the timed part. Cases that need surrounding
+# state (a server, settings) add a third item: a factory for a context manager.
+
+
+def bench_route_geometry(vertices):
+    route = synthetic_route(vertices, 1)
+    return (
+        lambda: route,
+        lambda r: RouteGeometry(r["geometry"], r["distance_m"], r["duration_s"]),
+    )
+
+
+def bench_stop_placement(vertices):
+    """Fuel stops every 1000 miles plus snapping the pickup/dropoff onto the line."""
+    route = synthetic_route(vertices, 14)
+    _, pickup, dropoff = trip_waypoints(route)
+
+    def setup():
+        return RouteGeometry(route["geometry"], route["distance_m"], route["duration_s"])
+
+    def run(geom):
+        geom.points_every(FUEL_INTERVAL_M)
+        geom.nearest_index(*pickup[1])
+        geom.nearest_index(*dropoff[1])
+
+    return setup, run
+
+
+def bench_hos_simulation(vertices, days):
+    """The arrival-time walk: HOS limits, breaks, rests and fuel along the route."""
+    route = synthetic_route(vertices, days)
+    geom = RouteGeometry(route["geometry"], route["distance_m"], route["duration_s"])
+    current, pickup, dropoff = trip_waypoints(route)
+    geom.nearest_index(*pickup[1])  # build the grid outside the timer
+    return (
+        lambda: geom,
+        lambda g: simulate_trip(g, current, pickup, dropoff, start_time()),
+    )
+
+
+def bench_plan_trip(days):
+    route = synthetic_route(1000, days)
+    geom = RouteGeometry(route["geometry"], route["distance_m"], route["duration_s"])
+    stops = simulate_trip(geom, *trip_waypoints(route), start_time())
+    return lambda: stops, plan_trip
+
+
+@lru_cache(maxsize=None)
+def synthetic_road_graph(side):
+    """
+    In-memory RoadGraph for a side x side grid of two-way roads ROAD_GRID_STEP
+    apart: every tenth road a 105 km/h motorway, the rest 50 km/h.
+    """
+    lines = []
+    for i in range(side):
+        speed = (105 if i % 10 == 0 else 50) * road_graph.KPH
+        along = [ORIGIN[1] + j * ROAD_GRID_STEP for j in range(side)]
+        lines.append(([(ORIGIN[0] + i * ROAD_GRID_STEP, lon) for lon in along], speed, 0))
+        up = [ORIGIN[0] + j * ROAD_GRID_STEP for j in range(side)]
+        lines.append(([(lat, ORIGIN[1] + i * ROAD_GRID_STEP) for lat in up], speed, 0))
+    return road_graph.RoadGraph(*road_graph.build_graph(lines))
+
+
+def bench_local_route(side, span):
+    """
+    One A* leg on the synthetic road grid, from near a corner across `span`
+    percent of the diagonal, without the ROAD_GRAPH_MAX_SETTLED bound.
+    """
+    graph = synthetic_road_graph(side)
+    reach = (side - 1) * ROAD_GRID_STEP * span / 100
+    coords = [
+        (ORIGIN[0] + 0.3 * ROAD_GRID_STEP, ORIGIN[1] + 0.3 * ROAD_GRID_STEP),
+        (ORIGIN[0] + reach, ORIGIN[1] + reach),
+    ]
+    graph.route(coords)  # build the snap grid outside the timer
+    return lambda: coords, graph.route
+
+
+def bench_create_split_event(days):
+    start = start_time()
+    end = start + timedelta(days=days)
+    return (
+        lambda: None,
+        lambda _: create_split_event("driving", start, end, "Driving", 0),
+    )
+
+
+class MockMapbox:
+    """In-process mock_mapbox server holding fixtures for one synthetic trip."""
+
+    def __init__(self, route, latency_ms=0.0):
+        self.waypoints = trip_waypoints(route)
+        fixtures = {}
+        for name, (lat, lon) in self.waypoints:
+            path = geocoding._geocode_path(name)
+            response = {"features": [{"center": [lon, lat], "place_name": name}]}
+            fixtures[("geocoding", fixture_key(path, {"limit": 1}))] = _json_bytes(response)
+        coords = [latlon for _, latlon in self.waypoints]
+        path, params = routing._directions_request(coords)
+        response = {
+            "code": "Ok",
+            "routes": [
+                {
+                    "distance": route["distance_m"],
+                    "duration": route["duration_s"],
+                    "geometry": {
+                        "type": "LineString",
+                        "coordinates": [[lon, lat] for lat, lon in route["geometry"]],
+                    },
+                }
+            ],
+        }
+        fixtures[("directions", fixture_key(path, params))] = _json_bytes(response)
+        self.route_key = routing.route_cache_key(coords)
+        self.server = make_server(fixtures, latency_ms=latency_ms)
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+
+def _json_bytes(data):
+    return json.dumps(data).encode()
+
+
+def _clear_planner_caches(mock):
+    geocoding._memory_cache.clear()
+    routing._memory_cache.clear()
+    names = [geocoding.normalize_location(name) for name, _ in mock.waypoints]
+    GeocodeCache.objects.filter(query__in=names).delete()
+    RouteCache.objects.filter(key=mock.route_key).delete()
+
+
+_scratch_database = False
+
+
+@contextmanager
+def scratch_database():
+    """
+    Point the default connection at a freshly migrated test database for the
+    duration, the way the test runner does, and drop it afterwards.
+    """
+    global _scratch_database
+    old_name = connection.settings_dict["NAME"]
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    _scratch_database = True
+    try:
+        yield
+    finally:
+        _scratch_database = False
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def bench_plan_endpoint(vertices, days, cache):
+    """
+    POST /api/plan/ through the full stack against the in-process mock server.
+    cache="cold" clears the geocode/route caches before every call.
+    Trips created by the benchmark are deleted after each call. This writes to
+    the database, so it only runs inside scratch_database().
+    """
+    mock = MockMapbox(synthetic_route(vertices, days))
+    client = APIClient()
+    body = {
+        "current_location": "Bench Start",
+        "pickup_location": "Bench Pickup",
+        "dropoff_location": "Bench Dropoff",
+        "current_cycle_used": 0,
+    }
+    created = []
+
+    def setup():
+        if cache == "cold":
+            _clear_planner_caches(mock)
+        if created:
+            Trip.objects.filter(id__in=created).delete()
+            created.clear()
+
+    def run(_):
+        response = client.post("/api/plan/", body, format="json")
+        assert response.status_code == 201, (
+            f"plan failed: status={response.status_code} body={response.content[:500]!r}"
+        )
+        created.append(response.data["id"])
+        assert response.data["stops"], "plan returned no stops"
+
+    return setup, run, lambda: _EndpointContext(mock, setup)
+
+
+class _EndpointContext:
+    """
+    Mock server up, requests pointed at it, client rate limits off, and the
+    test client's "testserver" host allowed.
+    """
+
+    def __init__(self, mock, cleanup):
+        self.mock = mock
+        self.cleanup = cleanup
+
+    def __enter__(self):
+        if not _scratch_database:
+            raise RuntimeError("plan_endpoint benchmarks must run inside scratch_database()")
+        self.mock.__enter__()
+        self.settings = override_settings(
+            MAPBOX_BASE_URL=self.mock.base_url,
+            MAPBOX_RECORD_DIR=None,
+            ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"],
+        )
+        self.settings.enable()
+        for endpoint in ("geocoding", "directions"):
+            set_rate_limit(endpoint, None)
+        return self
+
+    def __exit__(self, *exc):
+        self.cleanup()
+        self.settings.disable()
+        for endpoint, rate in getattr(settings, "HTTP_RATE_LIMITS", {}).items():
+            set_rate_limit(endpoint, rate)
+        _clear_planner_caches(self.mock)
+        self.mock.__exit__(*exc)
+
+
+def cases(vertices, days):
+    """[(name, params, factory)] for every case over the vertices x days matrix."""
+    out = []
+    for v in vertices:
+        out.append(("route_geometry", {"vertices": v}, lambda v=v: bench_route_geometry(v)))
+        out.append(("stop_placement", {"vertices": v}, lambda v=v: bench_stop_placement(v)))
+        for d in days:
+            out.append(
+                (
+                    "hos_simulation",
+                    {"vertices": v, "days": d},
+                    lambda v=v, d=d: bench_hos_simulation(v, d),
+                )
+            )
+    for d in days:
+        out.append(("plan_trip", {"days": d}, lambda d=d: bench_plan_trip(d)))
+        out.append(("create_split_event", {"days": d}, lambda d=d: bench_create_split_event(d)))
+    for side in ROAD_GRID_SIDES:
+        for span in (20, 50, 90):
+            out.append(
+                (
+                    "local_route",
+                    {"nodes": side * side, "span": span},
+                    lambda side=side, span=span: bench_local_route(side, span),
+                )
+            )
+    for v in vertices:
+        for d in days:
+            for cache in ("warm", "cold"):
+                out.append(
+                    (
+                        "plan_endpoint",
+                        {"vertices": v, "days": d, "cache": cache},
+                        lambda v=v, d=d, c=cache: bench_plan_endpoint(v, d, c),
+                    )
+                )
+    return out
+
+
+# ---- Running and comparing ----
+
+
+def time_case(factory, repeat=5, warmup=1, min_time=0.0):
+    """
+    Run one case; returns timing stats in milliseconds. Repeats at least `repeat`
+    times, and keeps going until `min_time` seconds have been spent timing.
+    """
+    made = factory()
+    setup, run = made[:2]
+    context = made[2]() if len(made) > 2 else nullcontext()
+    with context:
+        for _ in range(warmup):
+            run(setup())
+        samples = []
+        spent = 0.0
+        while len(samples) < repeat or spent < min_time:
+            state = setup()
+            started = time.perf_counter()
+            run(state)
+            elapsed = time.perf_counter() - started
+            samples.append(elapsed * 1000)
+            spent += elapsed
+    return {
+        "runs": len(samples),
+        "min_ms": round(min(samples), 4),
+        "median_ms": round(statistics.median(samples), 4),
+        "mean_ms": round(statistics.fmean(samples), 4),
+        "stdev_ms": round(statistics.stdev(samples), 4) if len(samples) > 1 else 0.0,
+    }
+
+
+def case_id(name, params):
+    return name + "".join(f" {k}={v}" for k, v in params.items())
+
+
+def environment():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=settings.BASE_DIR,
+        ).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "timestamp": timezone.now().isoformat(),
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "platform": platform.platform(),
+        "database": settings.DATABASES["default"]["ENGINE"].rsplit(".", 1)[-1],
+    }
+
+
+def compare(baseline, current, threshold=0.10, noise_ms=0.05):
+    """
+    Match results by case id and flag any whose median grew by more than
+    `threshold` (fractional) and by more than `noise_ms`.
+    Returns [{"case", "baseline_ms", "current_ms", "change", "regressed"}, ...].
+    """
+    before = {r["case"]: r for r in baseline["results"]}
+    rows = []
+    for result in current["results"]:
+        old = before.get(result["case"])
+        if old is None:
+            continue
+        old_ms, new_ms = old["median_ms"], result["median_ms"]
+        change = (new_ms - old_ms) / old_ms if old_ms else 0.0
+        rows.append(
+            {
+                "case": result["case"],
+                "baseline_ms": old_ms,
+                "current_ms": new_ms,
+                "change": round(change, 4),
+                "regressed": change > threshold and new_ms - old_ms > noise_ms,
+            }
+        )
+    return rows
@@ -0,0 +1,8 @@
+"""Choices shared by the models and the in-memory planner (services.event_planning)."""
+
+EVENT_STATUSES = [
+    ("driving", "Driving"),
+    ("on_duty", "On Duty (not driving)"),
+    ("off_duty", "Off Duty"),
+    ("sleeper", "Sleeper Berth"),
+]
@@ -0,0 +1,86 @@
+import json
+from contextlib import nullcontext
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from planner.benchmarks import (
+    case_id,
+    cases,
+    compare,
+    environment,
+    scratch_database,
+    time_case,
+)
+
+
+def int_list(value):
+    return [int(v) for v in value.split(",") if v]
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the trip planner on synthetic routes and save the timings as JSON. "
+        "With --compare, flag cases whose median got slower than a saved run. "
+        "The plan_endpoint cases run against a scratch test database, created and "
+        "dropped around the run, never the configured one."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--vertices", type=int_list, default=[100, 1000, 10000, 100000])
+        parser.add_argument("--days", type=int_list, default=[1, 3, 7, 14])
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument(
+            "--min-time", type=float, default=0.2, help="seconds to spend timing each case"
+        )
+        parser.add_argument("--only", action="append", help="run cases whose id contains this")
+        parser.add_argument("--skip-endpoint", action="store_true", help="skip plan_endpoint")
+        parser.add_argument("--out", help="write results JSON here")
+        parser.add_argument("--compare", help="results JSON from an earlier run")
+        parser.add_argument(
+            "--threshold", type=float, default=0.10, help="fractional slowdown that counts"
+        )
+
+    def handle(self, *args, **options):
+        selected = []
+        for name, params, factory in cases(options["vertices"], options["days"]):
+            cid = case_id(name, params)
+            if options["only"] and not any(part in cid for part in options["only"]):
+                continue
+            if options["skip_endpoint"] and name == "plan_endpoint":
+                continue
+            selected.append((cid, name, params, factory))
+        if not selected:
+            raise CommandError("No benchmark cases selected")
+
+        needs_db = any(name == "plan_endpoint" for _, name, _, _ in selected)
+        results = []
+        with scratch_database() if needs_db else nullcontext():
+            for cid, name, params, factory in selected:
+                timing = time_case(
+                    factory, repeat=options["repeat"], min_time=options["min_time"]
+                )
+                results.append({"case": cid, "name": name, "params": params, **timing})
+                self.stdout.write(
+                    f"{cid:50} median {timing['median_ms']:>11.3f} ms  "
+                    f"min {timing['min_ms']:>11.3f} ms  ({timing['runs']} runs)"
+                )
+
+        report = {"environment": environment(), "results": results}
+        if options["out"]:
+            Path(options["out"]).write_text(json.dumps(report, indent=2))
+            self.stdout.write(f"Wrote {options['out']}")
+
+        if options["compare"]:
+            baseline = json.loads(Path(options["compare"]).read_text())
+            rows = compare(baseline, report, threshold=options["threshold"])
+            self.stdout.write(f"\nCompared with {options['compare']}:")
+            for row in rows:
+                flag = "REGRESSED" if row["regressed"] else ""
+                self.stdout.write(
+                    f"{row['case']:50} {row['baseline_ms']:>11.3f} -> {row['current_ms']:>11.3f} ms"
+                    f"  {row['change']:+7.1%}  {flag}"
+                )
+            regressed = [row["case"] for row in rows if row["regressed"]]
+            if regressed:
+                raise CommandError(f"{len(regressed)} case(s) regressed")
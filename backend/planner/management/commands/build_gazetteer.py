@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from planner.services.gazetteer import build_gazetteer, rows_from_file, write_gazetteer
+
+
+class Command(BaseCommand):
+    help = (
+        "Index a US places gazetteer (the Census Gazetteer places file, or a CSV with "
+        "name,state,lat,lon[,population]) for offline geocoding and autocomplete."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("places_file")
+        parser.add_argument("out", help="index file to write; point GAZETTEER_PATH at it")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            arrays, meta = build_gazetteer(rows_from_file(options["places_file"]))
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+        if not meta["places"]:
+            raise CommandError("No US places in input")
+
+        meta["source"] = options["places_file"]
+        write_gazetteer(options["out"], arrays, meta)
+        self.stdout.write(
+            f"Wrote {options['out']}: {meta['places']} places, {meta['keys']} keys "
+            f"in {time.perf_counter() - started:.1f}s"
+        )
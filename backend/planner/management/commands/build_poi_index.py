@@ -0,0 +1,42 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from planner.services.poi_index import (
+    DEFAULT_CELL_DEG,
+    build_poi_index,
+    rows_from_file,
+    write_poi_index,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Index truck stops and rest areas (OSM GeoJSON, or a CSV with "
+        "name,lat,lon,kind[,city,state]) for snapping planned stops to them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("poi_file")
+        parser.add_argument("out", help="index file to write; point POI_INDEX_PATH at it")
+        parser.add_argument(
+            "--cell-deg", type=float, default=DEFAULT_CELL_DEG, help="grid cell size in degrees"
+        )
+
+    def handle(self, *args, **options):
+        if options["cell_deg"] <= 0:
+            raise CommandError("--cell-deg must be positive")
+        started = time.perf_counter()
+        try:
+            arrays, meta = build_poi_index(rows_from_file(options["poi_file"]), options["cell_deg"])
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+        if not meta["pois"]:
+            raise CommandError("No truck stops or rest areas in input")
+
+        meta["source"] = options["poi_file"]
+        write_poi_index(options["out"], arrays, meta)
+        self.stdout.write(
+            f"Wrote {options['out']}: {meta['pois']} POIs in {len(arrays['cell_keys'])} cells "
+            f"in {time.perf_counter() - started:.1f}s"
+        )
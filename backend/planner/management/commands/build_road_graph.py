@@ -0,0 +1,50 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from planner.services.road_graph import (
+    DEFAULT_SPEED_KPH,
+    build_graph,
+    lines_from_geojson,
+    write_graph,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Preprocess a GeoJSON road network (LineStrings with optional highway, maxspeed "
+        "and oneway properties) into a road graph file for the local routing backend."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("geojson")
+        parser.add_argument("out", help="graph file to write; point ROAD_GRAPH_PATH at it")
+        parser.add_argument(
+            "--precision",
+            type=int,
+            default=6,
+            help="decimal places at which coordinates are considered the same junction",
+        )
+        parser.add_argument(
+            "--default-speed-kph",
+            type=float,
+            default=DEFAULT_SPEED_KPH,
+            help="speed for roads with no maxspeed and an unknown highway class",
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        with open(options["geojson"]) as f:
+            data = json.load(f)
+        lines = list(lines_from_geojson(data, options["default_speed_kph"]))
+        if not lines:
+            raise CommandError("No LineString features in input")
+
+        arrays, meta = build_graph(lines, precision=options["precision"])
+        meta["source"] = options["geojson"]
+        write_graph(options["out"], arrays, meta)
+        self.stdout.write(
+            f"Wrote {options['out']}: {meta['nodes']} nodes, {meta['edges']} edges "
+            f"from {len(lines)} lines in {time.perf_counter() - started:.1f}s"
+        )
@@ -0,0 +1,54 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from planner.services.mock_mapbox import load_fixtures, make_server
+
+
+class Command(BaseCommand):
+    help = (
+        "Serve recorded Mapbox geocoding/directions fixtures on a local port, with "
+        "injected latency, as a stand-in for api.mapbox.com (set MAPBOX_BASE_URL to it)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--fixtures", default=getattr(settings, "MAPBOX_RECORD_DIR", None))
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8765)
+        parser.add_argument("--latency-ms", type=float, default=0.0, help="added to every response")
+        parser.add_argument("--jitter-ms", type=float, default=0.0, help="uniform +/- jitter")
+        parser.add_argument(
+            "--error-rate", type=float, default=0.0, help="fraction of requests answered 503"
+        )
+        parser.add_argument(
+            "--synthesize",
+            action="store_true",
+            help="answer requests without a fixture with deterministic synthetic data",
+        )
+        parser.add_argument("--seed", type=int, default=0, help="seed for latency jitter and errors")
+
+    def handle(self, *args, **options):
+        fixtures = load_fixtures(options["fixtures"]) if options["fixtures"] else {}
+        if not fixtures and not options["synthesize"]:
+            raise CommandError("No fixtures found; pass --fixtures DIR or --synthesize")
+
+        server = make_server(
+            fixtures,
+            host=options["host"],
+            port=options["port"],
+            latency_ms=options["latency_ms"],
+            jitter_ms=options["jitter_ms"],
+            error_rate=options["error_rate"],
+            synthesize=options["synthesize"],
+            seed=options["seed"],
+        )
+        self.stdout.write(
+            f"Mock Mapbox on http://{options['host']}:{server.server_port} "
+            f"({len(fixtures)} fixtures, synthesize={options['synthesize']})"
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(f"Served: {server.stats}")
@@ -0,0 +1,41 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from planner.services import geocoding, routing
+from planner.services.trip_planning import LOCATION_FIELDS
+
+
+class Command(BaseCommand):
+    help = (
+        "Call the live Mapbox API for each trip in a JSON file ({\"trips\": [...]}, as "
+        "for /api/plan/batch/) and save the responses as fixtures for mock_mapbox."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("trips_file")
+        parser.add_argument("--out", required=True, help="fixture directory")
+
+    def handle(self, *args, **options):
+        with open(options["trips_file"]) as f:
+            trips = json.load(f)
+        trips = trips.get("trips", []) if isinstance(trips, dict) else trips
+        if not trips:
+            raise CommandError("No trips in file")
+
+        out = options["out"]
+        recorded = 0
+        # Call the fetchers directly so cached locations/routes are still recorded
+        for trip in trips:
+            coords = [
+                geocoding._fetch_geocode(trip[field], record_dir=out) for field in LOCATION_FIELDS
+            ]
+            missing = sum(1 for lat, lon in coords if lat is None)
+            recorded += len(coords) - missing
+            if missing:
+                self.stderr.write(f"Skipping route, could not geocode: {trip}")
+                continue
+            if routing._route_mapbox(coords, record_dir=out) is not None:
+                recorded += 1
+
+        self.stdout.write(f"Recorded {recorded} responses to {options['out']}")
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from planner.services.plan_jobs import run_workers
+
+
+class Command(BaseCommand):
+    help = "Run queued plan jobs (POST /api/plan/jobs/). Scale by running more of these."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency", type=int, default=4, help="jobs run at once by this process"
+        )
+        parser.add_argument(
+            "--poll-interval", type=float, default=1.0, help="seconds between idle polls"
+        )
+        parser.add_argument("--burst", action="store_true", help="exit once no job is runnable")
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Plan worker started with {options['concurrency']} threads")
+        run_workers(
+            concurrency=max(options["concurrency"], 1),
+            poll_interval=options["poll_interval"],
+            burst=options["burst"],
+        )
@@ -0,0 +1,57 @@
+import time
+
+from asgiref.sync import iscoroutinefunction
+from django.utils.decorators import sync_and_async_middleware
+
+from .services.instrumentation import (
+    REQUEST_SECONDS,
+    finish_request,
+    server_timing_header,
+    start_request,
+)
+
+
+def _finish(request, response, timings, started):
+    total_s = time.perf_counter() - started
+    match = getattr(request, "resolver_match", None)
+    REQUEST_SECONDS.observe(
+        total_s,
+        view=match.url_name if match and match.url_name else "unmatched",
+        method=request.method,
+        status=response.status_code,
+    )
+    response["Server-Timing"] = server_timing_header(timings, total_s)
+    # Lets the cross-origin frontend read the header through the Resource Timing API
+    response["Timing-Allow-Origin"] = "*"
+    return response
+
+
+@sync_and_async_middleware
+def server_timing_middleware(get_response):
+    """
+    Collects the instrumentation spans recorded while handling a request and
+    returns them as a Server-Timing header; also feeds the request histogram.
+    """
+    if iscoroutinefunction(get_response):
+
+        async def middleware(request):
+            token = start_request()
+            started = time.perf_counter()
+            try:
+                response = await get_response(request)
+            finally:
+                timings = finish_request(token)
+            return _finish(request, response, timings, started)
+
+    else:
+
+        def middleware(request):
+            token = start_request()
+            started = time.perf_counter()
+            try:
+                response = get_response(request)
+            finally:
+                timings = finish_request(token)
+            return _finish(request, response, timings, started)
+
+    return middleware
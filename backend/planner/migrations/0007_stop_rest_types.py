@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 09:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('planner', '0006_routecache'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='stop',
+            name='type',
+            field=models.CharField(choices=[('pickup', 'Pickup'), ('dropoff', 'Dropoff'), ('fuel', 'Fuel'), ('break', 'Break'), ('rest', '10-hour Rest'), ('restart', '34-hour Restart')], max_length=50),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.6 on 2026-10-18 09:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('planner', '0007_stop_rest_types'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trip',
+            name='route_distance_m',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='route_duration_s',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='route_geometry',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
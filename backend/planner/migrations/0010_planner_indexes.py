@@ -0,0 +1,46 @@
+# Generated by Django 5.2.6 on 2026-10-18 10:15
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def dedupe_logsheets(apps, schema_editor):
+    """Keep only the newest sheet per (trip, date) so the unique constraint can be added."""
+    LogSheet = apps.get_model("planner", "LogSheet")
+    keep = (
+        LogSheet.objects.values("trip_id", "date")
+        .annotate(keep_id=Max("id"))
+        .values_list("keep_id", flat=True)
+    )
+    LogSheet.objects.exclude(id__in=list(keep)).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('planner', '0009_trip_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['trip', 'order_index'], name='event_trip_order_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['trip', 'start_time'], name='event_trip_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stop',
+            index=models.Index(fields=['trip', 'order_index'], name='stop_trip_order_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='trip',
+            index=models.Index(fields=['-created_at', '-id'], name='trip_created_idx'),
+        ),
+        migrations.RunPython(dedupe_logsheets, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='logsheet',
+            constraint=models.UniqueConstraint(fields=('trip', 'date'), name='logsheet_trip_date_uniq'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 10:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('planner', '0011_plan_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stop',
+            name='added',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.6 on 2026-10-18 10:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('planner', '0012_stop_added'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlanRequest',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('fingerprint', models.CharField(max_length=64)),
+                ('expires_at', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('trip', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='planner.trip')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['expires_at'], name='planrequest_expiry_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 10:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('planner', '0013_plan_request'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='trip',
+            name='current_cycle_used',
+            field=models.FloatField(),
+        ),
+    ]
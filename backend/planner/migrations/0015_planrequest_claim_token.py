@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 10:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('planner', '0014_trip_cycle_used_float'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='planrequest',
+            name='claim_token',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+    ]
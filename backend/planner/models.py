@@ -1,13 +1,28 @@
 from django.db import models
+from django.utils import timezone
+
+from .constants import EVENT_STATUSES
 
 
 class Trip(models.Model):
     current_location = models.CharField(max_length=255)
     pickup_location = models.CharField(max_length=255)
     dropoff_location = models.CharField(max_length=255)
-    current_cycle_used = models.IntegerField()
+    current_cycle_used = models.FloatField()  # hours
+
+    # Route as planned, so a trip can be redrawn without calling Mapbox again
+    route_geometry = models.BinaryField(null=True, blank=True)  # services.codec.pack_geometry
+    route_distance_m = models.FloatField(null=True, blank=True)
+    route_duration_s = models.FloatField(null=True, blank=True)
 
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)  # bumps trip ETags / cached responses
+
+    class Meta:
+        indexes = [
+            # Trip list ordering / cursor seeks, and created_at range filters
+            models.Index(fields=["-created_at", "-id"], name="trip_created_idx"),
+        ]
 
     def __str__(self):
         return f"Trip {self.id}: {self.current_location} → {self.dropoff_location}"
@@ -19,6 +34,8 @@ class Stop(models.Model):
         ("dropoff", "Dropoff"),
         ("fuel", "Fuel"),
         ("break", "Break"),
+        ("rest", "10-hour Rest"),
+        ("restart", "34-hour Restart"),
     ]
 
     trip = models.ForeignKey(Trip, on_delete=models.CASCADE, related_name="stops")
@@ -29,18 +46,17 @@ class Stop(models.Model):
     order_index = models.IntegerField()
     lat = models.FloatField(null=True, blank=True)
     lon = models.FloatField(null=True, blank=True)
+    added = models.BooleanField(default=False)  # added by a replan; only these can be removed
+
+    class Meta:
+        indexes = [models.Index(fields=["trip", "order_index"], name="stop_trip_order_idx")]
 
     def __str__(self):
         return f"{self.type.title()} stop at {self.location}"
 
 
 class Event(models.Model):
-    EVENT_STATUSES = [
-        ("driving", "Driving"),
-        ("on_duty", "On Duty (not driving)"),
-        ("off_duty", "Off Duty"),
-        ("sleeper", "Sleeper Berth"),
-    ]
+    EVENT_STATUSES = EVENT_STATUSES  # shared with the in-memory planner
 
     trip = models.ForeignKey(Trip, on_delete=models.CASCADE, related_name="events")
     status = models.CharField(max_length=50, choices=EVENT_STATUSES)
@@ -50,6 +66,12 @@ class Event(models.Model):
     note = models.CharField(max_length=255, null=True, blank=True)
     order_index = models.IntegerField()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["trip", "order_index"], name="event_trip_order_idx"),
+            models.Index(fields=["trip", "start_time"], name="event_trip_start_idx"),
+        ]
+
     def __str__(self):
         return f"{self.status} ({self.start_time} → {self.end_time})"
 
@@ -59,5 +81,99 @@ class LogSheet(models.Model):
     date = models.DateField()
     sheet_json = models.JSONField()  # store daily events in JSON
 
+    class Meta:
+        constraints = [
+            # One sheet per trip per day; also the upsert target in services.persistence
+            models.UniqueConstraint(fields=["trip", "date"], name="logsheet_trip_date_uniq"),
+        ]
+
     def __str__(self):
         return f"LogSheet {self.date} for Trip {self.trip.id}"
+
+
+class GeocodeCache(models.Model):
+    query = models.CharField(max_length=255, unique=True)  # normalized location text
+    lat = models.FloatField()
+    lon = models.FloatField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.query} → ({self.lat}, {self.lon})"
+
+
+class RouteCache(models.Model):
+    key = models.CharField(max_length=512, unique=True)  # quantized waypoint tuple
+    distance_m = models.FloatField()
+    duration_s = models.FloatField()
+    geometry = models.BinaryField()  # packed via services.codec.pack_geometry
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Route {self.key}"
+
+
+class PlanJob(models.Model):
+    """A queued POST /api/plan/jobs/ request, run by `manage.py run_plan_worker`."""
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    STATUSES = [
+        (QUEUED, "Queued"),
+        (RUNNING, "Running"),
+        (SUCCEEDED, "Succeeded"),
+        (FAILED, "Failed"),
+    ]
+
+    status = models.CharField(max_length=16, choices=STATUSES, default=QUEUED)
+    trip_input = models.JSONField()  # as returned by parse_trip_input
+    geometry_options = models.JSONField(default=dict)  # for rendering the result
+    trip = models.ForeignKey(
+        Trip, on_delete=models.SET_NULL, null=True, blank=True, related_name="+"
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    error = models.TextField(blank=True, default="")
+
+    # Claiming: a worker sets lease_token and holds the job until lease_expires_at;
+    # after that another worker may take it over
+    run_after = models.DateTimeField(default=timezone.now)
+    lease_token = models.CharField(max_length=32, blank=True, default="")
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Workers polling for the next runnable job
+            models.Index(fields=["status", "run_after"], name="planjob_claim_idx"),
+        ]
+
+    def __str__(self):
+        return f"PlanJob {self.id} ({self.status})"
+
+
+class PlanRequest(models.Model):
+    """
+    A recent plan request, by Idempotency-Key or input hash, and the trip it
+    produced; lets repeats and concurrent duplicates share one plan (services.dedupe).
+    """
+
+    key = models.CharField(max_length=64, unique=True)
+    fingerprint = models.CharField(max_length=64)  # hash of the normalized trip input
+    claim_token = models.CharField(max_length=32, blank=True, default="")  # of the planner
+    trip = models.ForeignKey(
+        Trip, on_delete=models.CASCADE, null=True, blank=True, related_name="+"
+    )  # null while the plan is in flight
+    # End of the planning request's lease while in flight, then of the dedupe window
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["expires_at"], name="planrequest_expiry_idx")]
+
+    def __str__(self):
+        return f"PlanRequest {self.key[:12]} → {self.trip_id}"
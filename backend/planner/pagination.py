@@ -0,0 +1,14 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class TripCursorPagination(CursorPagination):
+    """
+    Newest trips first. Cursors seek on created_at instead of counting an
+    OFFSET, so deep pages cost the same as the first one.
+    """
+
+    ordering = ("-created_at", "-id")
+    page_size = getattr(settings, "TRIPS_PAGE_SIZE", 50)
+    page_size_query_param = "page_size"
+    max_page_size = 200
@@ -15,6 +15,7 @@ class StopSerializer(serializers.ModelSerializer):
             "order_index",
             "lat",
             "lon",
+            "added",
         ]
 
 
@@ -61,3 +62,21 @@ class TripSerializer(serializers.ModelSerializer):
             "events",
             "logsheets",
         ]
+
+
+class TripSummarySerializer(serializers.ModelSerializer):
+    """Trip row without nested stops/sheets, for list endpoints."""
+
+    class Meta:
+        model = Trip
+        fields = [
+            "id",
+            "current_location",
+            "pickup_location",
+            "dropoff_location",
+            "current_cycle_used",
+            "route_distance_m",
+            "route_duration_s",
+            "created_at",
+            "updated_at",
+        ]
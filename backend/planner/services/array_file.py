@@ -0,0 +1,85 @@
+"""
+Read-only numpy array bundles stored as one memory-mappable file.
+
+Layout: an 8-byte magic string, an 8-byte little-endian header length, a JSON
+header ({"meta": ..., "arrays": {name: {dtype, shape, offset}}}), then each
+array at a 64-byte aligned offset from the end of the header. Readers map the
+file, so every worker process shares the same pages and opening costs nothing
+beyond reading the header.
+"""
+
+import json
+import os
+import threading
+
+import numpy as np
+
+ALIGN = 64
+
+
+def _align(n):
+    return -(-n // ALIGN) * ALIGN
+
+
+def write_arrays(path, magic, arrays, meta):
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        layout[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset = _align(offset + array.nbytes)
+    header = json.dumps({"meta": meta, "arrays": layout}).encode()
+    data_start = _align(len(magic) + 8 + len(header))
+
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(magic + len(header).to_bytes(8, "little") + header)
+        for name, array in arrays.items():
+            f.seek(data_start + layout[name]["offset"])
+            f.write(array.tobytes())
+        f.truncate(data_start + offset)
+    # Rename so processes that already mapped the old file keep a consistent view
+    os.replace(tmp, path)
+
+
+def read_arrays(path, magic):
+    """({name: read-only array view}, meta); ValueError if the magic doesn't match."""
+    mm = np.memmap(path, dtype=np.uint8, mode="r")
+    if bytes(mm[: len(magic)]) != magic:
+        raise ValueError(f"{path} is not a {magic.decode().strip()} file")
+    header_start = len(magic) + 8
+    header_len = int.from_bytes(bytes(mm[len(magic) : header_start]), "little")
+    header = json.loads(bytes(mm[header_start : header_start + header_len]))
+    data_start = _align(header_start + header_len)
+    arrays = {}
+    for name, spec in header["arrays"].items():
+        dtype = np.dtype(spec["dtype"])
+        count = int(np.prod(spec["shape"]))
+        start = data_start + spec["offset"]
+        arrays[name] = mm[start : start + count * dtype.itemsize].view(dtype).reshape(spec["shape"])
+    return arrays, header["meta"]
+
+
+def pack_strings(strings):
+    """(uint8 array of the UTF-8 strings back to back, int64 offsets of length n + 1)."""
+    encoded = [s.encode() for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+_opened = {}
+_opened_lock = threading.Lock()
+
+
+def open_cached(path, opener):
+    """
+    opener(path), called once per process per version of the file: replacing the
+    file (as write_arrays does) is picked up on the next call.
+    """
+    stamp = os.stat(path).st_mtime_ns
+    with _opened_lock:
+        cached = _opened.get((opener, path))
+        if cached is None or cached[0] != stamp:
+            cached = _opened[(opener, path)] = (stamp, opener(path))
+    return cached[1]
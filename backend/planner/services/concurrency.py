@@ -0,0 +1,39 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from django.conf import settings
+
+# Shared, bounded pool for outbound I/O (Mapbox calls). Bounded so a burst of plan
+# requests can't open an unbounded number of upstream connections.
+_io_pool = ThreadPoolExecutor(
+    max_workers=getattr(settings, "PLANNER_IO_WORKERS", 8),
+    thread_name_prefix="planner-io",
+)
+
+
+def io_pool():
+    return _io_pool
+
+
+def remaining(deadline, cap=None):
+    """Seconds left until a time.monotonic() deadline, optionally capped."""
+    left = max(deadline - time.monotonic(), 0)
+    return left if cap is None else min(left, cap)
+
+
+def map_with_deadline(fn, items, deadline, default=None):
+    """
+    Run fn(item) for every item on the I/O pool and collect results in order.
+    Items that raise or are still running at the deadline yield `default`.
+    """
+    futures = [_io_pool.submit(fn, item) for item in items]
+    wait(futures, timeout=remaining(deadline))
+
+    results = []
+    for future in futures:
+        if future.done() and future.exception() is None:
+            results.append(future.result())
+        else:
+            future.cancel()
+            results.append(default)
+    return results
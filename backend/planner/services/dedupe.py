@@ -0,0 +1,326 @@
+"""
+Deduplication of plan requests. A request's key is its Idempotency-Key header;
+with PLAN_DEDUPE_INPUTS on, requests without one are keyed by a hash of their
+normalized input, so identical inputs from different clients share a trip. One
+PlanRequest row per key, unique in the database and so shared by every web
+process, records the trip planned for it:
+
+- a repeat within PLAN_DEDUPE_WINDOW seconds gets that trip back instead of
+  planning and saving a new one, and
+- a request arriving while the same plan is in flight waits for it instead of
+  geocoding and routing again (single flight).
+
+The first request claims the row before planning, under a lease of
+PLAN_REQUEST_TIMEOUT plus LEASE_MARGIN seconds and a claim token; only the
+token holder can record or release the result. If it dies, the lease runs out
+and the next request for the key plans afresh under a new token. A waiting
+request spends at most WAIT_SHARE of its timeout waiting and plans with what is
+left, so it finishes within its own timeout and the leader's lease. Trips whose
+locations couldn't be resolved aren't remembered, so a retry tries again.
+"""
+
+import asyncio
+import hashlib
+import logging
+import time
+import uuid
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from planner.models import PlanRequest, Trip
+
+from .concurrency import remaining
+from .geocoding import normalize_location
+from .persistence import with_plan
+from .trip_planning import (
+    LOCATION_FIELDS,
+    PlanInputError,
+    plan_single_trip,
+    plan_single_trip_async,
+    saved_trip_events,
+    stream_single_trip,
+)
+
+logger = logging.getLogger(__name__)
+
+PLAN_DEDUPE_WINDOW = getattr(settings, "PLAN_DEDUPE_WINDOW", 300)  # seconds; 0 disables
+PLAN_DEDUPE_INPUTS = getattr(settings, "PLAN_DEDUPE_INPUTS", False)
+LEASE_MARGIN = 30  # seconds past PLAN_REQUEST_TIMEOUT for planning and saving
+POLL_INTERVAL = 0.05  # seconds before the first re-check on a plan in flight
+MAX_POLL_INTERVAL = 0.5  # re-checks back off, doubling up to this
+WAIT_SHARE = 0.5  # of the request timeout spent waiting before planning alongside
+MAX_IDEMPOTENCY_KEY_LENGTH = 255
+
+# claim() outcomes
+DONE = "done"
+LEAD = "lead"
+WAIT = "wait"
+
+_stats = {"planned": 0, "replayed": 0, "coalesced": 0}
+
+
+class IdempotencyConflict(Exception):
+    """An Idempotency-Key was reused within the window for a different trip input."""
+
+
+def dedupe_stats():
+    return dict(_stats)
+
+
+def enabled():
+    return PLAN_DEDUPE_WINDOW > 0
+
+
+def _digest(*parts):
+    return hashlib.sha256("\x1f".join(parts).encode()).hexdigest()
+
+
+def request_key(trip_input, idempotency_key=None):
+    """
+    (key, fingerprint) for a parsed trip input. The fingerprint hashes the input
+    as geocoding sees it; without an Idempotency-Key it is also the key, so
+    identical inputs share one plan. The key is None when the request isn't
+    deduplicated: no Idempotency-Key and PLAN_DEDUPE_INPUTS off.
+    """
+    if idempotency_key is not None and not 0 < len(idempotency_key) <= MAX_IDEMPOTENCY_KEY_LENGTH:
+        raise PlanInputError(
+            f"Idempotency-Key must be 1 to {MAX_IDEMPOTENCY_KEY_LENGTH} characters"
+        )
+    fingerprint = _digest(
+        "input",
+        *(normalize_location(trip_input[field]) for field in LOCATION_FIELDS),
+        repr(float(trip_input["current_cycle_used"])),
+    )
+    if idempotency_key:
+        return _digest("key", idempotency_key), fingerprint
+    return (fingerprint if PLAN_DEDUPE_INPUTS else None), fingerprint
+
+
+def _lease():
+    lease = getattr(settings, "PLAN_REQUEST_TIMEOUT", 20) + LEASE_MARGIN
+    return timezone.now() + timedelta(seconds=lease)
+
+
+def claim(key, fingerprint):
+    """
+    Look up `key` and claim it if free. Returns (DONE, trip_id) if a trip was
+    planned for it within the window, (LEAD, token) if this request now holds it
+    under claim token `token` and should plan, or (WAIT, None) while another
+    request is planning it.
+    Raises IdempotencyConflict if the key is held for a different input.
+    """
+    for _ in range(3):  # retried when another request changes the row under us
+        now = timezone.now()
+        fields = ("fingerprint", "trip_id", "expires_at")
+        row = PlanRequest.objects.filter(key=key).values_list(*fields).first()
+        token = uuid.uuid4().hex
+        if row is None:
+            try:
+                with transaction.atomic():
+                    PlanRequest.objects.create(
+                        key=key, fingerprint=fingerprint, claim_token=token, expires_at=_lease()
+                    )
+            except IntegrityError:
+                continue
+            # Misses are the slow path anyway; clear out rows nobody can use
+            PlanRequest.objects.filter(expires_at__lt=now).delete()
+            return LEAD, token
+
+        held_fingerprint, trip_id, expires_at = row
+        if expires_at > now:
+            if held_fingerprint != fingerprint:
+                raise IdempotencyConflict()
+            return (DONE, trip_id) if trip_id is not None else (WAIT, None)
+        # The window has passed or the planning request died: take the key over
+        taken = PlanRequest.objects.filter(key=key, expires_at=expires_at).update(
+            fingerprint=fingerprint, trip=None, claim_token=token, expires_at=_lease()
+        )
+        if taken:
+            return LEAD, token
+    return WAIT, None
+
+
+def peek(key, fingerprint):
+    """
+    The id of the trip planned for `key` within the window, or None; claims
+    nothing. Raises IdempotencyConflict as claim() does.
+    """
+    row = (
+        PlanRequest.objects.filter(key=key, expires_at__gt=timezone.now())
+        .values_list("fingerprint", "trip_id")
+        .first()
+    )
+    if row is None:
+        return None
+    if row[0] != fingerprint:
+        raise IdempotencyConflict()
+    return row[1]
+
+
+def _settled(state, value, waited):
+    if state == DONE:
+        _stats["coalesced" if waited else "replayed"] += 1
+        return value, None
+    _stats["planned"] += 1
+    return None, value if state == LEAD else None
+
+
+def acquire(key, fingerprint, timeout):
+    """
+    Wait up to `timeout` seconds for `key`, re-checking at intervals that
+    double from POLL_INTERVAL up to MAX_POLL_INTERVAL. Returns (trip_id, None) with the
+    trip planned for it, or (None, token) once this request should plan it
+    itself; it must then call finish() or abandon() with the token. The token is
+    None if the wait timed out and this request plans without holding the key.
+    """
+    deadline = time.monotonic() + timeout
+    waited = False
+    interval = POLL_INTERVAL
+    state, value = claim(key, fingerprint)
+    while state == WAIT and time.monotonic() < deadline:
+        waited = True
+        time.sleep(remaining(deadline, cap=interval))
+        interval = min(interval * 2, MAX_POLL_INTERVAL)
+        state, value = claim(key, fingerprint)
+    if state == WAIT:
+        logger.warning("plan dedupe wait timed out key=%s; planning alongside", key[:12])
+    return _settled(state, value, waited)
+
+
+async def acquire_async(key, fingerprint, timeout):
+    """acquire() for the async view; waits on the event loop, not in a thread."""
+    deadline = time.monotonic() + timeout
+    waited = False
+    interval = POLL_INTERVAL
+    state, value = await sync_to_async(claim)(key, fingerprint)
+    while state == WAIT and time.monotonic() < deadline:
+        waited = True
+        await asyncio.sleep(remaining(deadline, cap=interval))
+        interval = min(interval * 2, MAX_POLL_INTERVAL)
+        state, value = await sync_to_async(claim)(key, fingerprint)
+    if state == WAIT:
+        logger.warning("plan dedupe wait timed out key=%s; planning alongside", key[:12])
+    return _settled(state, value, waited)
+
+
+def _claimed(key, token):
+    if token is None:
+        return PlanRequest.objects.none()
+    return PlanRequest.objects.filter(key=key, claim_token=token, trip__isnull=True)
+
+
+def finish(key, token, trip_id):
+    """Record the trip planned under a claim; repeats get it for the window."""
+    _claimed(key, token).update(
+        trip_id=trip_id, expires_at=timezone.now() + timedelta(seconds=PLAN_DEDUPE_WINDOW)
+    )
+
+
+def abandon(key, token):
+    """Release a claim without a result; waiting requests then plan it."""
+    _claimed(key, token).delete()
+
+
+def _saved_trip(trip_id):
+    if trip_id is None:
+        return None
+    return with_plan(Trip.objects).filter(pk=trip_id).first()
+
+
+def plan_once(trip_input, timeout, idempotency_key=None):
+    """
+    plan_single_trip, deduplicated. Returns (trip, route, replayed); a replayed
+    trip was planned by an earlier or concurrent identical request, comes with
+    its plan prefetched, and has route None (the stored one applies).
+    """
+    key, fingerprint = request_key(trip_input, idempotency_key)
+    if key is None or not enabled():
+        return (*plan_single_trip(trip_input, timeout), False)
+    deadline = time.monotonic() + timeout
+    trip_id, token = acquire(key, fingerprint, timeout * WAIT_SHARE)
+    trip = _saved_trip(trip_id)
+    if trip is not None:
+        return trip, None, True
+    try:
+        trip, route = plan_single_trip(trip_input, remaining(deadline))
+    except BaseException:
+        abandon(key, token)
+        raise
+    if route:
+        finish(key, token, trip.id)
+    else:
+        abandon(key, token)
+    return trip, route, False
+
+
+async def plan_once_async(trip_input, timeout, idempotency_key=None):
+    """plan_single_trip_async, deduplicated as plan_once."""
+    key, fingerprint = request_key(trip_input, idempotency_key)
+    if key is None or not enabled():
+        return (*await plan_single_trip_async(trip_input, timeout), False)
+    deadline = time.monotonic() + timeout
+    trip_id, token = await acquire_async(key, fingerprint, timeout * WAIT_SHARE)
+    trip = await sync_to_async(_saved_trip)(trip_id)
+    if trip is not None:
+        return trip, None, True
+    try:
+        trip, route = await plan_single_trip_async(trip_input, remaining(deadline))
+    except BaseException:
+        await sync_to_async(abandon)(key, token)
+        raise
+    if route:
+        await sync_to_async(finish)(key, token, trip.id)
+    else:
+        await sync_to_async(abandon)(key, token)
+    return trip, route, False
+
+
+def _settle_after(key, token, events):
+    trip_id = None
+    routed = False
+    try:
+        for event in events:
+            routed = routed or event["event"] == "route"
+            if event["event"] == "trip":
+                trip_id = event["trip"]["id"]
+            yield event
+    finally:
+        # Also reached when the client disconnects and the stream is closed early
+        if trip_id and routed:
+            finish(key, token, trip_id)
+        else:
+            abandon(key, token)
+
+
+def _claimed_events(key, fingerprint, trip_input, timeout, geometry_options):
+    """Claims `key` on the first read, so a stream that is never read holds nothing."""
+    deadline = time.monotonic() + timeout
+    trip_id, token = acquire(key, fingerprint, timeout * WAIT_SHARE)
+    trip = _saved_trip(trip_id)
+    if trip is not None:
+        yield from saved_trip_events(trip, geometry_options)
+        return
+    events = stream_single_trip(trip_input, remaining(deadline), geometry_options)
+    yield from _settle_after(key, token, events)
+
+
+def stream_once(trip_input, timeout, geometry_options=None, idempotency_key=None):
+    """
+    stream_single_trip, deduplicated. A trip already planned for the request
+    and an IdempotencyConflict are found before returning the event generator;
+    the key is claimed (or a concurrent plan waited for) only once the
+    generator is read. Returns (events, replayed); a replayed trip streams from
+    its saved rows (see trip_planning.saved_trip_events).
+    """
+    key, fingerprint = request_key(trip_input, idempotency_key)
+    if key is None or not enabled():
+        return stream_single_trip(trip_input, timeout, geometry_options), False
+    trip = _saved_trip(peek(key, fingerprint))
+    if trip is not None:
+        _stats["replayed"] += 1
+        return saved_trip_events(trip, geometry_options), True
+    return _claimed_events(key, fingerprint, trip_input, timeout, geometry_options), False
@@ -1,192 +1,205 @@
-from datetime import timedelta
-
-from django.utils import timezone
-from planner.models import Event, LogSheet
-
-
-def create_split_event(trip, status, start_time, end_time, note, order_index):
+"""
+Pure in-memory trip planning: ordered stops in, duty-status segments and
+per-day log sheets out. Nothing here touches the database; see
+services.persistence for writing a TripPlan to the ORM models.
+"""
+
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+
+from planner.constants import EVENT_STATUSES
+
+STATUS_DISPLAY = dict(EVENT_STATUSES)
+
+
+@dataclass(slots=True)
+class PlannedStop:
+    type: str
+    location: str
+    arrival_time: datetime
+    duration_hours: float
+    order_index: int
+    lat: float = None
+    lon: float = None
+    geometry_idx: int = 0
+    added: bool = False  # added by a replan rather than placed by the planner
+
+    @property
+    def departure_time(self):
+        return self.arrival_time + timedelta(hours=self.duration_hours)
+
+
+@dataclass(slots=True)
+class DutySegment:
+    status: str
+    start_time: datetime
+    end_time: datetime
+    note: str
+    order_index: int
+    location: str = None
+
+    @property
+    def status_display(self):
+        return STATUS_DISPLAY.get(self.status, self.status)
+
+    def to_json(self):
+        return {
+            "status": self.status,
+            "status_display": self.status_display,
+            "start_time": self.start_time.isoformat(),
+            "end_time": self.end_time.isoformat(),
+            "note": self.note,
+            "order_index": self.order_index,
+        }
+
+
+@dataclass(slots=True)
+class DaySheet:
+    date: str  # ISO date
+    segments: list = field(default_factory=list)
+
+    def to_json(self):
+        return {"date": self.date, "events": [s.to_json() for s in self.segments]}
+
+
+@dataclass(slots=True)
+class TripPlan:
+    stops: list
+    segments: list
+    sheets: list
+
+    def add(self, kind, item):
+        """Append one of iter_plan's ("stop" | "segment" | "sheet", item) pairs."""
+        getattr(self, kind + "s").append(item)
+
+
+def create_split_event(status, start_time, end_time, note, order_index):
     """
-    Create events that don't cross midnight.
-    If an event spans multiple days, split it at midnight.
+    Build segments that don't cross midnight.
+    If a segment spans multiple days, split it at midnight.
     """
-    events = []
+    segments = []
     current_start = start_time
     current_end = end_time
 
     while current_start.date() != current_end.date():
         midnight = current_start.replace(hour=23, minute=59, second=59, microsecond=999999)
-        e = Event.objects.create(
-            trip=trip,
-            status=status,
-            start_time=current_start,
-            end_time=midnight,
-            note=note,
-            order_index=order_index,
+        segments.append(
+            DutySegment(
+                status=status,
+                start_time=current_start,
+                end_time=midnight,
+                note=note,
+                order_index=order_index,
+            )
         )
-        events.append(e)
 
         # move to next day
         current_start = midnight + timedelta(microseconds=1)
         order_index += 1
 
     # final piece
-    e = Event.objects.create(
-        trip=trip,
-        status=status,
-        start_time=current_start,
-        end_time=current_end,
-        note=note,
-        order_index=order_index,
+    segments.append(
+        DutySegment(
+            status=status,
+            start_time=current_start,
+            end_time=current_end,
+            note=note,
+            order_index=order_index,
+        )
     )
-    events.append(e)
-    return events
+    return segments
 
 
-def plan_trip(all_stops_obj):
-    log_sheets = []  # all Event objects
-    order_index = 0  # global ordering
+# stop type -> (note for the drive there, status at the stop, note at the stop)
+STOP_ACTIVITIES = {
+    "break": ("Driving to break", "off_duty", "Taking a break"),
+    "fuel": ("Driving to fuel stop", "on_duty", "Refueling"),
+    "pickup": ("Driving to pickup", "on_duty", "Loading cargo"),
+    "dropoff": ("Driving to dropoff", "on_duty", "Unloading cargo"),
+    "rest": ("Driving to rest stop", "sleeper", "10-hour rest"),
+    "restart": ("Driving to rest stop", "off_duty", "34-hour restart"),
+}
 
-    for idx, stop in enumerate(all_stops_obj):
-        prev_stop = all_stops_obj[idx - 1] if idx > 0 else None
 
+def iter_segments(stops):
+    """
+    Duty-status segments for PlannedStops in order, yielded as each stop arrives
+    so `stops` can be a generator. The driver is off duty from midnight of the
+    first day until the first stop, and again after the last stop until midnight.
+    """
+    order_index = 0
+    prev_stop = None
+    last_segment = None
+
+    def split(status, start_time, end_time, note):
+        nonlocal order_index, last_segment
+        pieces = create_split_event(status, start_time, end_time, note, order_index)
+        order_index += len(pieces)
+        last_segment = pieces[-1]
+        return pieces
+
+    for stop in stops:
         if stop.type == "current":
-            log_sheets += create_split_event(
-                trip=stop.trip,
-                status="off_duty",
-                start_time=timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
-                + timedelta(days=1),
-                end_time=stop.arrival_time,
-                note="Sleeping till duty starts",
-                order_index=order_index,
-            )
-            order_index += len(log_sheets)
-
-        elif stop.type == "break":
-            log_sheets += create_split_event(
-                trip=stop.trip,
-                status="driving",
-                start_time=prev_stop.arrival_time + timedelta(hours=prev_stop.duration_hours),
-                end_time=stop.arrival_time,
-                note="Driving to break",
-                order_index=order_index,
-            )
-            order_index += len(log_sheets)
-
-            log_sheets += create_split_event(
-                trip=stop.trip,
-                status="off_duty",
-                start_time=stop.arrival_time,
-                end_time=stop.arrival_time + timedelta(hours=stop.duration_hours),
-                note="Taking a break",
-                order_index=order_index,
-            )
-            order_index += len(log_sheets)
-
-        elif stop.type == "fuel":
-            log_sheets += create_split_event(
-                trip=stop.trip,
-                status="driving",
-                start_time=prev_stop.arrival_time + timedelta(hours=prev_stop.duration_hours),
-                end_time=stop.arrival_time,
-                note="Driving to fuel stop",
-                order_index=order_index,
-            )
-            order_index += len(log_sheets)
-
-            log_sheets += create_split_event(
-                trip=stop.trip,
-                status="on_duty",
-                start_time=stop.arrival_time,
-                end_time=stop.arrival_time + timedelta(hours=stop.duration_hours),
-                note="Refueling",
-                order_index=order_index,
-            )
-            order_index += len(log_sheets)
-
-        elif stop.type == "pickup":
-            log_sheets += create_split_event(
-                trip=stop.trip,
-                status="driving",
-                start_time=prev_stop.arrival_time + timedelta(hours=prev_stop.duration_hours),
-                end_time=stop.arrival_time,
-                note="Driving to pickup",
-                order_index=order_index,
-            )
-            order_index += len(log_sheets)
-
-            log_sheets += create_split_event(
-                trip=stop.trip,
-                status="on_duty",
-                start_time=stop.arrival_time,
-                end_time=stop.arrival_time + timedelta(hours=stop.duration_hours),
-                note="Loading cargo",
-                order_index=order_index,
-            )
-            order_index += len(log_sheets)
-
-        elif stop.type == "dropoff":
-            log_sheets += create_split_event(
-                trip=stop.trip,
-                status="driving",
-                start_time=prev_stop.arrival_time + timedelta(hours=prev_stop.duration_hours),
-                end_time=stop.arrival_time,
-                note="Driving to dropoff",
-                order_index=order_index,
-            )
-            order_index += len(log_sheets)
-
-            log_sheets += create_split_event(
-                trip=stop.trip,
-                status="on_duty",
-                start_time=stop.arrival_time,
-                end_time=stop.arrival_time + timedelta(hours=stop.duration_hours),
-                note="Unloading cargo",
-                order_index=order_index,
-            )
-            order_index += len(log_sheets)
-
-    # Final off-duty event till midnight
-    last_event = log_sheets[-1]
-    log_sheets += create_split_event(
-        trip=last_event.trip,
-        status="off_duty",
-        start_time=last_event.end_time,
-        end_time=last_event.end_time.replace(hour=23, minute=59, second=59, microsecond=999999),
-        note="Off duty till midnight",
-        order_index=order_index,
+            day_start = stop.arrival_time.replace(hour=0, minute=0, second=0, microsecond=0)
+            yield from split("off_duty", day_start, stop.arrival_time, "Sleeping till duty starts")
+
+        elif stop.type in STOP_ACTIVITIES:
+            drive_note, stop_status, stop_note = STOP_ACTIVITIES[stop.type]
+            yield from split("driving", prev_stop.departure_time, stop.arrival_time, drive_note)
+            yield from split(stop_status, stop.arrival_time, stop.departure_time, stop_note)
+
+        prev_stop = stop
+
+    # Final off-duty segment till midnight
+    end = last_segment.end_time
+    yield from split(
+        "off_duty",
+        end,
+        end.replace(hour=23, minute=59, second=59, microsecond=999999),
+        "Off duty till midnight",
     )
 
-    # ---- Group by date for frontend ----
-    grouped = {}
-    for e in log_sheets:
-        day = e.start_time.date().isoformat()
-        if day not in grouped:
-            grouped[day] = {"date": day, "events": []}
-        grouped[day]["events"].append(
-            {
-                "status": e.status,
-                "status_display": e.get_status_display(),
-                "start_time": e.start_time.isoformat(),
-                "end_time": e.end_time.isoformat(),
-                "note": e.note,
-                "order_index": e.order_index,
-            }
-        )
-
-    # ---- Persist LogSheets ----
-    trip = all_stops_obj[0].trip
-    for day, data in grouped.items():
-        LogSheet.objects.update_or_create(
-            trip=trip,
-            date=day,
-            defaults={"sheet_json": data},
-        )
-
-    print("\n--- Planned Events ---")
-    for g in grouped.values():
-        print(f"Date: {g['date']}")
-        for e in g["events"]:
-            print(f"  {e['status']} from {e['start_time']} to {e['end_time']} - {e['note']}")
-    print("--- End Events ---\n")
 
-    # return {"log_sheets": list(grouped.values())}
+def iter_plan(stops):
+    """
+    Incremental plan_trip. Yields ("stop", PlannedStop) for each stop as it is
+    consumed, ("segment", DutySegment) as each is laid out, and ("sheet", DaySheet)
+    as soon as a day's last segment is known, so callers can stream a plan while
+    the stops are still being placed.
+    """
+    placed = []
+
+    def consume():
+        for stop in stops:
+            placed.append(stop)
+            yield stop
+
+    sheet = None
+    for segment in iter_segments(consume()):
+        while placed:
+            yield "stop", placed.pop(0)
+        yield "segment", segment
+        # Segments never cross midnight, so a new date closes the previous sheet
+        day = segment.start_time.date().isoformat()
+        if sheet is not None and sheet.date != day:
+            yield "sheet", sheet
+            sheet = None
+        if sheet is None:
+            sheet = DaySheet(date=day)
+        sheet.segments.append(segment)
+    while placed:
+        yield "stop", placed.pop(0)
+    if sheet is not None:
+        yield "sheet", sheet
+
+
+def plan_trip(stops):
+    """
+    Turn an ordered list of PlannedStops into duty-status segments and day sheets.
+    The driver is off duty from midnight of the first day until the first stop.
+    """
+    plan = TripPlan(stops=[], segments=[], sheets=[])
+    for kind, item in iter_plan(stops):
+        plan.add(kind, item)
+    return plan
@@ -0,0 +1,210 @@
+"""
+Offline place lookup from a US places gazetteer.
+
+`build_gazetteer` turns place rows into a sorted array of normalized keys, two
+per place ("chicago, il" and "chicago, illinois"), stored as an array file (see
+services.array_file). An exact lookup is a binary search over the memory-mapped
+keys; a prefix query is the contiguous run of keys starting with the prefix.
+
+Nothing here imports Django; services.geocoding consults it before Mapbox.
+"""
+
+import csv
+from bisect import bisect_left
+
+import numpy as np
+
+from .array_file import open_cached, pack_strings, read_arrays, write_arrays
+
+MAGIC = b"GAZETR1\n"
+
+# fmt: off
+US_STATES = {
+    "AL": "Alabama", "AK": "Alaska", "AZ": "Arizona", "AR": "Arkansas", "CA": "California",
+    "CO": "Colorado", "CT": "Connecticut", "DE": "Delaware", "DC": "District of Columbia",
+    "FL": "Florida", "GA": "Georgia", "HI": "Hawaii", "ID": "Idaho", "IL": "Illinois",
+    "IN": "Indiana", "IA": "Iowa", "KS": "Kansas", "KY": "Kentucky", "LA": "Louisiana",
+    "ME": "Maine", "MD": "Maryland", "MA": "Massachusetts", "MI": "Michigan", "MN": "Minnesota",
+    "MS": "Mississippi", "MO": "Missouri", "MT": "Montana", "NE": "Nebraska", "NV": "Nevada",
+    "NH": "New Hampshire", "NJ": "New Jersey", "NM": "New Mexico", "NY": "New York",
+    "NC": "North Carolina", "ND": "North Dakota", "OH": "Ohio", "OK": "Oklahoma", "OR": "Oregon",
+    "PA": "Pennsylvania", "PR": "Puerto Rico", "RI": "Rhode Island", "SC": "South Carolina",
+    "SD": "South Dakota", "TN": "Tennessee", "TX": "Texas", "UT": "Utah", "VT": "Vermont",
+    "VA": "Virginia", "WA": "Washington", "WV": "West Virginia", "WI": "Wisconsin",
+    "WY": "Wyoming",
+}
+_STATE_CODES = {code.casefold() for code in US_STATES}
+
+# Census place names end in their legal/statistical type, always lower case except
+# CDP: "Chicago city", "Aspen town", but "Carson City" is the name itself
+PLACE_TYPE_SUFFIXES = (
+    " city and borough", " unified government", " consolidated government",
+    " metropolitan government", " urban county", " municipality", " borough", " village",
+    " city", " town", " township", " CDP", " comunidad", " zona urbana",
+)
+# fmt: on
+COUNTRY_NAMES = {"us", "usa", "u.s.", "u.s.a.", "united states", "united states of america"}
+
+# Header names accepted for each column (Census gazetteer files, or a plain CSV)
+COLUMNS = {
+    "name": ("name",),
+    "state": ("usps", "state"),
+    "lat": ("intptlat", "lat", "latitude"),
+    "lon": ("intptlong", "lon", "lng", "longitude"),
+    "population": ("pop", "population"),
+}
+
+
+def normalize_query(text, split_state=True):
+    """
+    Key form of a place query: case-folded, whitespace collapsed and a trailing
+    country dropped. With split_state, "Chicago IL" is read as "Chicago, IL".
+    """
+    parts = [" ".join(p.split()) for p in str(text).casefold().split(",")]
+    parts = [p for p in parts if p]
+    if len(parts) > 1 and parts[-1] in COUNTRY_NAMES:
+        parts.pop()
+    if split_state and len(parts) == 1:
+        head, _, tail = parts[0].rpartition(" ")
+        if head and tail in _STATE_CODES:
+            parts = [head, tail]
+    return ", ".join(parts)
+
+
+def clean_place_name(name):
+    """'Chicago city' -> 'Chicago'."""
+    for suffix in PLACE_TYPE_SUFFIXES:
+        if name.endswith(suffix) and len(name) > len(suffix):
+            return name[: -len(suffix)].strip()
+    return name.strip()
+
+
+def rows_from_file(path):
+    """
+    (name, state_code, lat, lon, population) from a Census gazetteer places file
+    (tab-separated) or a CSV with name,state,lat,lon[,population] columns.
+    """
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        first = f.readline()
+        f.seek(0)
+        reader = csv.reader(f, delimiter="\t" if "\t" in first else ",")
+        header = [h.strip().casefold() for h in next(reader)]
+        index = {}
+        for column, names in COLUMNS.items():
+            found = [header.index(n) for n in names if n in header]
+            if found:
+                index[column] = found[0]
+        missing = {"name", "state", "lat", "lon"} - set(index)
+        if missing:
+            raise ValueError(f"{path}: missing column(s) {', '.join(sorted(missing))}")
+        for row in reader:
+            if not row:
+                continue
+            population = row[index["population"]].strip() if "population" in index else ""
+            yield (
+                row[index["name"]].strip(),
+                row[index["state"]].strip().upper(),
+                float(row[index["lat"]]),
+                float(row[index["lon"]]),
+                int(float(population)) if population else 0,
+            )
+
+
+def build_gazetteer(rows):
+    """
+    Arrays and metadata for `write_gazetteer`. Rows are (name, state_code, lat,
+    lon, population); where two places share a key the more populous one wins.
+    """
+    places = []
+    keys = {}  # key -> place index
+    for name, state, lat, lon, population in rows:
+        name = clean_place_name(name)
+        base = normalize_query(name, split_state=False)
+        if not base or state not in US_STATES:
+            continue
+        place = len(places)
+        places.append((f"{name}, {state}", lat, lon, population))
+        for key in (f"{base}, {state.casefold()}", f"{base}, {US_STATES[state].casefold()}"):
+            held = keys.get(key)
+            if held is None or population > places[held][3]:
+                keys[key] = place
+
+    sorted_keys = sorted(keys, key=str.encode)
+    key_bytes, key_offsets = pack_strings(sorted_keys)
+    name_bytes, name_offsets = pack_strings([p[0] for p in places])
+    arrays = {
+        "key_bytes": key_bytes,
+        "key_offsets": key_offsets,
+        "key_place": np.array([keys[k] for k in sorted_keys], dtype=np.int32),
+        "name_bytes": name_bytes,
+        "name_offsets": name_offsets,
+        "lat": np.array([p[1] for p in places], dtype=np.float64),
+        "lon": np.array([p[2] for p in places], dtype=np.float64),
+        "population": np.array([p[3] for p in places], dtype=np.int64),
+    }
+    return arrays, {"places": len(places), "keys": len(sorted_keys)}
+
+
+def write_gazetteer(path, arrays, meta):
+    write_arrays(path, MAGIC, arrays, meta)
+
+
+class Gazetteer:
+    """Memory-mapped place index answering exact and prefix lookups."""
+
+    def __init__(self, arrays, meta):
+        self.meta = meta
+        for name, array in arrays.items():
+            setattr(self, name, array)
+        self._positions = range(len(self.key_place))
+        # Slicing a memoryview is far cheaper than slicing the memmap itself
+        self._key_view = memoryview(self.key_bytes)
+        self._key_offsets = self.key_offsets.tolist()
+
+    @classmethod
+    def open(cls, path):
+        return cls(*read_arrays(path, MAGIC))
+
+    def _key(self, i):
+        return bytes(self._key_view[self._key_offsets[i] : self._key_offsets[i + 1]])
+
+    def _place(self, place):
+        start, end = self.name_offsets[place], self.name_offsets[place + 1]
+        return {
+            "name": bytes(self.name_bytes[start:end]).decode(),
+            "lat": float(self.lat[place]),
+            "lon": float(self.lon[place]),
+        }
+
+    def lookup(self, query):
+        """(lat, lon) for an exact "City, ST" / "City, State" match, else None."""
+        key = normalize_query(query).encode()
+        i = bisect_left(self._positions, key, key=self._key)
+        if i < len(self._positions) and self._key(i) == key:
+            place = int(self.key_place[i])
+            return float(self.lat[place]), float(self.lon[place])
+        return None
+
+    def complete(self, prefix, limit=10):
+        """
+        Up to `limit` places whose name starts with `prefix`, most populous first:
+        [{"name": "Chicago, IL", "lat", "lon"}, ...].
+        """
+        # A half-typed name can look like "City ST" ("port de..."); don't split it
+        key = normalize_query(prefix, split_state=False).encode()
+        if not key or limit <= 0:
+            return []
+        lo = bisect_left(self._positions, key, key=self._key)
+        # 0xff never occurs in UTF-8, so this sorts after every key with the prefix
+        hi = bisect_left(self._positions, key + b"\xff", lo=lo, key=self._key)
+        # Each place can match under both of its keys; keep its first (lowest) one
+        places, first = np.unique(self.key_place[lo:hi], return_index=True)
+        name_length = self.name_offsets[places + 1] - self.name_offsets[places]
+        # Most populous, then shortest name ("Chicago" before "Chicago Heights")
+        order = np.lexsort((first, name_length, -self.population[places]))[:limit]
+        return [self._place(int(place)) for place in places[order]]
+
+
+def load_gazetteer(path):
+    """The Gazetteer at `path`, mapped once per process and reopened if the file changes."""
+    return open_cached(path, Gazetteer.open)
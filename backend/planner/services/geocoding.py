@@ -1,19 +1,232 @@
-import os
-import requests
+import asyncio
+import logging
+import time
+from datetime import timedelta
+from urllib.parse import quote
 
-MAPBOX_TOKEN = os.environ.get("MAPBOX_API_KEY")
+from django.conf import settings
+from django.utils import timezone
 
+from planner.models import GeocodeCache
 
-def geocode_location(name):
-    url = f"https://api.mapbox.com/geocoding/v5/mapbox.places/{name}.json"
-    params = {"access_token": MAPBOX_TOKEN, "limit": 1}
+from .cache import TTLCache
+from .concurrency import map_with_deadline, remaining
+from .gazetteer import load_gazetteer
+from .http_client import UpstreamError
+from .mapbox import amapbox_get_json, mapbox_get_json
+
+logger = logging.getLogger(__name__)
+
+GEOCODE_CACHE_TTL = getattr(settings, "GEOCODE_CACHE_TTL", 30 * 24 * 3600)
+
+# Tier 1: per-process LRU. Tier 2: the GeocodeCache table shared by all workers.
+_memory_cache = TTLCache(
+    maxsize=getattr(settings, "GEOCODE_CACHE_SIZE", 2048),
+    ttl=GEOCODE_CACHE_TTL,
+)
+_db_stats = {"hits": 0, "misses": 0}
+_gazetteer_stats = {"hits": 0, "misses": 0}
+
+
+def normalize_location(name):
+    """Cache key for a location: case-folded with whitespace and commas collapsed."""
+    parts = [p.strip() for p in str(name).casefold().split(",")]
+    return ", ".join(" ".join(p.split()) for p in parts if p)
+
+
+def geocode_cache_stats():
+    return {
+        "memory": _memory_cache.stats(),
+        "db": dict(_db_stats),
+        "gazetteer": dict(_gazetteer_stats),
+    }
+
+
+def gazetteer():
+    """The offline Gazetteer at GAZETTEER_PATH, or None if unset or unreadable."""
+    path = getattr(settings, "GAZETTEER_PATH", None)
+    if not path:
+        return None
+    try:
+        return load_gazetteer(path)
+    except (OSError, ValueError) as e:
+        logger.warning("gazetteer unavailable path=%s error=%s", path, e)
+        return None
+
+
+def _lookup_gazetteer(name):
+    index = gazetteer()
+    if index is None:
+        return None
+    coords = index.lookup(name)
+    _gazetteer_stats["hits" if coords else "misses"] += 1
+    return coords
+
+
+def _geocode_path(name):
+    # Encode everything, "/" included: "?", "#" or "/" in a name would cut the path short
+    return f"/geocoding/v5/mapbox.places/{quote(name, safe='')}.json"
+
+
+def _parse_geocode(data):
+    if data.get("features"):
+        lon, lat = data["features"][0]["center"]
+        return lat, lon
+    return None, None
+
+
+def _fetch_geocode(name, timeout=10, record_dir=None):
     try:
-        resp = requests.get(url, params=params, timeout=10)
-        resp.raise_for_status()
-        data = resp.json()
-        if data["features"]:
-            lon, lat = data["features"][0]["center"]
-            return lat, lon
-    except Exception as e:
-        print(f"Geocoding failed for {name}: {e}")
+        data = mapbox_get_json(
+            "geocoding", _geocode_path(name), {"limit": 1}, timeout, record_dir=record_dir
+        )
+        return _parse_geocode(data)
+    except UpstreamError as e:
+        logger.warning("geocoding failed location=%r error=%s", name, e)
     return None, None
+
+
+async def _afetch_geocode(name, timeout=10):
+    try:
+        data = await amapbox_get_json("geocoding", _geocode_path(name), {"limit": 1}, timeout)
+        return _parse_geocode(data)
+    except UpstreamError as e:
+        logger.warning("geocoding failed location=%r error=%s", name, e)
+    return None, None
+
+
+def _fresh_rows(key):
+    fresh_after = timezone.now() - timedelta(seconds=GEOCODE_CACHE_TTL)
+    return GeocodeCache.objects.filter(query=key, updated_at__gte=fresh_after)
+
+
+def _remember_row(key, row):
+    if row is None:
+        _db_stats["misses"] += 1
+        return None
+    _db_stats["hits"] += 1
+    ttl_left = GEOCODE_CACHE_TTL - (timezone.now() - row.updated_at).total_seconds()
+    coords = (row.lat, row.lon)
+    _memory_cache.set(key, coords, ttl=max(ttl_left, 0))
+    return coords
+
+
+def _read_db_cache(key):
+    return _remember_row(key, _fresh_rows(key).first())
+
+
+def _write_cache(key, coords):
+    _memory_cache.set(key, coords)
+    lat, lon = coords
+    GeocodeCache.objects.update_or_create(query=key, defaults={"lat": lat, "lon": lon})
+
+
+async def _awrite_cache(key, coords):
+    _memory_cache.set(key, coords)
+    lat, lon = coords
+    await GeocodeCache.objects.aupdate_or_create(query=key, defaults={"lat": lat, "lon": lon})
+
+
+def _read_local(key):
+    """Memory cache, then the gazetteer, then the GeocodeCache table."""
+    coords = _memory_cache.get(key) or _lookup_gazetteer(key)
+    if coords is None:
+        coords = _read_db_cache(key)
+    return coords
+
+
+def geocode_location(name):
+    """
+    Returns (lat, lon) for a free-text location, or (None, None) if it can't be resolved.
+    Checks the in-process cache, the offline gazetteer (exact "City, ST" matches) and
+    the GeocodeCache table before calling Mapbox.
+    Failed lookups are not cached so they are retried on the next request.
+    """
+    key = normalize_location(name)
+    if not key:
+        return None, None
+
+    coords = _read_local(key)
+    if coords is not None:
+        return coords
+
+    coords = _fetch_geocode(str(name).strip())
+    if coords[0] is not None:
+        _write_cache(key, coords)
+    return coords
+
+
+def geocode_locations(names, timeout=10):
+    """
+    Geocode several locations at once, returning [(lat, lon), ...] in input order.
+    Cache lookups run inline; the remaining distinct names are fetched concurrently on
+    the shared I/O pool under a single deadline. A lookup that fails or misses the
+    deadline comes back as (None, None) without holding up the others.
+    """
+    deadline = time.monotonic() + timeout
+    keys = [normalize_location(n) for n in names]
+
+    resolved = {}
+    pending = {}  # key -> raw name, deduplicated
+    for name, key in zip(names, keys):
+        if not key or key in resolved or key in pending:
+            continue
+        coords = _read_local(key)
+        if coords is not None:
+            resolved[key] = coords
+        else:
+            pending[key] = str(name).strip()
+
+    if pending:
+        fetched = map_with_deadline(
+            lambda name: _fetch_geocode(name, timeout=remaining(deadline, cap=10)),
+            list(pending.values()),
+            deadline,
+            default=(None, None),
+        )
+        for key, coords in zip(pending, fetched):
+            resolved[key] = coords
+            if coords[0] is not None:
+                _write_cache(key, coords)
+
+    return [resolved.get(key, (None, None)) for key in keys]
+
+
+async def geocode_locations_async(names, timeout=10):
+    """
+    Coroutine counterpart of geocode_locations: same caching and deadline, but
+    lookups are concurrent coroutines instead of pool threads.
+    """
+    deadline = time.monotonic() + timeout
+    keys = [normalize_location(n) for n in names]
+
+    resolved = {}
+    pending = {}  # key -> raw name, deduplicated
+    for name, key in zip(names, keys):
+        if not key or key in resolved or key in pending:
+            continue
+        coords = _memory_cache.get(key) or _lookup_gazetteer(key)
+        if coords is None:
+            coords = _remember_row(key, await _fresh_rows(key).afirst())
+        if coords is not None:
+            resolved[key] = coords
+        else:
+            pending[key] = str(name).strip()
+
+    if pending:
+        tasks = {
+            key: asyncio.ensure_future(_afetch_geocode(name, timeout=remaining(deadline, cap=10)))
+            for key, name in pending.items()
+        }
+        await asyncio.wait(tasks.values(), timeout=remaining(deadline))
+        for key, task in tasks.items():
+            if task.done() and not task.cancelled() and task.exception() is None:
+                coords = task.result()
+            else:
+                task.cancel()
+                coords = (None, None)
+            resolved[key] = coords
+            if coords[0] is not None:
+                await _awrite_cache(key, coords)
+
+    return [resolved.get(key, (None, None)) for key in keys]
@@ -0,0 +1,315 @@
+from math import atan2, cos, radians, sin, sqrt
+
+import numpy as np
+
+EARTH_RADIUS_M = 6371000
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Return distance in meters between two lat/lon points using the Haversine formula."""
+    phi1, phi2 = radians(lat1), radians(lat2)
+    dphi = radians(lat2 - lat1)
+    dlambda = radians(lon2 - lon1)
+    a = sin(dphi / 2) ** 2 + cos(phi1) * cos(phi2) * sin(dlambda / 2) ** 2
+    return EARTH_RADIUS_M * 2 * atan2(sqrt(a), sqrt(1 - a))
+
+
+def segment_lengths(points):
+    """Haversine length in meters of every consecutive segment of an (N, 2) lat/lon array."""
+    lat = np.radians(points[:, 0])
+    lon = np.radians(points[:, 1])
+    dphi = np.diff(lat)
+    dlambda = np.diff(lon)
+    a = np.sin(dphi / 2) ** 2 + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(dlambda / 2) ** 2
+    return EARTH_RADIUS_M * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+def _ring_offsets(r):
+    """(dx, dy) of every cell at Chebyshev distance exactly r from a cell."""
+    if r == 0:
+        return np.zeros(1, dtype=np.int64), np.zeros(1, dtype=np.int64)
+    side = np.arange(-r, r + 1)
+    inner = side[1:-1]
+    dx = np.concatenate([side, side, np.full(len(inner), -r), np.full(len(inner), r)])
+    dy = np.concatenate([np.full(len(side), -r), np.full(len(side), r), inner, inner])
+    return dx, dy
+
+
+class SpatialGrid:
+    """
+    Uniform grid over lat/lon points for nearest-point queries in degree space.
+    Queries search rings of cells outward from the query cell and stop once no
+    unvisited cell can hold anything closer, so cost depends on local density
+    rather than on the total number of points.
+    """
+
+    # Rings nearest_many searches in bulk before falling back to nearest()
+    BULK_RINGS = 8
+
+    def __init__(self, points, points_per_cell=32, cell=None):
+        self.points = points
+        n = len(points)
+        lo = points.min(axis=0)
+        hi = points.max(axis=0)
+        extent = float((hi - lo).max())
+        if cell is None:
+            # Size cells from the polyline's length so each holds ~points_per_cell vertices
+            path_len = float(np.hypot(*np.diff(points, axis=0).T).sum()) if n > 1 else 0.0
+            cell = path_len / max(n, 1) * points_per_cell
+        self.cell = max(cell, extent / 4096, 1e-9)
+        self.origin = lo
+        cells = np.floor((points - lo) / self.cell).astype(np.int64)
+        self.nx, self.ny = (int(c) + 1 for c in cells.max(axis=0))
+
+        keys = cells[:, 0] * self.ny + cells[:, 1]
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        uniq, starts = np.unique(sorted_keys, return_index=True)
+        bounds = list(starts[1:]) + [n]
+        self._cells = {int(k): order[s:e] for k, s, e in zip(uniq, starts, bounds)}
+        # The same cells as sorted keys over one index array, for nearest_many
+        self._keys = uniq
+        self._offsets = np.append(starts, n)
+        self._order = order
+
+    def _ring(self, cx, cy, r):
+        """In-grid cells at Chebyshev distance exactly r from (cx, cy)."""
+        x0, x1 = max(cx - r, 0), min(cx + r, self.nx - 1)
+        y0, y1 = max(cy - r, 0), min(cy + r, self.ny - 1)
+        if r == 0:
+            if 0 <= cx < self.nx and 0 <= cy < self.ny:
+                yield cx, cy
+            return
+        for y in (cy - r, cy + r):
+            if 0 <= y < self.ny:
+                for x in range(x0, x1 + 1):
+                    yield x, y
+        for x in (cx - r, cx + r):
+            if 0 <= x < self.nx:
+                for y in range(max(y0, cy - r + 1), min(y1, cy + r - 1) + 1):
+                    yield x, y
+
+    def nearest(self, lat, lon):
+        """Index of the point closest to (lat, lon); lowest index on exact ties."""
+        cx = int(np.floor((lat - self.origin[0]) / self.cell))
+        cy = int(np.floor((lon - self.origin[1]) / self.cell))
+        # Rings closer than this contain no grid cells when the query is off the grid
+        r = max(-cx, cx - (self.nx - 1), -cy, cy - (self.ny - 1), 0)
+        max_r = r + max(self.nx, self.ny)
+
+        best_d2, best_idx = np.inf, -1
+        while r <= max_r:
+            for x, y in self._ring(cx, cy, r):
+                idx = self._cells.get(x * self.ny + y)
+                if idx is None:
+                    continue
+                pts = self.points[idx]
+                d2 = (pts[:, 0] - lat) ** 2 + (pts[:, 1] - lon) ** 2
+                k = int(np.argmin(d2))
+                if d2[k] < best_d2 or (d2[k] == best_d2 and idx[k] < best_idx):
+                    best_d2, best_idx = float(d2[k]), int(idx[k])
+            # Anything in ring r + 1 or beyond is at least r cells away
+            if best_idx >= 0 and best_d2 < (r * self.cell) ** 2:
+                break
+            r += 1
+        return best_idx
+
+    def nearest_many(self, lats, lons):
+        """
+        nearest() for many points at once. Queries on the grid search their
+        first BULK_RINGS rings together, so the Python loop runs per ring rather
+        than per query; the few left over, and queries off the grid, fall back
+        to nearest().
+        """
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        best_d2 = np.full(len(lats), np.inf)
+        best_idx = np.full(len(lats), -1, dtype=np.int64)
+        cx = np.floor((lats - self.origin[0]) / self.cell).astype(np.int64)
+        cy = np.floor((lons - self.origin[1]) / self.cell).astype(np.int64)
+        on_grid = (cx >= 0) & (cx < self.nx) & (cy >= 0) & (cy < self.ny)
+        active = np.flatnonzero(on_grid)
+        max_r = min(self.BULK_RINGS, max(self.nx, self.ny))
+        for r in range(max_r + 1):
+            if not len(active):
+                break
+            d2, idx = self._nearest_in_ring(r, active, cx, cy, lats, lons)
+            better = (d2 < best_d2[active]) | ((d2 == best_d2[active]) & (idx < best_idx[active]))
+            best_d2[active[better]] = d2[better]
+            best_idx[active[better]] = idx[better]
+            # Anything in ring r + 1 or beyond is at least r cells away
+            done = (best_idx[active] >= 0) & (best_d2[active] < (r * self.cell) ** 2)
+            active = active[~done]
+        for i in np.concatenate([np.flatnonzero(~on_grid), active]).tolist():
+            best_idx[i] = self.nearest(lats[i], lons[i])
+        return best_idx
+
+    def _nearest_in_ring(self, r, queries, cx, cy, lats, lons):
+        """
+        For each query, squared distance and index of its closest point in the
+        cells at ring r around its own cell; (inf, -1) where those are empty.
+        """
+        dx, dy = _ring_offsets(r)
+        x, y = cx[queries, None] + dx, cy[queries, None] + dy
+        owner = np.broadcast_to(np.arange(len(queries))[:, None], x.shape)
+        inside = (x >= 0) & (x < self.nx) & (y >= 0) & (y < self.ny)
+        keys, owner = (x * self.ny + y)[inside], owner[inside]
+        pos = np.clip(np.searchsorted(self._keys, keys), 0, len(self._keys) - 1)
+        hit = self._keys[pos] == keys
+        pos, owner = pos[hit], owner[hit]
+        # Points of all the hit cells: each cell's run of _order, concatenated
+        starts, counts = self._offsets[pos], self._offsets[pos + 1] - self._offsets[pos]
+        rows = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        owner, idx = np.repeat(owner, counts), self._order[rows]
+        q = queries[owner]
+        d2 = (self.points[idx, 0] - lats[q]) ** 2 + (self.points[idx, 1] - lons[q]) ** 2
+
+        # Closest per query, lowest index on ties; candidates are grouped by owner
+        best_d2 = np.full(len(queries), np.inf)
+        best_idx = np.full(len(queries), -1, dtype=np.int64)
+        if len(owner):
+            head = np.flatnonzero(np.r_[True, owner[1:] != owner[:-1]])
+            group_d2 = np.minimum.reduceat(d2, head)
+            ties = d2 == np.repeat(group_d2, np.diff(np.r_[head, len(owner)]))
+            best_d2[owner[head]] = group_d2
+            best_idx[owner[head]] = np.minimum.reduceat(np.where(ties, idx, len(self.points)), head)
+        return best_d2, best_idx
+
+
+class RouteGeometry:
+    """
+    A route polyline with cumulative distance and time precomputed once.
+    Distance or travel time between any two vertex indices is then a subtraction.
+    Travel time assumes the route's average speed, as the planner always has.
+    """
+
+    def __init__(self, geometry, distance_m=None, duration_s=None):
+        self.points = np.asarray(geometry, dtype=np.float64).reshape(-1, 2)
+        self.cum_dist = np.zeros(len(self.points))
+        if len(self.points) > 1:
+            np.cumsum(segment_lengths(self.points), out=self.cum_dist[1:])
+
+        self.total_distance_m = float(self.cum_dist[-1]) if len(self.points) else 0.0
+        distance_m = self.total_distance_m if distance_m is None else distance_m
+        self.avg_speed_mps = distance_m / duration_s if duration_s else 0
+        if self.avg_speed_mps > 0:
+            self.cum_time = self.cum_dist / self.avg_speed_mps
+        else:
+            self.cum_time = np.zeros(len(self.points))
+        self._grid = None
+
+    def __len__(self):
+        return len(self.points)
+
+    def point(self, idx):
+        lat, lon = self.points[idx]
+        return float(lat), float(lon)
+
+    def distance_between(self, i, j):
+        """Meters along the route from vertex i to vertex j."""
+        return float(self.cum_dist[j] - self.cum_dist[i])
+
+    def seconds_between(self, i, j):
+        """Travel time in seconds from vertex i to vertex j at the route's average speed."""
+        return float(self.cum_time[j] - self.cum_time[i])
+
+    def indices_at_distances(self, targets_m):
+        """
+        For each target, the vertex whose cumulative distance is closest to it
+        (first one on ties), by binary search over the cumulative-distance array.
+        """
+        cum = self.cum_dist
+        targets = np.asarray(targets_m, dtype=np.float64)
+        hi = np.clip(np.searchsorted(cum, targets, side="left"), 0, len(cum) - 1)
+        lo = np.clip(hi - 1, 0, None)
+        # Step back over repeated vertices so ties resolve to the first index
+        hi = np.searchsorted(cum, cum[hi], side="left")
+        lo = np.searchsorted(cum, cum[lo], side="left")
+        take_hi = np.abs(cum[hi] - targets) < np.abs(cum[lo] - targets)
+        return np.where(take_hi, hi, lo)
+
+    def index_at_distance(self, target_m):
+        """Vertex whose cumulative distance is closest to target_m (first one on ties)."""
+        return int(self.indices_at_distances([target_m])[0])
+
+    def nearest_index(self, lat, lon):
+        """Vertex closest to (lat, lon) in plain degree space (first one on ties)."""
+        if self._grid is None:
+            self._grid = SpatialGrid(self.points)
+        return self._grid.nearest(lat, lon)
+
+    def nearest_indices(self, lats, lons):
+        """nearest_index for arrays of points, in one grid search."""
+        if self._grid is None:
+            self._grid = SpatialGrid(self.points)
+        return self._grid.nearest_many(lats, lons)
+
+    def points_every(self, interval_m):
+        """
+        Vertices nearest to every multiple of interval_m along the route.
+        Returns [{"lat", "lon", "geometry_idx", "order_index"}, ...].
+        """
+        if interval_m <= 0 or not len(self.points):
+            return []
+        num_stops = int(self.total_distance_m // interval_m)
+        targets = np.arange(1, num_stops + 1) * interval_m
+        indices = self.indices_at_distances(targets)
+
+        stops = []
+        for i, idx in enumerate(indices.tolist(), start=1):
+            lat, lon = self.point(idx)
+            stops.append({"lat": lat, "lon": lon, "geometry_idx": idx, "order_index": i})
+        return stops
+
+
+def meters_per_pixel(zoom, lat=0.0):
+    """Ground resolution of a 256px web-mercator tile at `zoom` and latitude."""
+    return 2 * np.pi * EARTH_RADIUS_M * cos(radians(lat)) / (256 * 2**zoom)
+
+
+def simplify_indices(points, tolerance_m):
+    """
+    Douglas-Peucker over an (N, 2) lat/lon array: indices of the vertices to keep
+    so no dropped vertex is more than tolerance_m from the simplified line.
+    Distances use a local equirectangular projection, which is accurate to well
+    under a pixel at the tolerances a map needs.
+    """
+    n = len(points)
+    if n < 3 or tolerance_m <= 0:
+        return np.arange(n)
+
+    lat0 = radians(float(points[:, 0].mean()))
+    xy = np.empty((n, 2))
+    xy[:, 0] = np.radians(points[:, 1]) * cos(lat0) * EARTH_RADIUS_M
+    xy[:, 1] = np.radians(points[:, 0]) * EARTH_RADIUS_M
+
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    tol2 = tolerance_m**2
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        seg = xy[end] - xy[start]
+        rel = xy[start + 1 : end] - xy[start]
+        seg_len2 = float(seg @ seg)
+        if seg_len2 == 0:
+            d2 = (rel**2).sum(axis=1)
+        else:
+            # Distance to the segment, clamped to its endpoints
+            t = np.clip(rel @ seg / seg_len2, 0.0, 1.0)
+            d2 = ((rel - t[:, None] * seg) ** 2).sum(axis=1)
+        k = int(np.argmax(d2))
+        if d2[k] > tol2:
+            split = start + 1 + k
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+    return np.flatnonzero(keep)
+
+
+def simplify_geometry(geometry, tolerance_m):
+    """[[lat, lon], ...] with Douglas-Peucker applied at tolerance_m."""
+    points = np.asarray(geometry, dtype=np.float64).reshape(-1, 2)
+    return points[simplify_indices(points, tolerance_m)].tolist()
@@ -0,0 +1,329 @@
+"""
+Hours-of-service simulator for a property-carrying driver (FMCSA 395.3).
+
+Walks the route timeline once, driving toward each waypoint in chunks that end
+at whichever limit comes first, and inserting the stop that limit requires:
+
+- 11 hours driving per shift, then a 10-hour rest
+- no driving after the 14th hour since coming on duty, then a 10-hour rest
+- a 30-minute break after 8 hours of driving (any 30+ minutes not driving counts)
+- 70 on-duty hours in 8 days, then a 34-hour restart
+- fuel every 1000 miles
+
+The 70-hour cycle starts from the driver's reported `current_cycle_used` and
+only accumulates; hours rolling off the 8-day window are not credited back, so
+the plan can restart earlier than strictly needed but never later.
+"""
+
+from dataclasses import dataclass, replace
+from datetime import timedelta
+
+from .event_planning import PlannedStop, iter_plan, plan_trip
+from .geometry import RouteGeometry, haversine
+from .instrumentation import span
+
+HOUR = 3600.0
+METERS_PER_MILE = 1609.34
+
+MAX_DRIVING_H = 11
+DUTY_WINDOW_H = 14
+BREAK_AFTER_DRIVING_H = 8
+CYCLE_LIMIT_H = 70
+FUEL_INTERVAL_M = 1000 * METERS_PER_MILE
+
+# Time spent at each kind of stop
+STOP_DURATION_HOURS = {
+    "current": 0.0,
+    "pickup": 1.0,
+    "dropoff": 1.0,
+    "fuel": 0.5,
+    "break": 0.5,
+    "rest": 10.0,
+    "restart": 34.0,
+}
+OFF_DUTY_STOPS = {"break", "rest", "restart"}
+# Stops the planner may move off the route to a truck stop or rest area
+POI_STOP_TYPES = {"fuel", "break", "rest", "restart"}
+
+_EPS = 1e-6
+
+
+@dataclass(slots=True)
+class DriverClock:
+    """HOS counters, all in seconds. `window_start` is None while off shift."""
+
+    driving_in_shift: float = 0.0
+    window_start: float = None
+    driving_since_break: float = 0.0
+    cycle_used: float = 0.0
+
+    def drive(self, now, seconds):
+        if self.window_start is None:
+            self.window_start = now
+        self.driving_in_shift += seconds
+        self.driving_since_break += seconds
+        self.cycle_used += seconds
+
+    def work(self, now, seconds):
+        """On duty, not driving."""
+        if self.window_start is None:
+            self.window_start = now
+        self.cycle_used += seconds
+        if seconds >= 0.5 * HOUR:
+            self.driving_since_break = 0.0
+
+    def rest(self, seconds):
+        if seconds >= 0.5 * HOUR:
+            self.driving_since_break = 0.0
+        if seconds >= 10 * HOUR:
+            self.driving_in_shift = 0.0
+            self.window_start = None
+        if seconds >= 34 * HOUR:
+            self.cycle_used = 0.0
+
+    def driving_allowed(self, now):
+        """Seconds of driving left before the first limit, and which limit it is."""
+        on_duty_for = now - self.window_start if self.window_start is not None else 0.0
+        window_left = DUTY_WINDOW_H * HOUR - on_duty_for
+        limits = [
+            (CYCLE_LIMIT_H * HOUR - self.cycle_used, "restart"),
+            (min(MAX_DRIVING_H * HOUR - self.driving_in_shift, window_left), "rest"),
+            (BREAK_AFTER_DRIVING_H * HOUR - self.driving_since_break, "break"),
+        ]
+        return min(limits, key=lambda limit: limit[0])
+
+
+@dataclass(slots=True)
+class Waypoint:
+    """A stop the route has to visit: pickup, dropoff, or a stop added by a replan."""
+
+    type: str
+    location: str
+    geometry_idx: int
+    lat: float
+    lon: float
+    duration_hours: float = None  # STOP_DURATION_HOURS[type] if None
+    added: bool = False
+
+
+class ReplanError(ValueError):
+    pass
+
+
+class Timeline:
+    """
+    The driver's progress along a route while stops are laid out: HOS clock,
+    time since start_time, meters driven and the stops placed so far. With a
+    poi_index.Corridor, fuel and HOS stops are moved back to the best truck
+    stop or rest area short of where the limit falls, and the drive off the
+    route to it and back is charged as driving before arrival.
+    """
+
+    def __init__(self, route_geom, start_time, cycle_used_hours=0, pois=None):
+        self.route_geom = route_geom
+        self.pois = pois
+        self.speed = route_geom.avg_speed_mps
+        self.start_time = start_time
+        self.clock = DriverClock(cycle_used=max(float(cycle_used_hours or 0), 0.0) * HOUR)
+        self.stops = []
+        self.now = 0.0  # seconds since start_time
+        self.position = 0.0  # meters along the route
+        self.next_fuel = FUEL_INTERVAL_M
+
+    def _spend(self, stop_type, duration_h):
+        if stop_type in OFF_DUTY_STOPS:
+            self.clock.rest(duration_h * HOUR)
+        elif duration_h:
+            self.clock.work(self.now, duration_h * HOUR)
+        if stop_type == "fuel":
+            self.next_fuel = self.position + FUEL_INTERVAL_M
+        self.now += duration_h * HOUR
+
+    def add_stop(self, stop_type, location, geometry_idx, lat, lon, duration_h=None, added=False):
+        if duration_h is None:
+            duration_h = STOP_DURATION_HOURS[stop_type]
+        stop = PlannedStop(
+            type=stop_type,
+            location=location,
+            arrival_time=self.start_time + timedelta(seconds=self.now),
+            duration_hours=duration_h,
+            order_index=len(self.stops) + 1,
+            lat=lat,
+            lon=lon,
+            geometry_idx=geometry_idx,
+            added=added,
+        )
+        self.stops.append(stop)
+        self._spend(stop_type, duration_h)
+        return stop
+
+    def detour(self, off_route_m):
+        """Drive off the route to a stop and back: on the clock and off the fuel range."""
+        seconds = 2 * off_route_m / self.speed
+        self.clock.drive(self.now, seconds)
+        self.now += seconds
+        self.next_fuel -= 2 * off_route_m
+
+    def off_route_m(self, stop):
+        """How far a placed stop is from the route: nonzero only for one moved to a POI."""
+        if stop.type not in POI_STOP_TYPES or stop.lat is None or stop.lon is None:
+            return 0.0
+        lat, lon = self.route_geom.point(self.route_geom.nearest_index(stop.lat, stop.lon))
+        return haversine(stop.lat, stop.lon, lat, lon)
+
+    def add_route_stop(self, stop_type):
+        idx = self.route_geom.index_at_distance(self.position)
+        lat, lon = self.route_geom.point(idx)
+        return self.add_stop(stop_type, f"{lat},{lon}", idx, lat, lon)
+
+    def drive_to(self, target):
+        """Drive to `target` meters along the route, yielding each stop needed on the way."""
+        clock, speed = self.clock, self.speed
+        while target - self.position > _EPS and speed > 0:
+            allowed, limit_stop = clock.driving_allowed(self.now)
+            to_fuel = (self.next_fuel - self.position) / speed
+            to_target = (target - self.position) / speed
+            chunk = max(min(to_target, to_fuel, allowed), 0.0)
+            stop_type = limit_stop if allowed <= chunk + _EPS else "fuel"
+            end = target if chunk == to_target else self.position + chunk * speed
+
+            poi = None
+            if self.pois is not None and target - end > _EPS:
+                poi = self.pois.best(stop_type, self.position, end)
+                if poi is not None:
+                    # Stopping early is always legal; the clock just has time left over
+                    chunk = min(chunk, (poi.along_m - self.position) / speed)
+                    end = poi.along_m
+
+            clock.drive(self.now, chunk)
+            self.now += chunk
+            self.position = end
+            if target - self.position <= _EPS:
+                break
+            if poi is not None:
+                self.detour(poi.off_route_m)
+                yield self.add_stop(stop_type, poi.name, poi.route_idx, poi.lat, poi.lon)
+            else:
+                yield self.add_route_stop(stop_type)
+
+    def visit(self, waypoints):
+        """Drive to each Waypoint in route order, yielding the stops on the way and at it."""
+        for w in sorted(waypoints, key=lambda w: w.geometry_idx):
+            yield from self.drive_to(float(self.route_geom.cum_dist[w.geometry_idx]))
+            yield self.add_stop(
+                w.type, w.location, w.geometry_idx, w.lat, w.lon, w.duration_hours, w.added
+            )
+
+    def replay(self, stop, arrival_time=None, duration_hours=None):
+        """
+        Advance past a PlannedStop already reached, as planned or, given
+        arrival_time / duration_hours, as it actually went. The distance to it is
+        the planned one, less any detour to a POI; time beyond the planned drive
+        counts as driving, which is the conservative reading for the 11-hour limit.
+        """
+        arrival_time = arrival_time or stop.arrival_time
+        duration_h = stop.duration_hours if duration_hours is None else duration_hours
+        if not self.stops:
+            # The trip starts whenever the driver actually did
+            self.start_time = arrival_time
+        else:
+            planned_s = (stop.arrival_time - self.start_time).total_seconds() - self.now
+            driven_s = (arrival_time - self.start_time).total_seconds() - self.now
+            if driven_s < 0:
+                raise ReplanError("arrival_time is before departure from the previous stop")
+            detour_m = 2 * self.off_route_m(stop)
+            self.position += max(planned_s * self.speed - detour_m, 0.0)
+            self.next_fuel -= detour_m
+            if driven_s > 0:
+                self.clock.drive(self.now, driven_s)
+                self.now += driven_s
+        self.stops.append(replace(stop, arrival_time=arrival_time, duration_hours=duration_h))
+        self._spend(stop.type, duration_h)
+
+
+def iter_trip_stops(
+    route_geom, current, pickup, dropoff, start_time, cycle_used_hours=0, pois=None
+):
+    """
+    Lay out a legal trip along a RouteGeometry, yielding each PlannedStop as it
+    is placed. current/pickup/dropoff are (location_name, (lat, lon)) pairs; the
+    driver is assumed to start a fresh shift at start_time with `cycle_used_hours`
+    already on the 70-hour clock. `pois` is an optional Corridor to snap stops to.
+    """
+    timeline = Timeline(route_geom, start_time, cycle_used_hours, pois)
+    current_location, (current_lat, current_lon) = current
+    yield timeline.add_stop("current", current_location, 0, current_lat, current_lon)
+    if timeline.clock.cycle_used >= CYCLE_LIMIT_H * HOUR:
+        yield timeline.add_route_stop("restart")
+
+    waypoints = [
+        Waypoint(stop_type, location, route_geom.nearest_index(lat, lon), lat, lon)
+        for stop_type, (location, (lat, lon)) in (("pickup", pickup), ("dropoff", dropoff))
+    ]
+    yield from timeline.visit(waypoints)
+
+
+def resume_trip(
+    route_geom,
+    reached,
+    waypoints,
+    cycle_used_hours=0,
+    arrival_time=None,
+    duration_hours=None,
+    pois=None,
+):
+    """
+    Replan a trip from the last of `reached`, the PlannedStops already made in
+    order, optionally correcting that stop's arrival_time / duration_hours to
+    what actually happened. `waypoints` are the Waypoints still ahead (pickup,
+    dropoff, added stops); HOS and fuel stops between them are laid out afresh.
+    Returns every stop, the reached ones included.
+    """
+    timeline = Timeline(route_geom, reached[0].arrival_time, cycle_used_hours, pois)
+    for stop in reached[:-1]:
+        timeline.replay(stop)
+    timeline.replay(reached[-1], arrival_time, duration_hours)
+    for w in waypoints:
+        # A meter of slack for snapping; the replayed position comes from rounded times
+        if route_geom.cum_dist[w.geometry_idx] < timeline.position - 1.0:
+            raise ReplanError(f"Stop at {w.lat},{w.lon} is behind the driver")
+    for _ in timeline.visit(waypoints):
+        pass
+    return timeline.stops
+
+
+def simulate_trip(route_geom, current, pickup, dropoff, start_time, cycle_used_hours=0, pois=None):
+    """All of iter_trip_stops' PlannedStops, in time order."""
+    return list(
+        iter_trip_stops(route_geom, current, pickup, dropoff, start_time, cycle_used_hours, pois)
+    )
+
+
+def plan_route(route, current, pickup, dropoff, start_time, cycle_used_hours=0, pois=None):
+    """
+    Full in-memory plan for a fetched route: HOS stop layout, then duty segments
+    and day sheets. Returns a TripPlan, or None if the route has no geometry.
+    Pure and picklable in and out (pois included), so it can run in a worker process.
+    """
+    if not route or not route.get("geometry"):
+        return None
+    with span("stops"):
+        route_geom = RouteGeometry(route["geometry"], route["distance_m"], route["duration_s"])
+        stops = simulate_trip(
+            route_geom, current, pickup, dropoff, start_time, cycle_used_hours, pois
+        )
+    with span("log"):
+        return plan_trip(stops)
+
+
+def iter_plan_route(route, current, pickup, dropoff, start_time, cycle_used_hours=0, pois=None):
+    """
+    plan_route as a stream of event_planning.iter_plan's (kind, item) pairs,
+    produced while the stops are being placed. Yields nothing without geometry.
+    """
+    if not route or not route.get("geometry"):
+        return
+    route_geom = RouteGeometry(route["geometry"], route["distance_m"], route["duration_s"])
+    yield from iter_plan(
+        iter_trip_stops(route_geom, current, pickup, dropoff, start_time, cycle_used_hours, pois)
+    )
@@ -0,0 +1,351 @@
+import asyncio
+import random
+import threading
+import time
+import weakref
+
+import httpx
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from .instrumentation import UPSTREAM_SECONDS
+
+MAX_RETRIES = getattr(settings, "HTTP_MAX_RETRIES", 2)
+BACKOFF_BASE = getattr(settings, "HTTP_BACKOFF_BASE", 0.2)  # seconds
+BACKOFF_CAP = getattr(settings, "HTTP_BACKOFF_CAP", 2.0)  # seconds
+CIRCUIT_FAILURE_THRESHOLD = getattr(settings, "HTTP_CIRCUIT_FAILURE_THRESHOLD", 5)
+CIRCUIT_RESET_TIMEOUT = getattr(settings, "HTTP_CIRCUIT_RESET_TIMEOUT", 30)  # seconds
+RATE_LIMITS = getattr(settings, "HTTP_RATE_LIMITS", {})  # endpoint -> requests per second
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Failures worth retrying besides RETRY_STATUSES: the request or response was cut short
+TRANSIENT_ERRORS = (
+    requests.ConnectionError,
+    requests.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+    requests.exceptions.ContentDecodingError,
+    httpx.TransportError,
+)
+
+
+class UpstreamError(Exception):
+    """An outbound call failed after retries, or was refused by an open circuit."""
+
+
+class CircuitOpenError(UpstreamError):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and rejects calls for
+    `reset_timeout` seconds, then lets a single trial call through (half-open).
+    """
+
+    def __init__(
+        self, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_timeout=CIRCUIT_RESET_TIMEOUT
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def release(self):
+        """End a half-open trial that never reached upstream, without a verdict."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class RateLimiter:
+    """Token bucket shared by every thread calling one endpoint."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _take(self):
+        """Take a token if one is available; otherwise return seconds until the next one."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self, deadline):
+        """Wait for a token; returns False if none frees up before the deadline."""
+        while wait := self._take():
+            if time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+        return True
+
+    async def acquire_async(self, deadline):
+        while wait := self._take():
+            if time.monotonic() + wait > deadline:
+                return False
+            await asyncio.sleep(wait)
+        return True
+
+
+class EndpointMetrics:
+    def __init__(self, endpoint=""):
+        self.endpoint = endpoint
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.rejected = 0
+        self.total_s = 0.0
+        self.max_s = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds, error=False):
+        UPSTREAM_SECONDS.observe(seconds, endpoint=self.endpoint)
+        with self._lock:
+            self.calls += 1
+            self.errors += int(error)
+            self.total_s += seconds
+            self.max_s = max(self.max_s, seconds)
+
+    def incr(self, field):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "errors": self.errors,
+                "retries": self.retries,
+                "rejected": self.rejected,
+                "avg_ms": round(1000 * self.total_s / self.calls, 2) if self.calls else None,
+                "max_ms": round(1000 * self.max_s, 2),
+            }
+
+
+_local = threading.local()
+_async_clients = weakref.WeakKeyDictionary()  # event loop -> (httpx.AsyncClient, closer task)
+_breakers = {}
+_metrics = {}
+_limiters = {}
+_registry_lock = threading.Lock()
+
+
+def get_session():
+    """One keep-alive session per thread, so each worker reuses its TLS connections."""
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        _local.session = session
+    return session
+
+
+async def _close_with_loop(client):
+    """
+    Keep `client` until its loop shuts down. asyncio.run() (which the ASGI
+    server and async_to_sync run loops with) cancels this task on the way out,
+    and the client's connections are closed then rather than leaked.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.create_future()
+    finally:
+        _async_clients.pop(loop, None)
+        await client.aclose()
+
+
+def get_async_client():
+    """One pooled AsyncClient per event loop, shared by every coroutine on it."""
+    loop = asyncio.get_running_loop()
+    entry = _async_clients.get(loop)
+    if entry is None:
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
+        )
+        # The loop only holds tasks weakly, so the entry keeps the closer alive
+        entry = _async_clients[loop] = (client, loop.create_task(_close_with_loop(client)))
+    return entry[0]
+
+
+def _for_endpoint(endpoint):
+    with _registry_lock:
+        if endpoint not in _breakers:
+            _breakers[endpoint] = CircuitBreaker()
+            _metrics[endpoint] = EndpointMetrics(endpoint)
+            if RATE_LIMITS.get(endpoint):
+                _limiters[endpoint] = RateLimiter(RATE_LIMITS[endpoint])
+        return _breakers[endpoint], _metrics[endpoint], _limiters.get(endpoint)
+
+
+def set_rate_limit(endpoint, rate):
+    """Replace an endpoint's client-side rate limit (None or 0 removes it)."""
+    _for_endpoint(endpoint)
+    with _registry_lock:
+        if rate:
+            _limiters[endpoint] = RateLimiter(rate)
+        else:
+            _limiters.pop(endpoint, None)
+
+
+def endpoint_metrics():
+    with _registry_lock:
+        endpoints = list(_metrics)
+    return {
+        name: {**_metrics[name].as_dict(), "circuit": _breakers[name].state}
+        for name in endpoints
+    }
+
+
+def _backoff(attempt):
+    # "Full jitter": spread retries from concurrent workers instead of syncing them up.
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2**attempt))
+
+
+def _verdict(breaker, error, retryable):
+    """The breaker outcome for a call that failed with `error`."""
+    # 4xx responses (bad token, bad query) say nothing about upstream health; an
+    # undecodable body on a 2xx does, so it counts against the breaker like a 5xx.
+    client_error = isinstance(error, (requests.HTTPError, httpx.HTTPStatusError))
+    if client_error and not retryable:
+        return breaker.record_success
+    return breaker.record_failure
+
+
+def get_json(endpoint, url, params=None, timeout=10, max_retries=MAX_RETRIES):
+    """
+    GET `url` and return the decoded JSON body.
+    `endpoint` names the upstream for the circuit breaker and metrics (e.g. "geocoding").
+    `timeout` bounds the whole call including rate limiting, retries and backoff.
+    Raises UpstreamError on failure.
+    """
+    breaker, metrics, limiter = _for_endpoint(endpoint)
+    if not breaker.allow():
+        metrics.incr("rejected")
+        raise CircuitOpenError(f"{endpoint}: circuit open")
+
+    deadline = time.monotonic() + timeout
+    session = get_session()
+    attempt = 0
+    settle = breaker.release  # replaced by the call's verdict once it has one
+    try:
+        while True:
+            if limiter is not None and not limiter.acquire(deadline):
+                metrics.incr("rejected")
+                raise UpstreamError(f"{endpoint}: rate limit wait exceeds timeout")
+            started = time.perf_counter()
+            retryable = False
+            try:
+                resp = session.get(
+                    url, params=params, timeout=max(deadline - time.monotonic(), 0.001)
+                )
+                retryable = resp.status_code in RETRY_STATUSES
+                resp.raise_for_status()
+                data = resp.json()
+            except (requests.RequestException, ValueError) as e:
+                metrics.observe(time.perf_counter() - started, error=True)
+                retryable = retryable or isinstance(e, TRANSIENT_ERRORS)
+                delay = _backoff(attempt)
+                if retryable and attempt < max_retries and time.monotonic() + delay < deadline:
+                    attempt += 1
+                    metrics.incr("retries")
+                    time.sleep(delay)
+                    continue
+                settle = _verdict(breaker, e, retryable)
+                raise UpstreamError(f"{endpoint}: {e}") from e
+
+            metrics.observe(time.perf_counter() - started)
+            settle = breaker.record_success
+            return data
+    finally:
+        # Always settled, so a half-open trial can't be left in flight
+        settle()
+
+
+async def async_get_json(endpoint, url, params=None, timeout=10, max_retries=MAX_RETRIES):
+    """
+    Coroutine counterpart of get_json, on httpx. Shares the same circuit breakers,
+    rate limits and metrics as the sync client.
+    """
+    breaker, metrics, limiter = _for_endpoint(endpoint)
+    if not breaker.allow():
+        metrics.incr("rejected")
+        raise CircuitOpenError(f"{endpoint}: circuit open")
+
+    deadline = time.monotonic() + timeout
+    client = get_async_client()
+    attempt = 0
+    settle = breaker.release
+    try:
+        while True:
+            if limiter is not None and not await limiter.acquire_async(deadline):
+                metrics.incr("rejected")
+                raise UpstreamError(f"{endpoint}: rate limit wait exceeds timeout")
+            started = time.perf_counter()
+            retryable = False
+            try:
+                resp = await client.get(
+                    url, params=params, timeout=max(deadline - time.monotonic(), 0.001)
+                )
+                retryable = resp.status_code in RETRY_STATUSES
+                resp.raise_for_status()
+                data = resp.json()
+            except (httpx.HTTPError, ValueError) as e:
+                metrics.observe(time.perf_counter() - started, error=True)
+                retryable = retryable or isinstance(e, TRANSIENT_ERRORS)
+                delay = _backoff(attempt)
+                if retryable and attempt < max_retries and time.monotonic() + delay < deadline:
+                    attempt += 1
+                    metrics.incr("retries")
+                    await asyncio.sleep(delay)
+                    continue
+                settle = _verdict(breaker, e, retryable)
+                raise UpstreamError(f"{endpoint}: {e}") from e
+
+            metrics.observe(time.perf_counter() - started)
+            settle = breaker.record_success
+            return data
+    finally:
+        # Also reached when the coroutine is cancelled at a deadline
+        settle()
@@ -0,0 +1,143 @@
+"""
+Lightweight timing spans and Prometheus-style metrics.
+
+`span(name)` times a block, adds it to the current request's timings (sent
+back as a Server-Timing header by planner.middleware) and to a process-wide
+histogram. Nothing here imports Django, so planning code in worker processes
+can use it too; spans recorded there only reach that process's histograms.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Seconds; covers sub-millisecond cache hits through slow upstream calls
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Descriptions shown in browser dev tools next to Server-Timing entries
+STAGE_DESCRIPTIONS = {
+    "geocode": "Geocoding",
+    "route": "Routing",
+    "pois": "Truck stop lookup",
+    "stops": "HOS stop placement",
+    "log": "Duty log",
+    "plan": "Planning",
+    "persist": "DB writes",
+    "serialize": "Serialization",
+}
+
+_request_timings = ContextVar("planner_request_timings", default=None)
+
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by a tuple of label values."""
+
+    def __init__(self, name, help_text, label_names, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, seconds, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        slot = bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            if slot < len(self.buckets):
+                series[slot] += 1
+            series[-2] += seconds
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        for key, values in sorted(series.items()):
+            labels = ",".join(f'{n}="{v}"' for n, v in zip(self.label_names, key))
+            sep = "," if labels else ""
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels}{sep}le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{labels}{sep}le="+Inf"}} {values[-1]}')
+            lines.append(f"{self.name}_sum{{{labels}}} {values[-2]:.6f}")
+            lines.append(f"{self.name}_count{{{labels}}} {values[-1]}")
+        return lines
+
+
+STAGE_SECONDS = Histogram(
+    "planner_stage_seconds", "Time spent in each planning stage.", ["stage"]
+)
+REQUEST_SECONDS = Histogram(
+    "planner_request_seconds", "API request latency by view.", ["view", "method", "status"]
+)
+UPSTREAM_SECONDS = Histogram(
+    "planner_upstream_seconds", "Latency of each Mapbox HTTP attempt.", ["endpoint"]
+)
+
+
+class Span:
+    __slots__ = ("name", "seconds")
+
+    def __init__(self, name):
+        self.name = name
+        self.seconds = 0.0
+
+    @property
+    def ms(self):
+        return round(self.seconds * 1000, 1)
+
+
+@contextmanager
+def span(name):
+    """
+    Time a block as stage `name`. Yields a Span whose .seconds / .ms are set on
+    exit. Repeated spans of one stage within a request add up.
+    """
+    s = Span(name)
+    started = time.perf_counter()
+    try:
+        yield s
+    finally:
+        s.seconds = time.perf_counter() - started
+        STAGE_SECONDS.observe(s.seconds, stage=name)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + s.seconds
+
+
+def start_request():
+    """Begin collecting spans for the current request (or task); returns the token."""
+    return _request_timings.set({})
+
+
+def finish_request(token):
+    """Stop collecting; returns {stage: seconds} gathered since start_request."""
+    timings = _request_timings.get() or {}
+    _request_timings.reset(token)
+    return timings
+
+
+def server_timing_header(timings, total_s=None):
+    """Server-Timing header value, e.g. 'geocode;desc="Geocoding";dur=12.3, ...'."""
+    parts = []
+    for name, seconds in timings.items():
+        desc = STAGE_DESCRIPTIONS.get(name)
+        desc = f';desc="{desc}"' if desc else ""
+        parts.append(f"{name}{desc};dur={seconds * 1000:.1f}")
+    if total_s is not None:
+        parts.append(f"total;dur={total_s * 1000:.1f}")
+    return ", ".join(parts)
+
+
+def render_histograms():
+    lines = []
+    for histogram in (STAGE_SECONDS, REQUEST_SECONDS, UPSTREAM_SECONDS):
+        lines += histogram.render()
+    return lines
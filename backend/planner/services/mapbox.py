@@ -0,0 +1,82 @@
+"""
+Mapbox endpoint configuration and recorded fixtures.
+
+The base URL and token come from settings at call time, so the planner can be
+pointed at the local stand-in server (`manage.py mock_mapbox`) for offline and
+load testing. With MAPBOX_RECORD_DIR set, every successful response is also
+written there as a fixture that the stand-in server can replay.
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+from urllib.parse import unquote
+
+from django.conf import settings
+
+from .http_client import async_get_json, get_json
+
+DEFAULT_BASE_URL = "https://api.mapbox.com"
+
+
+def base_url():
+    return (getattr(settings, "MAPBOX_BASE_URL", None) or DEFAULT_BASE_URL).rstrip("/")
+
+
+def access_token():
+    return getattr(settings, "MAPBOX_API_KEY", None)
+
+
+def fixture_key(path, params):
+    """
+    Stable name for a request: the decoded path plus the query params other than
+    the token. Client and stand-in server both derive it, so they always agree.
+    """
+    query = sorted((str(k), str(v)) for k, v in (params or {}).items() if k != "access_token")
+    raw = json.dumps([unquote(path), query])
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def fixture_path(directory, endpoint, path, params):
+    return Path(directory) / endpoint / f"{fixture_key(path, params)}.json"
+
+
+def record_fixture(endpoint, path, params, data, directory=None):
+    directory = directory or getattr(settings, "MAPBOX_RECORD_DIR", None)
+    if not directory:
+        return
+    target = fixture_path(directory, endpoint, path, params)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    fixture = {
+        "path": unquote(path),
+        "params": {k: str(v) for k, v in params.items() if k != "access_token"},
+        "response": data,
+    }
+    # Write-then-rename so a concurrent reader never sees half a file
+    tmp = target.with_suffix(f".{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(fixture))
+    tmp.replace(target)
+
+
+def _request(path, params):
+    return f"{base_url()}{path}", {**params, "access_token": access_token()}
+
+
+def mapbox_get_json(endpoint, path, params, timeout, record_dir=None):
+    """
+    get_json against the configured Mapbox base URL, recording the response to
+    record_dir, or MAPBOX_RECORD_DIR if that is set.
+    """
+    url, query = _request(path, params)
+    data = get_json(endpoint, url, params=query, timeout=timeout)
+    record_fixture(endpoint, path, params, data, record_dir)
+    return data
+
+
+async def amapbox_get_json(endpoint, path, params, timeout):
+    """Async mapbox_get_json."""
+    url, query = _request(path, params)
+    data = await async_get_json(endpoint, url, params=query, timeout=timeout)
+    record_fixture(endpoint, path, params, data)
+    return data
@@ -0,0 +1,73 @@
+"""Prometheus text exposition of the planner's histograms, upstream and cache counters."""
+
+from .dedupe import dedupe_stats
+from .geocoding import geocode_cache_stats
+from .http_client import endpoint_metrics
+from .instrumentation import render_histograms
+from .routing import route_cache_stats
+from .trip_cache import trip_cache_stats
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _family(name, kind, help_text, samples):
+    """samples: [(labels dict, value), ...]"""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        label_str = ",".join(f'{k}="{v}"' for k, v in labels.items())
+        lines.append(f"{name}{{{label_str}}} {value}")
+    return lines
+
+
+def render_metrics():
+    lines = render_histograms()
+
+    upstream = endpoint_metrics()
+    for field, help_text in (
+        ("calls", "Mapbox HTTP attempts."),
+        ("errors", "Mapbox HTTP attempts that failed."),
+        ("retries", "Mapbox HTTP retries."),
+        ("rejected", "Calls refused by an open circuit breaker."),
+    ):
+        lines += _family(
+            f"planner_upstream_{field}_total",
+            "counter",
+            help_text,
+            [({"endpoint": name}, m[field]) for name, m in upstream.items()],
+        )
+    lines += _family(
+        "planner_upstream_circuit_open",
+        "gauge",
+        "1 while an endpoint's circuit breaker is not closed.",
+        [({"endpoint": name}, int(m["circuit"] != "closed")) for name, m in upstream.items()],
+    )
+
+    lines += _family(
+        "planner_plan_requests_total",
+        "counter",
+        "Deduplicated plan requests: planned, replayed from the window, or coalesced in flight.",
+        [({"outcome": outcome}, count) for outcome, count in dedupe_stats().items()],
+    )
+
+    geocode = geocode_cache_stats()
+    caches = {
+        "geocode_memory": geocode["memory"],
+        "geocode_db": geocode["db"],
+        "geocode_gazetteer": geocode["gazetteer"],
+        "route_memory": route_cache_stats(),
+        "trip_response": trip_cache_stats(),
+    }
+    for field in ("hits", "misses", "evictions"):
+        lines += _family(
+            f"planner_cache_{field}_total",
+            "counter",
+            f"Cache {field}.",
+            [({"cache": name}, s[field]) for name, s in caches.items() if field in s],
+        )
+    lines += _family(
+        "planner_cache_entries",
+        "gauge",
+        "Entries currently held by in-process caches.",
+        [({"cache": name}, s["size"]) for name, s in caches.items() if "size" in s],
+    )
+    return "\n".join(lines) + "\n"
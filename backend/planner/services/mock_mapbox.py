@@ -0,0 +1,134 @@
+"""
+A local stand-in for the Mapbox geocoding and directions APIs, serving recorded
+fixtures (see services.mapbox.record_fixture) or synthetic answers with
+injected latency and errors. Run by `manage.py mock_mapbox`; the benchmarks
+start one in-process.
+"""
+
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+from .geometry import haversine
+from .mapbox import fixture_key
+
+SYNTHETIC_SPEED_MPS = 25.0  # ~56 mph
+SYNTHETIC_STEP_M = 1000.0  # one geometry vertex per km
+
+
+def load_fixtures(directory):
+    """{(endpoint, key): response bytes} for every fixture under directory."""
+    fixtures = {}
+    for path in Path(directory).glob("*/*.json"):
+        fixture = json.loads(path.read_text())
+        key = fixture_key(fixture["path"], fixture["params"])
+        fixtures[(path.parent.name, key)] = json.dumps(fixture["response"]).encode()
+    return fixtures
+
+
+def synthetic_geocode(name):
+    """Stable pseudo-random point in the continental US for any place name."""
+    digest = hashlib.blake2b(name.casefold().encode(), digest_size=8).digest()
+    lat = 25 + int.from_bytes(digest[:4], "big") / 2**32 * 24
+    lon = -124 + int.from_bytes(digest[4:], "big") / 2**32 * 57
+    return {"type": "FeatureCollection", "features": [{"center": [lon, lat], "place_name": name}]}
+
+
+def synthetic_directions(coord_str):
+    """Straight-line route through the waypoints with a vertex every SYNTHETIC_STEP_M."""
+    waypoints = [tuple(map(float, pair.split(","))) for pair in coord_str.split(";")]
+    coordinates = [list(waypoints[0])]
+    distance = 0.0
+    for (lon1, lat1), (lon2, lat2) in zip(waypoints, waypoints[1:]):
+        leg = haversine(lat1, lon1, lat2, lon2)
+        steps = max(int(leg // SYNTHETIC_STEP_M), 1)
+        for i in range(1, steps + 1):
+            t = i / steps
+            coordinates.append([lon1 + (lon2 - lon1) * t, lat1 + (lat2 - lat1) * t])
+        distance += leg
+    return {
+        "code": "Ok",
+        "routes": [
+            {
+                "distance": distance,
+                "duration": distance / SYNTHETIC_SPEED_MPS,
+                "geometry": {"type": "LineString", "coordinates": coordinates},
+            }
+        ],
+    }
+
+
+def make_server(
+    fixtures,
+    host="127.0.0.1",
+    port=0,
+    latency_ms=0.0,
+    jitter_ms=0.0,
+    error_rate=0.0,
+    synthesize=False,
+    seed=0,
+):
+    """
+    ThreadingHTTPServer answering Mapbox-style GETs from `fixtures` (see
+    load_fixtures). Call serve_forever() on it; server.stats counts responses.
+    """
+    rng = random.Random(seed)
+    rng_lock = threading.Lock()
+    stats = {"fixture": 0, "synthetic": 0, "missing": 0, "error": 0}
+
+    def delay():
+        with rng_lock:
+            jitter = rng.uniform(-1, 1) * jitter_ms
+            fail = rng.random() < error_rate
+        return max(latency_ms + jitter, 0.0) / 1000, fail
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            path = unquote(url.path)
+            params = dict(parse_qsl(url.query))
+            endpoint = path.strip("/").split("/", 1)[0]
+
+            seconds, fail = delay()
+            time.sleep(seconds)
+            if fail:
+                stats["error"] += 1
+                return self.reply(503, {"message": "Injected failure"})
+
+            body = fixtures.get((endpoint, fixture_key(path, params)))
+            if body is not None:
+                stats["fixture"] += 1
+                return self.reply(200, body)
+            if synthesize and endpoint in ("geocoding", "directions"):
+                stats["synthetic"] += 1
+                # Split before unquoting: place names may contain "/"
+                query = unquote(url.path.rsplit("/", 1)[-1])
+                if endpoint == "geocoding":
+                    return self.reply(200, synthetic_geocode(query.removesuffix(".json")))
+                return self.reply(200, synthetic_directions(query))
+            stats["missing"] += 1
+            return self.reply(404, {"message": "No fixture for this request"})
+
+        def reply(self, code, body):
+            if not isinstance(body, bytes):
+                body = json.dumps(body).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    server.stats = stats
+    return server
@@ -0,0 +1,133 @@
+from django.db import transaction
+from django.db.models import Prefetch
+
+from planner.models import Event, LogSheet, Stop
+
+from .codec import pack_geometry, unpack_geometry_array
+
+
+def build_models(trip, plan):
+    """Unsaved Stop, Event and LogSheet instances for a TripPlan."""
+    stops = [
+        Stop(
+            trip=trip,
+            type=s.type,
+            location=s.location,
+            arrival_time=s.arrival_time,
+            duration_hours=s.duration_hours,
+            order_index=s.order_index,
+            lat=s.lat,
+            lon=s.lon,
+            added=s.added,
+        )
+        for s in plan.stops
+    ]
+    events = [
+        Event(
+            trip=trip,
+            status=e.status,
+            start_time=e.start_time,
+            end_time=e.end_time,
+            location=e.location,
+            note=e.note,
+            order_index=e.order_index,
+        )
+        for e in plan.segments
+    ]
+    log_sheets = [
+        LogSheet(trip=trip, date=sheet.date, sheet_json=sheet.to_json()) for sheet in plan.sheets
+    ]
+    return stops, events, log_sheets
+
+
+def set_route(trip, route):
+    """Copy a fetched route onto the trip's stored-route fields (geometry packed)."""
+    trip.route_geometry = pack_geometry(route["geometry"])
+    trip.route_distance_m = route["distance_m"]
+    trip.route_duration_s = route["duration_s"]
+
+
+def stored_route(trip):
+    """
+    The route saved with a trip, in get_mapbox_route's shape but with geometry
+    as an (N, 2) lat/lon array; None if the trip has no route.
+    """
+    if not trip.route_geometry:
+        return None
+    return {
+        "distance_m": trip.route_distance_m,
+        "duration_s": trip.route_duration_s,
+        "geometry": unpack_geometry_array(trip.route_geometry),
+    }
+
+
+def save_plan(trip, plan=None, route=None):
+    """
+    Write a trip, its route and (optionally) its TripPlan in one transaction with
+    a handful of statements: the trip row, then one bulk INSERT each for stops
+    and events, then one upsert of the day sheets on the (trip, date) constraint.
+    """
+    if route and route.get("geometry"):
+        set_route(trip, route)
+    with transaction.atomic():
+        trip.save()
+        if plan is None:
+            return trip
+
+        stops, events, log_sheets = build_models(trip, plan)
+        Stop.objects.bulk_create(stops)
+        Event.objects.bulk_create(events)
+        LogSheet.objects.bulk_create(
+            log_sheets,
+            update_conflicts=True,
+            unique_fields=["trip", "date"],
+            update_fields=["sheet_json"],
+        )
+    return trip
+
+
+def with_plan(queryset):
+    """
+    Prefetch each trip's stops, events and sheets in plan order. The orderings
+    match the (trip, order_index) indexes and the (trip, date) constraint.
+    """
+    return queryset.prefetch_related(
+        Prefetch("stops", queryset=Stop.objects.order_by("order_index")),
+        Prefetch("events", queryset=Event.objects.order_by("order_index")),
+        Prefetch("logsheets", queryset=LogSheet.objects.order_by("date")),
+    )
+
+
+def save_replan(trip, plan, first_stop, first_segment):
+    """
+    Write a replanned TripPlan over the trip's saved one, leaving what came
+    before the change alone: stop `first_stop` (an order_index) is updated in
+    place and the stops after it replaced, events are replaced from segment
+    `first_segment` on, and only day sheets from that segment's date on are
+    rewritten. Returns the number of sheets written.
+    """
+    stops, events, log_sheets = build_models(trip, plan)
+    changed_from = plan.segments[first_segment].start_time.date()
+    log_sheets = [sheet for sheet in log_sheets if sheet.date >= changed_from.isoformat()]
+    with transaction.atomic():
+        changed = next(s for s in stops if s.order_index == first_stop)
+        Stop.objects.filter(trip=trip, order_index=first_stop).update(
+            arrival_time=changed.arrival_time, duration_hours=changed.duration_hours
+        )
+        Stop.objects.filter(trip=trip, order_index__gt=first_stop).delete()
+        Stop.objects.bulk_create([s for s in stops if s.order_index > first_stop])
+        Event.objects.filter(trip=trip, order_index__gte=first_segment).delete()
+        Event.objects.bulk_create([e for e in events if e.order_index >= first_segment])
+        # A later start or earlier finish can leave days with no duty at all
+        LogSheet.objects.filter(trip=trip).exclude(
+            date__range=(plan.sheets[0].date, plan.sheets[-1].date)
+        ).delete()
+        LogSheet.objects.bulk_create(
+            log_sheets,
+            update_conflicts=True,
+            unique_fields=["trip", "date"],
+            update_fields=["sheet_json"],
+        )
+        # Bumps updated_at, which turns over the trip's ETags and cached JSON
+        trip.save(update_fields=["updated_at"])
+    return len(log_sheets)
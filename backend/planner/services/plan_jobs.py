@@ -0,0 +1,210 @@
+"""
+Plan jobs: POST /api/plan/jobs/ stores the request as a PlanJob row and returns
+at once; `manage.py run_plan_worker` processes run the plans and clients poll
+GET /api/plan/jobs/<id>/ for the result.
+
+The table is the queue. A worker claims a job with a conditional UPDATE, which
+works on any database, and holds it under a lease. If the worker dies, the
+lease expires and another worker picks the job up. The result is saved in the
+same transaction that marks the job succeeded, and only while this worker
+still holds the lease, so a retried job never leaves two trips behind.
+"""
+
+import logging
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from planner.models import PlanJob, Trip
+
+from .instrumentation import span
+from .persistence import save_plan, with_plan
+from .trip_planning import log_saved, prepare_single_trip, trip_response
+
+logger = logging.getLogger(__name__)
+
+PLAN_JOB_MAX_ATTEMPTS = getattr(settings, "PLAN_JOB_MAX_ATTEMPTS", 3)
+PLAN_JOB_LEASE = getattr(settings, "PLAN_JOB_LEASE", 120)  # seconds
+PLAN_JOB_RETRY_BACKOFF = getattr(settings, "PLAN_JOB_RETRY_BACKOFF", 5)  # seconds, doubles
+PLAN_JOB_RETRY_BACKOFF_CAP = 300  # seconds
+
+# Claim candidates fetched per poll; more than one so racing workers rarely collide
+CLAIM_BATCH = 5
+
+
+class LeaseLost(Exception):
+    """The job was taken over by another worker while this one was running it."""
+
+
+def enqueue_plan_job(trip_input, geometry_options=None):
+    return PlanJob.objects.create(
+        trip_input=trip_input,
+        geometry_options=geometry_options or {},
+        max_attempts=PLAN_JOB_MAX_ATTEMPTS,
+    )
+
+
+def job_status(job):
+    """Response body for GET /api/plan/jobs/<id>/; includes the trip once succeeded."""
+    body = {
+        "id": job.id,
+        "status": job.status,
+        "attempts": job.attempts,
+        "created_at": job.created_at.isoformat(),
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+        "trip_id": job.trip_id,
+    }
+    if job.error:
+        body["error"] = job.error
+    if job.status == PlanJob.SUCCEEDED and job.trip_id:
+        trip = with_plan(Trip.objects).filter(pk=job.trip_id).first()
+        if trip is not None:
+            body["result"] = trip_response(trip, geometry_options=job.geometry_options)
+    return body
+
+
+def _runnable(now):
+    """Queued jobs that are due, and running jobs whose worker's lease ran out."""
+    return Q(status=PlanJob.QUEUED, run_after__lte=now) | Q(
+        status=PlanJob.RUNNING, lease_expires_at__lt=now, attempts__lt=F("max_attempts")
+    )
+
+
+def claim_job():
+    """Take the oldest runnable job for this worker, or return None if there is none."""
+    now = timezone.now()
+    candidates = list(
+        PlanJob.objects.filter(_runnable(now))
+        .order_by("run_after", "id")
+        .values_list("id", flat=True)[:CLAIM_BATCH]
+    )
+    token = uuid.uuid4().hex
+    for job_id in candidates:
+        # Only one worker's UPDATE can still match the runnable condition
+        claimed = PlanJob.objects.filter(_runnable(now), id=job_id).update(
+            status=PlanJob.RUNNING,
+            lease_token=token,
+            lease_expires_at=now + timedelta(seconds=PLAN_JOB_LEASE),
+            attempts=F("attempts") + 1,
+            started_at=now,
+        )
+        if claimed:
+            return PlanJob.objects.get(id=job_id)
+    return None
+
+
+def fail_abandoned_jobs():
+    """Give up on running jobs whose lease expired with no attempts left."""
+    now = timezone.now()
+    return PlanJob.objects.filter(
+        status=PlanJob.RUNNING, lease_expires_at__lt=now, attempts__gte=F("max_attempts")
+    ).update(
+        status=PlanJob.FAILED,
+        error="Worker stopped responding",
+        lease_token="",
+        finished_at=now,
+    )
+
+
+def _held(job):
+    return PlanJob.objects.filter(id=job.id, status=PlanJob.RUNNING, lease_token=job.lease_token)
+
+
+def _retry_or_fail(job, error):
+    if job.attempts < job.max_attempts:
+        delay = min(PLAN_JOB_RETRY_BACKOFF * 2 ** (job.attempts - 1), PLAN_JOB_RETRY_BACKOFF_CAP)
+        _held(job).update(
+            status=PlanJob.QUEUED,
+            error=error,
+            lease_token="",
+            run_after=timezone.now() + timedelta(seconds=delay),
+        )
+        logger.warning("plan job retrying id=%s attempt=%d error=%s", job.id, job.attempts, error)
+    else:
+        _held(job).update(
+            status=PlanJob.FAILED, error=error, lease_token="", finished_at=timezone.now()
+        )
+        logger.warning("plan job failed id=%s attempts=%d error=%s", job.id, job.attempts, error)
+
+
+def run_job(job):
+    """
+    Plan and persist a claimed job. A plan that comes back without a route
+    (unresolved location, Mapbox failing) is retried while attempts remain; the
+    last attempt saves the trip without stops, as POST /api/plan/ does.
+    """
+    timeout = getattr(settings, "PLAN_REQUEST_TIMEOUT", 20)
+    try:
+        trip, plan, route = prepare_single_trip(job.trip_input, timeout)
+        if plan is None and job.attempts < job.max_attempts:
+            _retry_or_fail(job, "Could not geocode or route the trip")
+            return
+        with span("persist"), transaction.atomic():
+            save_plan(trip, plan, route)
+            finished = _held(job).update(
+                status=PlanJob.SUCCEEDED,
+                trip=trip,
+                error="",
+                lease_token="",
+                finished_at=timezone.now(),
+            )
+            if not finished:
+                raise LeaseLost()
+        log_saved(trip, plan)
+    except LeaseLost:
+        logger.warning("plan job lease lost id=%s; result discarded", job.id)
+    except Exception:
+        # Details go to the log; job.error is shown to whoever polls the job
+        logger.exception("plan job error id=%s", job.id)
+        _retry_or_fail(job, "Internal error while planning the trip")
+
+
+def work(stop, poll_interval=1.0, burst=False):
+    """
+    Worker loop for one thread: claim and run jobs until `stop` (a threading.Event)
+    is set, or, with burst, until no job is runnable.
+    """
+    while not stop.is_set():
+        job = None
+        try:
+            fail_abandoned_jobs()
+            job = claim_job()
+            if job is not None:
+                run_job(job)
+        except Exception:
+            # A database hiccup while polling shouldn't take the worker down
+            logger.exception("plan worker poll failed")
+        finally:
+            close_old_connections()
+        if job is None:
+            if burst:
+                return
+            stop.wait(poll_interval)
+
+
+def run_workers(concurrency=4, poll_interval=1.0, burst=False, stop=None):
+    """Run `concurrency` worker threads; returns once they have all stopped."""
+    stop = stop or threading.Event()
+    threads = [
+        threading.Thread(
+            target=work, args=(stop, poll_interval, burst), name=f"plan-worker-{i}", daemon=True
+        )
+        for i in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    try:
+        while any(thread.is_alive() for thread in threads):
+            time.sleep(0.2)
+    except KeyboardInterrupt:
+        # Let running jobs finish; anything cut short is picked up again after its lease
+        stop.set()
+        for thread in threads:
+            thread.join()
@@ -0,0 +1,315 @@
+"""
+Truck stops and rest areas, indexed for snapping planned stops to real places.
+
+`build_poi_index` buckets POIs into a uniform lat/lon grid and stores them
+sorted by cell, with a sorted array of cell keys, as an array file (see
+services.array_file). `PoiIndex.corridor` answers one bulk query per route:
+every POI within a detour radius of the route, with its distance along it.
+hos.Timeline then picks from that Corridor, with a binary search, for each
+fuel, break or rest stop it places.
+
+Nothing here imports Django.
+"""
+
+import csv
+import json
+from dataclasses import dataclass
+from math import ceil, cos, pi, radians
+
+import numpy as np
+
+from .array_file import open_cached, pack_strings, read_arrays, write_arrays
+from .geometry import EARTH_RADIUS_M
+
+MAGIC = b"POIIDX1\n"
+
+# truck_stop: fuel and overnight truck parking; fuel: truck fuel only; rest_area: parking only
+KINDS = ("truck_stop", "fuel", "rest_area")
+# POI kinds that can host each planned stop type
+STOP_KINDS = {
+    "fuel": ("truck_stop", "fuel"),
+    "break": ("truck_stop", "rest_area", "fuel"),
+    "rest": ("truck_stop", "rest_area"),
+    "restart": ("truck_stop", "rest_area"),
+}
+KIND_LABELS = {"truck_stop": "Truck stop", "fuel": "Fuel station", "rest_area": "Rest area"}
+
+DEFAULT_CELL_DEG = 0.1  # about 11 km north-south
+METERS_PER_DEGREE = EARTH_RADIUS_M * pi / 180
+MAX_LABEL_LENGTH = 255  # Stop.location
+_KEY_OFFSET = 1 << 20
+_KEY_SPAN = 1 << 21
+
+COLUMNS = {
+    "name": ("name",),
+    "lat": ("lat", "latitude"),
+    "lon": ("lon", "lng", "longitude"),
+    "kind": ("kind", "type"),
+    "city": ("city",),
+    "state": ("state",),
+}
+
+
+def _label(name, kind, city="", state=""):
+    label = ", ".join(part for part in (name or KIND_LABELS[kind], city, state) if part)
+    return label[:MAX_LABEL_LENGTH]
+
+
+def kind_from_tags(tags):
+    """POI kind for a GeoJSON feature's properties (a "kind" or OSM tags), or None."""
+    if tags.get("kind") in KINDS:
+        return tags["kind"]
+    if tags.get("highway") == "rest_area":
+        return "rest_area"
+    if tags.get("highway") == "services" or tags.get("amenity") == "truck_stop":
+        return "truck_stop"
+    # Only stations tagged as taking trucks; most fuel stations can't fit a rig
+    if tags.get("amenity") == "fuel" and tags.get("hgv") in ("yes", "designated"):
+        return "truck_stop"
+    return None
+
+
+def _feature_point(geometry):
+    if geometry["type"] == "Point":
+        lon, lat = geometry["coordinates"][:2]
+        return lat, lon
+    if geometry["type"] == "Polygon":
+        ring = np.asarray(geometry["coordinates"][0], dtype=np.float64)[:, :2]
+        lon, lat = ring.mean(axis=0)
+        return float(lat), float(lon)
+    return None
+
+
+def rows_from_file(path):
+    """
+    (label, lat, lon, kind) from GeoJSON Point/Polygon features with a "kind"
+    property or OSM tags (amenity=fuel + hgv=yes, highway=services|rest_area),
+    or from a CSV with name,lat,lon,kind[,city,state] columns.
+    """
+    if path.endswith((".geojson", ".json")):
+        with open(path) as f:
+            data = json.load(f)
+        for feature in data.get("features", []):
+            tags = feature.get("properties") or {}
+            kind = kind_from_tags(tags)
+            point = _feature_point(feature["geometry"]) if feature.get("geometry") else None
+            if kind and point:
+                name = tags.get("name") or tags.get("brand") or tags.get("operator")
+                yield _label(name, kind), point[0], point[1], kind
+        return
+
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.reader(f)
+        header = [h.strip().casefold() for h in next(reader)]
+        index = {}
+        for column, names in COLUMNS.items():
+            found = [header.index(n) for n in names if n in header]
+            if found:
+                index[column] = found[0]
+        missing = {"lat", "lon", "kind"} - set(index)
+        if missing:
+            raise ValueError(f"{path}: missing column(s) {', '.join(sorted(missing))}")
+        for row in reader:
+            if not row or row[index["kind"]].strip() not in KINDS:
+                continue
+            kind = row[index["kind"]].strip()
+            name, city, state = (
+                row[index[column]].strip() if column in index else ""
+                for column in ("name", "city", "state")
+            )
+            lat, lon = float(row[index["lat"]]), float(row[index["lon"]])
+            yield _label(name, kind, city, state), lat, lon, kind
+
+
+def _cell_keys(lat, lon, cell_deg):
+    ix = np.floor(np.asarray(lat) / cell_deg).astype(np.int64)
+    iy = np.floor(np.asarray(lon) / cell_deg).astype(np.int64)
+    return (ix + _KEY_OFFSET) * _KEY_SPAN + (iy + _KEY_OFFSET)
+
+
+def build_poi_index(rows, cell_deg=DEFAULT_CELL_DEG):
+    """Arrays and metadata for `write_poi_index` from (label, lat, lon, kind) rows."""
+    rows = [r for r in rows if -90 <= r[1] <= 90 and -180 <= r[2] <= 180]
+    lat = np.array([r[1] for r in rows], dtype=np.float64)
+    lon = np.array([r[2] for r in rows], dtype=np.float64)
+    keys = _cell_keys(lat, lon, cell_deg)
+    order = np.argsort(keys, kind="stable")
+    cell_keys, starts = np.unique(keys[order], return_index=True)
+    name_bytes, name_offsets = pack_strings([rows[i][0] for i in order.tolist()])
+    arrays = {
+        "lat": lat[order],
+        "lon": lon[order],
+        "kind": np.array([KINDS.index(rows[i][3]) for i in order.tolist()], dtype=np.uint8),
+        "name_bytes": name_bytes,
+        "name_offsets": name_offsets,
+        "cell_keys": cell_keys,
+        "cell_offsets": np.append(starts, len(rows)).astype(np.int64),
+    }
+    return arrays, {"pois": len(rows), "cell_deg": cell_deg, "kinds": list(KINDS)}
+
+
+def write_poi_index(path, arrays, meta):
+    write_arrays(path, MAGIC, arrays, meta)
+
+
+@dataclass(slots=True)
+class Poi:
+    name: str
+    kind: str
+    lat: float
+    lon: float
+    route_idx: int  # nearest route vertex
+    along_m: float  # where the POI's exit is, in meters along the route
+    off_route_m: float
+
+
+class Corridor:
+    """
+    The POIs near one route, ordered by distance along it. Plain arrays, so it
+    pickles cheaply into planning worker processes.
+    """
+
+    def __init__(self, along_m, off_route_m, route_idx, lat, lon, kind, names, max_backtrack_m):
+        self.along_m = along_m
+        self.off_route_m = off_route_m
+        self.route_idx = route_idx
+        self.lat = lat
+        self.lon = lon
+        self.kind = kind
+        self.names = names
+        self.max_backtrack_m = max_backtrack_m
+
+    def __len__(self):
+        return len(self.names)
+
+    def best(self, stop_type, from_m, to_m):
+        """
+        The POI to stop at instead of `to_m` meters along the route: the one
+        that costs least driving given up plus detour there and back, among
+        those suited to stop_type between from_m and to_m and no more than
+        max_backtrack_m short of it. The detour is driven too, so it has to fit
+        in the driving given up. None if there is none.
+        """
+        kinds = STOP_KINDS.get(stop_type)
+        if not kinds or not len(self):
+            return None
+        lo = max(from_m, to_m - self.max_backtrack_m)
+        i = int(np.searchsorted(self.along_m, lo, side="left"))
+        j = int(np.searchsorted(self.along_m, to_m, side="right"))
+        if i >= j:
+            return None
+        given_up, detour = to_m - self.along_m[i:j], 2 * self.off_route_m[i:j]
+        cost = given_up + detour
+        suited = np.isin(self.kind[i:j], [KINDS.index(k) for k in kinds]) & (detour <= given_up)
+        if not suited.any():
+            return None
+        k = i + int(np.argmin(np.where(suited, cost, np.inf)))
+        return Poi(
+            name=self.names[k],
+            kind=KINDS[self.kind[k]],
+            lat=float(self.lat[k]),
+            lon=float(self.lon[k]),
+            route_idx=int(self.route_idx[k]),
+            along_m=float(self.along_m[k]),
+            off_route_m=float(self.off_route_m[k]),
+        )
+
+
+def _project(route_geom, idx, lat, lon):
+    """
+    Off-route distance and distance along the route of each POI, projected onto
+    the route segments either side of its nearest vertex `idx`. Local flat-earth
+    approximation, which is exact enough over a few kilometers.
+    """
+    points, cum = route_geom.points, route_geom.cum_dist
+    last = len(points) - 1
+    scale = np.cos(np.radians(lat)) * METERS_PER_DEGREE
+    best_off = np.full(len(idx), np.inf)
+    best_along = cum[idx].copy()
+    for a, b in ((idx - 1, idx), (idx, idx + 1)):
+        a, b = np.clip(a, 0, last), np.clip(b, 0, last)
+        ax, ay = (points[a, 1] - lon) * scale, (points[a, 0] - lat) * METERS_PER_DEGREE
+        dx = (points[b, 1] - points[a, 1]) * scale
+        dy = (points[b, 0] - points[a, 0]) * METERS_PER_DEGREE
+        length2 = dx * dx + dy * dy
+        t = np.clip(-(ax * dx + ay * dy) / np.where(length2 > 0, length2, 1.0), 0.0, 1.0)
+        off = np.hypot(ax + t * dx, ay + t * dy)
+        along = cum[a] + t * (cum[b] - cum[a])
+        closer = off < best_off
+        best_off = np.where(closer, off, best_off)
+        best_along = np.where(closer, along, best_along)
+    return best_off, best_along
+
+
+class PoiIndex:
+    """Memory-mapped POI grid answering route corridor queries."""
+
+    def __init__(self, arrays, meta):
+        self.meta = meta
+        self.cell_deg = meta["cell_deg"]
+        for name, array in arrays.items():
+            setattr(self, name, array)
+
+    @classmethod
+    def open(cls, path):
+        return cls(*read_arrays(path, MAGIC))
+
+    def name(self, i):
+        start, end = self.name_offsets[i], self.name_offsets[i + 1]
+        return bytes(self.name_bytes[start:end]).decode()
+
+    def _route_cells(self, route_geom, radius_m):
+        """Keys of every grid cell within radius_m of the route."""
+        points, cum = route_geom.points, route_geom.cum_dist
+        # Sample at half a cell so no cell the route crosses is skipped between vertices
+        step_m = self.cell_deg * METERS_PER_DEGREE / 2
+        along = np.arange(0.0, route_geom.total_distance_m, step_m)
+        lat = np.concatenate([points[:, 0], np.interp(along, cum, points[:, 0])])
+        lon = np.concatenate([points[:, 1], np.interp(along, cum, points[:, 1])])
+        cells = np.unique(_cell_keys(lat, lon, self.cell_deg))
+
+        # Grow by the radius; longitude cells narrow toward the poles
+        max_lat = min(float(np.abs(points[:, 0]).max()) + self.cell_deg, 89.0)
+        r_lat = ceil(radius_m / (self.cell_deg * METERS_PER_DEGREE))
+        r_lon = ceil(radius_m / (self.cell_deg * METERS_PER_DEGREE * cos(radians(max_lat))))
+        dx, dy = np.meshgrid(np.arange(-r_lat, r_lat + 1), np.arange(-r_lon, r_lon + 1))
+        shifts = (dx * _KEY_SPAN + dy).ravel()
+        return np.unique((cells[:, None] + shifts[None, :]).ravel())
+
+    def corridor(self, route_geom, radius_m, max_backtrack_m):
+        """Corridor of POIs within radius_m of a RouteGeometry, in one bulk lookup."""
+        empty = np.zeros(0)
+        if len(route_geom) < 2 or not len(self.cell_keys):
+            return Corridor(empty, empty, empty, empty, empty, empty, [], max_backtrack_m)
+
+        keys = self._route_cells(route_geom, radius_m)
+        pos = np.searchsorted(self.cell_keys, keys)
+        found = pos < len(self.cell_keys)
+        found[found] = self.cell_keys[pos[found]] == keys[found]
+        pos = pos[found]
+        starts, ends = self.cell_offsets[pos], self.cell_offsets[pos + 1]
+        counts = ends - starts
+        # Rows of all matched cells: each cell's contiguous run, concatenated
+        rows = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+
+        lat, lon = np.asarray(self.lat[rows]), np.asarray(self.lon[rows])
+        idx = route_geom.nearest_indices(lat, lon)
+        off_route, along = _project(route_geom, idx, lat, lon)
+        near = off_route <= radius_m
+        order = np.argsort(along[near], kind="stable")
+        rows, idx = rows[near][order], idx[near][order]
+        return Corridor(
+            along_m=along[near][order],
+            off_route_m=off_route[near][order],
+            route_idx=idx,
+            lat=lat[near][order],
+            lon=lon[near][order],
+            kind=np.asarray(self.kind[rows]),
+            names=[self.name(int(i)) for i in rows],
+            max_backtrack_m=max_backtrack_m,
+        )
+
+
+def load_poi_index(path):
+    """The PoiIndex at `path`, mapped once per process and reopened if the file changes."""
+    return open_cached(path, PoiIndex.open)
@@ -0,0 +1,206 @@
+"""
+Replanning a saved trip after something changed on the road: the driver got to
+a stop late or stayed longer than planned, or stops were added or removed
+further on. The timeline is laid out again only after that stop, along the
+route stored with the trip, and only the rows and day sheets it changes are
+rewritten; nothing is geocoded or routed.
+"""
+
+import logging
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from planner.models import PlanRequest, Trip
+
+from .event_planning import PlannedStop, plan_trip
+from .geometry import RouteGeometry
+from .hos import ReplanError, Waypoint, resume_trip
+from .instrumentation import span
+from .persistence import save_replan, stored_route, with_plan
+from .trip_planning import PlanInputError, route_pois
+
+logger = logging.getLogger(__name__)
+
+# Stops a replan can add along the route
+ADDABLE_STOP_TYPES = ("fuel", "break", "rest", "restart")
+# Saved stops that stay fixed when the timeline after them is laid out again
+WAYPOINT_STOP_TYPES = ("pickup", "dropoff")
+
+
+def _number(value, name, low=None, high=None):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise PlanInputError(f"{name} must be a number")
+    if (low is not None and number < low) or (high is not None and number > high):
+        raise PlanInputError(f"{name} is out of range")
+    return number
+
+
+def _order_index(value, name):
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise PlanInputError(f"{name} must be a stop order_index")
+    return value
+
+
+def parse_added_stop(data):
+    if not isinstance(data, dict):
+        raise PlanInputError("add_stops entries must be objects")
+    if data.get("type") not in ADDABLE_STOP_TYPES:
+        raise PlanInputError(f"Added stop type must be one of: {', '.join(ADDABLE_STOP_TYPES)}")
+    stop = {
+        "type": data["type"],
+        "lat": _number(data.get("lat"), "lat", -90, 90),
+        "lon": _number(data.get("lon"), "lon", -180, 180),
+        "location": str(data.get("location") or ""),
+        "duration_hours": None,
+    }
+    if data.get("duration_hours") is not None:
+        stop["duration_hours"] = _number(data["duration_hours"], "duration_hours", 0, 168)
+    return stop
+
+
+def parse_replan_input(data):
+    """
+    Validate a replan body; returns a clean dict or raises PlanInputError.
+
+      {"stop": <order_index of the stop reached>,
+       "arrival_time": <ISO datetime actually arrived>,    optional
+       "duration_hours": <hours actually spent there>,     optional
+       "add_stops": [{"type", "lat", "lon", "location"?, "duration_hours"?}, ...],
+       "remove_stops": [<order_index of an added stop>, ...]}
+    """
+    if not isinstance(data, dict):
+        raise PlanInputError("Replan input must be an object")
+    changes = {
+        "stop": _order_index(data.get("stop"), "stop"),
+        "arrival_time": None,
+        "duration_hours": None,
+        "add_stops": data.get("add_stops") or [],
+        "remove_stops": data.get("remove_stops") or [],
+    }
+    if data.get("arrival_time") is not None:
+        arrival_time = parse_datetime(str(data["arrival_time"]))
+        if arrival_time is None:
+            raise PlanInputError("arrival_time must be an ISO 8601 datetime")
+        if timezone.is_naive(arrival_time):
+            arrival_time = timezone.make_aware(arrival_time)
+        changes["arrival_time"] = arrival_time
+    if data.get("duration_hours") is not None:
+        changes["duration_hours"] = _number(data["duration_hours"], "duration_hours", 0, 168)
+    if not isinstance(changes["add_stops"], list) or not isinstance(changes["remove_stops"], list):
+        raise PlanInputError("add_stops and remove_stops must be lists")
+    changes["add_stops"] = [parse_added_stop(stop) for stop in changes["add_stops"]]
+    changes["remove_stops"] = {_order_index(i, "remove_stops") for i in changes["remove_stops"]}
+    unchanged = changes["arrival_time"] is None and changes["duration_hours"] is None
+    if unchanged and not changes["add_stops"] and not changes["remove_stops"]:
+        raise PlanInputError("Nothing to replan")
+    return changes
+
+
+def planned_stop(stop):
+    return PlannedStop(
+        type=stop.type,
+        location=stop.location,
+        arrival_time=stop.arrival_time,
+        duration_hours=stop.duration_hours,
+        order_index=stop.order_index,
+        lat=stop.lat,
+        lon=stop.lon,
+        added=stop.added,
+    )
+
+
+def waypoints_ahead(route_geom, ahead, changes):
+    """Waypoints after the reached stop: saved pickup/dropoff and added stops, as changed."""
+    removable = {s.order_index for s in ahead if s.added}
+    invalid = sorted(changes["remove_stops"] - removable)
+    if invalid:
+        raise PlanInputError(
+            f"Stop {invalid[0]} can't be removed; only added stops still ahead can be"
+        )
+
+    waypoints = []
+    for s in ahead:
+        if s.order_index in changes["remove_stops"]:
+            continue
+        if s.type in WAYPOINT_STOP_TYPES or s.added:
+            if s.lat is None or s.lon is None:
+                raise PlanInputError("Trip was saved without stop coordinates; plan it again")
+            idx = route_geom.nearest_index(s.lat, s.lon)
+            waypoints.append(
+                Waypoint(s.type, s.location, idx, s.lat, s.lon, s.duration_hours, s.added)
+            )
+    for stop in changes["add_stops"]:
+        idx = route_geom.nearest_index(stop["lat"], stop["lon"])
+        lat, lon = route_geom.point(idx)
+        location = stop["location"] or f"{lat},{lon}"
+        waypoints.append(
+            Waypoint(stop["type"], location, idx, lat, lon, stop["duration_hours"], added=True)
+        )
+    return waypoints
+
+
+def replan_trip(trip_id, changes):
+    """
+    Apply `changes` (from parse_replan_input) to a saved trip and save the new
+    plan from the reached stop on. Returns the trip with its plan prefetched,
+    or None if there is no such trip; raises PlanInputError for changes that
+    don't fit the trip.
+    """
+    with transaction.atomic():
+        # One replan per trip at a time (a no-op on SQLite, which locks the whole DB)
+        trip = Trip.objects.select_for_update().filter(pk=trip_id).first()
+        if trip is None:
+            return None
+        route = stored_route(trip)
+        saved = list(trip.stops.order_by("order_index"))
+        if route is None or not saved:
+            raise PlanInputError("Trip has no saved plan to replan")
+        index = changes["stop"]
+        if not 1 <= index <= len(saved):
+            raise PlanInputError(f"Trip has no stop {index}")
+
+        pois = route_pois(route)
+        with span("stops"):
+            route_geom = RouteGeometry(route["geometry"], route["distance_m"], route["duration_s"])
+            waypoints = waypoints_ahead(route_geom, saved[index:], changes)
+            try:
+                stops = resume_trip(
+                    route_geom,
+                    [planned_stop(s) for s in saved[:index]],
+                    waypoints,
+                    trip.current_cycle_used,
+                    changes["arrival_time"],
+                    changes["duration_hours"],
+                    pois,
+                )
+            except ReplanError as e:
+                raise PlanInputError(str(e))
+        with span("log"):
+            plan = plan_trip(stops)
+
+        # Duty segments ending before the reached stop's old and new arrival are
+        # unchanged, as is the drive there if the arrival didn't move
+        old_arrival, new_arrival = saved[index - 1].arrival_time, stops[index - 1].arrival_time
+        if old_arrival == new_arrival:
+            first_segment = sum(1 for seg in plan.segments if seg.end_time <= new_arrival)
+        else:
+            cutoff = min(old_arrival, new_arrival)
+            first_segment = sum(1 for seg in plan.segments if seg.end_time < cutoff)
+        with span("persist"):
+            sheets = save_replan(trip, plan, index, first_segment)
+            # The trip no longer answers its original request (services.dedupe)
+            PlanRequest.objects.filter(trip=trip).delete()
+
+    logger.info(
+        "trip replanned id=%s stop=%d stops=%d events=%d sheets=%d",
+        trip.id,
+        index,
+        len(stops) - index,
+        len(plan.segments) - first_segment,
+        sheets,
+    )
+    return with_plan(Trip.objects).get(pk=trip.id)
@@ -0,0 +1,367 @@
+"""
+Offline routing over a preprocessed road graph.
+
+`build_graph` turns road centrelines into a directed graph whose nodes are only
+junctions and line ends: runs of shape points between junctions are folded into
+a single edge that keeps its geometry. `write_graph` stores the result as an
+array file (see services.array_file) that `RoadGraph.open` memory-maps. Queries snap each waypoint to the nearest road
+vertex and run A* on travel time between them.
+
+The search is plain Python with no preprocessing (no contraction hierarchies),
+so it is meant for regional graphs and short-to-medium legs: each leg gives up
+after settling `max_settled` nodes, and callers fall back to another backend.
+
+Nothing here imports Django; services.routing wires it in as the "local" backend.
+"""
+
+import heapq
+import re
+import threading
+from math import inf, sqrt
+
+import numpy as np
+
+from .array_file import open_cached, read_arrays, write_arrays
+from .geometry import SpatialGrid, haversine, segment_lengths
+
+MAGIC = b"RGRAPH1\n"
+
+# Used when a line has no usable maxspeed; keys are OSM highway classes
+HIGHWAY_SPEEDS_KPH = {
+    "motorway": 105,
+    "trunk": 90,
+    "primary": 80,
+    "secondary": 70,
+    "tertiary": 60,
+    "motorway_link": 60,
+    "trunk_link": 50,
+    "primary_link": 45,
+}
+DEFAULT_SPEED_KPH = 50
+KPH = 1000 / 3600
+MPH = 1609.34 / 3600
+
+_TARGET = -1
+
+
+# ---- Building ----
+
+
+def _speed_mps(props, default_kph):
+    raw = props.get("maxspeed")
+    if raw is not None:
+        match = re.match(r"\s*(\d+(?:\.\d+)?)\s*(mph)?", str(raw))
+        if match and float(match.group(1)) > 0:
+            return float(match.group(1)) * (MPH if match.group(2) else KPH)
+    return HIGHWAY_SPEEDS_KPH.get(props.get("highway"), default_kph) * KPH
+
+
+def _oneway(props):
+    """1 for digitised direction only, -1 for the reverse only, 0 for both ways."""
+    value = str(props.get("oneway", "")).strip().lower()
+    if value in ("yes", "true", "1"):
+        return 1
+    if value in ("-1", "reverse"):
+        return -1
+    return 0
+
+
+def lines_from_geojson(data, default_speed_kph=DEFAULT_SPEED_KPH):
+    """
+    (points, speed_mps, oneway) for every LineString/MultiLineString feature.
+    Speed comes from a `maxspeed` property ("65 mph", "100") or the `highway` class.
+    """
+    features = data.get("features", []) if data.get("type") == "FeatureCollection" else [data]
+    for feature in features:
+        geometry = feature.get("geometry") or {}
+        props = feature.get("properties") or {}
+        if geometry.get("type") == "LineString":
+            parts = [geometry["coordinates"]]
+        elif geometry.get("type") == "MultiLineString":
+            parts = geometry["coordinates"]
+        else:
+            continue
+        speed, oneway = _speed_mps(props, default_speed_kph), _oneway(props)
+        for coords in parts:
+            if len(coords) >= 2:
+                yield [(c[1], c[0]) for c in coords], speed, oneway
+
+
+def build_graph(lines, precision=6):
+    """
+    Arrays and metadata for `write_graph` from (points, speed_mps, oneway) lines,
+    points as [(lat, lon), ...]. Points equal after rounding to `precision` decimals
+    are the same place; a place becomes a node if it ends a line or is shared.
+    """
+    lines = [
+        ([(round(lat, precision), round(lon, precision)) for lat, lon in points], speed, oneway)
+        for points, speed, oneway in lines
+    ]
+    seen = {}
+    for points, _, _ in lines:
+        for i, p in enumerate(points):
+            end = i == 0 or i == len(points) - 1
+            seen[p] = seen.get(p, 0) + (2 if end else 1)
+    node_ids = {}
+    for points, _, _ in lines:
+        for p in points:
+            if seen[p] > 1 and p not in node_ids:
+                node_ids[p] = len(node_ids)
+
+    # One list per road piece: its directed edges as (from, to, length_m, duration_s, shape)
+    edges = []
+    for points, speed, oneway in lines:
+        start = 0
+        for i in range(1, len(points)):
+            if points[i] not in node_ids:
+                continue
+            u, v = node_ids[points[start]], node_ids[points[i]]
+            shape = np.array(points[start : i + 1], dtype=np.float64)
+            start = i
+            length = float(segment_lengths(shape).sum())
+            if length <= 0:
+                continue
+            pair = []
+            if oneway >= 0:
+                pair.append((u, v, length, length / speed, shape))
+            if oneway <= 0:
+                pair.append((v, u, length, length / speed, shape[::-1]))
+            edges.append(pair)
+
+    directed = [e for pair in edges for e in pair]
+    rev = np.full(len(directed), -1, dtype=np.int64)
+    i = 0
+    for pair in edges:
+        if len(pair) == 2:
+            rev[i], rev[i + 1] = i + 1, i
+        i += len(pair)
+
+    # CSR order: edges grouped by source node
+    order = np.argsort(np.array([e[0] for e in directed], dtype=np.int64), kind="stable")
+    position = np.empty_like(order)
+    position[order] = np.arange(len(order))
+    directed = [directed[k] for k in order]
+    rev = np.where(rev[order] >= 0, position[rev[order]], -1)
+
+    nodes = np.array(list(node_ids), dtype=np.float64).reshape(-1, 2)
+    edge_from = np.array([e[0] for e in directed], dtype=np.int32)
+    shapes = [e[4] for e in directed]
+    counts = np.array([len(s) for s in shapes], dtype=np.int64)
+    geom = np.concatenate(shapes) if shapes else np.empty((0, 2))
+    cum = [np.concatenate([[0.0], np.cumsum(segment_lengths(s))]) for s in shapes]
+    durations = np.array([e[3] for e in directed], dtype=np.float64)
+    lengths = np.array([e[2] for e in directed], dtype=np.float64)
+
+    arrays = {
+        "node_lat": nodes[:, 0],
+        "node_lon": nodes[:, 1],
+        "edge_ptr": np.searchsorted(edge_from, np.arange(len(nodes) + 1)).astype(np.int64),
+        "edge_from": edge_from,
+        "edge_to": np.array([e[1] for e in directed], dtype=np.int32),
+        "edge_length_m": lengths,
+        "edge_duration_s": durations,
+        "edge_rev": rev.astype(np.int32),
+        "edge_geom_ptr": np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+        "geom_lat": np.ascontiguousarray(geom[:, 0]),
+        "geom_lon": np.ascontiguousarray(geom[:, 1]),
+        "geom_cum_m": np.concatenate(cum) if cum else np.empty(0),
+    }
+    meta = {
+        "nodes": len(nodes),
+        "edges": len(directed),
+        "precision": precision,
+        "max_speed_mps": float((lengths / durations).max()) if len(directed) else 0.0,
+    }
+    return arrays, meta
+
+
+# ---- Querying ----
+
+
+class RoadGraph:
+    """A memory-mapped road graph answering shortest-time routes between points."""
+
+    def __init__(self, arrays, meta):
+        self.meta = meta
+        for name, array in arrays.items():
+            setattr(self, name, array)
+        self.max_speed_mps = meta["max_speed_mps"]
+        self._grid = None
+        self._snap_vertices = None
+        self._grid_lock = threading.Lock()
+
+    @classmethod
+    def open(cls, path):
+        return cls(*read_arrays(path, MAGIC))
+
+    def _snap_grid(self):
+        """Grid over every road vertex, each two-way road counted once."""
+        with self._grid_lock:
+            if self._grid is None:
+                ids = np.arange(len(self.edge_rev))
+                canonical = (self.edge_rev < 0) | (ids < self.edge_rev)
+                starts, ends = self.edge_geom_ptr[:-1][canonical], self.edge_geom_ptr[1:][canonical]
+                counts = ends - starts
+                # Every index in each [start, end) range, without a Python loop
+                offsets = np.cumsum(counts) - counts
+                vertices = np.repeat(starts - offsets, counts) + np.arange(counts.sum())
+                points = np.column_stack([self.geom_lat[vertices], self.geom_lon[vertices]])
+                # Cells sized from the bounding box, since road vertices aren't one polyline
+                span = np.ptp(points, axis=0) if len(points) else np.zeros(2)
+                cell = sqrt(max(float(span[0] * span[1]), 0.0) * 32 / max(len(points), 1))
+                self._snap_vertices = vertices
+                self._grid = SpatialGrid(points, cell=cell)
+        return self._grid
+
+    def snap(self, lat, lon, max_snap_m=None):
+        """
+        (edge, position) of the road vertex nearest to (lat, lon), where position
+        indexes into the edge's geometry; None if it is further than max_snap_m.
+        """
+        if not len(self.edge_rev):
+            return None
+        grid = self._snap_grid()
+        vertex = int(self._snap_vertices[grid.nearest(lat, lon)])
+        if max_snap_m is not None:
+            if haversine(lat, lon, self.geom_lat[vertex], self.geom_lon[vertex]) > max_snap_m:
+                return None
+        edge = int(np.searchsorted(self.edge_geom_ptr, vertex, side="right")) - 1
+        return edge, vertex - int(self.edge_geom_ptr[edge])
+
+    def _last(self, edge):
+        return int(self.edge_geom_ptr[edge + 1] - self.edge_geom_ptr[edge]) - 1
+
+    def _fraction(self, edge, position):
+        length = float(self.edge_length_m[edge])
+        cum = float(self.geom_cum_m[self.edge_geom_ptr[edge] + position])
+        return cum / length if length > 0 else 0.0
+
+    def _piece(self, edge, lo, hi, reverse=False):
+        """Edge geometry between positions lo..hi inclusive, and its length in meters."""
+        base = int(self.edge_geom_ptr[edge])
+        points = np.column_stack(
+            [self.geom_lat[base + lo : base + hi + 1], self.geom_lon[base + lo : base + hi + 1]]
+        )
+        length = float(self.geom_cum_m[base + hi] - self.geom_cum_m[base + lo])
+        return (points[::-1] if reverse else points), length
+
+    def _heuristic(self, lat, lon):
+        """Admissible A* estimate: straight-line distance at the graph's top speed."""
+        if self.max_speed_mps <= 0:
+            return lambda node: 0.0
+        scale = 1 / self.max_speed_mps
+        node_lat, node_lon = self.node_lat, self.node_lon
+
+        def h(node):
+            return haversine(float(node_lat[node]), float(node_lon[node]), lat, lon) * scale
+
+        return h
+
+    def shortest_path(self, source, target, max_settled=None):
+        """
+        Fastest path between two snapped points, as (duration_s, distance_m, points),
+        or None if the target can't be reached within `max_settled` settled nodes.
+        """
+        (ea, pa), (eb, pb) = source, target
+        fa, fb = self._fraction(ea, pa), self._fraction(eb, pb)
+        da, db = float(self.edge_duration_s[ea]), float(self.edge_duration_s[eb])
+
+        best = {}
+        prev = {}  # node -> (previous node or None, edge id or (edge, lo, hi, reverse))
+        heap = []
+        base = int(self.edge_geom_ptr[eb])
+        h = self._heuristic(float(self.geom_lat[base + pb]), float(self.geom_lon[base + pb]))
+
+        def push(node, cost, before, via):
+            if cost < best.get(node, inf):
+                best[node] = cost
+                prev[node] = (before, via)
+                heapq.heappush(heap, (cost + (0.0 if node == _TARGET else h(node)), cost, node))
+
+        # Leave the source part-way along its edge, in either direction it allows
+        push(int(self.edge_to[ea]), (1 - fa) * da, None, (ea, pa, self._last(ea), False))
+        if self.edge_rev[ea] >= 0:
+            push(int(self.edge_from[ea]), fa * da, None, (ea, 0, pa, True))
+        if ea == eb and pa <= pb:
+            push(_TARGET, (fb - fa) * da, None, (ea, pa, pb, False))
+        elif ea == eb and self.edge_rev[ea] >= 0:
+            push(_TARGET, (fa - fb) * da, None, (ea, pb, pa, True))
+
+        # Nodes the target edge can be entered from, with the cost of the last part
+        entries = {}
+        for node, cost, via in (
+            (int(self.edge_from[eb]), fb * db, (eb, 0, pb, False)),
+            (int(self.edge_to[eb]), (1 - fb) * db, (eb, pb, self._last(eb), True)),
+        ):
+            if via[3] and self.edge_rev[eb] < 0:
+                continue
+            if cost < entries.get(node, (inf,))[0]:
+                entries[node] = (cost, via)
+
+        edge_ptr, edge_to, edge_duration = self.edge_ptr, self.edge_to, self.edge_duration_s
+        settled = 0
+        while heap:
+            _, cost, node = heapq.heappop(heap)
+            if node == _TARGET:
+                break
+            if cost > best[node]:
+                continue
+            settled += 1
+            if max_settled is not None and settled > max_settled:
+                return None
+            if node in entries:
+                extra, via = entries[node]
+                push(_TARGET, cost + extra, node, via)
+            lo, hi = int(edge_ptr[node]), int(edge_ptr[node + 1])
+            for edge, to, duration in zip(
+                range(lo, hi), edge_to[lo:hi].tolist(), edge_duration[lo:hi].tolist()
+            ):
+                push(to, cost + duration, node, edge)
+        else:
+            return None
+
+        pieces = []
+        node = _TARGET
+        while node is not None:
+            before, via = prev[node]
+            if isinstance(via, tuple):
+                pieces.append(self._piece(*via))
+            else:
+                pieces.append(self._piece(via, 0, self._last(via)))
+            node = before
+        pieces.reverse()
+        points = np.concatenate([pieces[0][0]] + [p[1:] for p, _ in pieces[1:]])
+        return best[_TARGET], sum(length for _, length in pieces), points
+
+    def route(self, coords_list, max_snap_m=None, max_settled=None):
+        """
+        Same shape as routing.get_mapbox_route: {'distance_m', 'duration_s',
+        'geometry': [[lat, lon], ...]} through every waypoint in order, or None if a
+        waypoint is off the graph or a leg has no path within the search bound.
+        """
+        snapped = [self.snap(lat, lon, max_snap_m) for lat, lon in coords_list]
+        if len(snapped) < 2 or any(s is None for s in snapped):
+            return None
+        duration = distance = 0.0
+        legs = []
+        for source, target in zip(snapped, snapped[1:]):
+            leg = self.shortest_path(source, target, max_settled)
+            if leg is None:
+                return None
+            duration += leg[0]
+            distance += leg[1]
+            legs.append(leg[2] if not legs else leg[2][1:])
+        return {
+            "distance_m": distance,
+            "duration_s": duration,
+            "geometry": np.concatenate(legs).tolist(),
+        }
+
+
+def write_graph(path, arrays, meta):
+    write_arrays(path, MAGIC, arrays, meta)
+
+
+def load_graph(path):
+    """The RoadGraph at `path`, mapped once per process and reopened if the file changes."""
+    return open_cached(path, RoadGraph.open)
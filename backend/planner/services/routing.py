@@ -1,39 +1,250 @@
-import os
-import requests
+import asyncio
+import logging
+import threading
+import time
 
-MAPBOX_TOKEN = os.environ.get("MAPBOX_API_KEY")
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import close_old_connections
 
+from planner.models import RouteCache
 
-def get_mapbox_route(coords_list):
-    """
-    coords_list: [(lat, lon), ...]
-    Returns: {'distance_m', 'duration_s', 'geometry': [[lat, lon], ...]}
-    """
-    if not coords_list or len(coords_list) < 2:
-        return None
+from .cache import TTLCache
+from .codec import pack_geometry, unpack_geometry
+from .concurrency import io_pool
+from .http_client import UpstreamError
+from .mapbox import amapbox_get_json, mapbox_get_json
+from .road_graph import load_graph
+
+logger = logging.getLogger(__name__)
+
+ROUTE_CACHE_PRECISION = getattr(settings, "ROUTE_CACHE_PRECISION", 3)
+ROUTE_CACHE_TTL = getattr(settings, "ROUTE_CACHE_TTL", 7 * 24 * 3600)
+ROUTE_CACHE_STALE_TTL = getattr(settings, "ROUTE_CACHE_STALE_TTL", 24 * 3600)
+
+# Memory entries are (fetched_at, route) and live through the stale window too;
+# freshness is decided here, not by the cache.
+_memory_cache = TTLCache(
+    maxsize=getattr(settings, "ROUTE_CACHE_SIZE", 256),
+    ttl=ROUTE_CACHE_TTL + ROUTE_CACHE_STALE_TTL,
+)
+_refreshing = set()
+_refreshing_lock = threading.Lock()
 
+
+def route_cache_key(coords_list, precision=None):
+    """Waypoints rounded to `precision` decimal places, e.g. "41.878,-87.630;...". """
+    precision = ROUTE_CACHE_PRECISION if precision is None else precision
+    return ";".join(f"{lat:.{precision}f},{lon:.{precision}f}" for lat, lon in coords_list)
+
+
+def route_cache_stats():
+    return _memory_cache.stats()
+
+
+def _directions_request(coords_list):
     # Mapbox expects lon,lat order
     coord_str = ";".join([f"{lon},{lat}" for lat, lon in coords_list])
-    url = f"https://api.mapbox.com/directions/v5/mapbox/driving/{coord_str}"
+    path = f"/directions/v5/mapbox/driving/{coord_str}"
     params = {
-        "access_token": MAPBOX_TOKEN,
         "geometries": "geojson",
         "overview": "full",
     }
+    return path, params
+
+
+def _parse_route(data):
+    if data.get("routes"):
+        route = data["routes"][0]
+        geometry = route["geometry"]["coordinates"]  # [ [lon, lat], ... ]
+        geometry_latlon = [[lat, lon] for lon, lat in geometry]
+        return {
+            "distance_m": route["distance"],
+            "duration_s": route["duration"],
+            "geometry": geometry_latlon,
+        }
+    return None
+
+
+def _route_mapbox(coords_list, timeout=10, record_dir=None):
+    path, params = _directions_request(coords_list)
+    try:
+        data = mapbox_get_json("directions", path, params, timeout, record_dir=record_dir)
+        return _parse_route(data)
+    except UpstreamError as e:
+        logger.warning("routing failed waypoints=%d error=%s", len(coords_list), e)
+    return None
+
+
+async def _aroute_mapbox(coords_list, timeout=10):
+    path, params = _directions_request(coords_list)
+    try:
+        data = await amapbox_get_json("directions", path, params, timeout=timeout)
+        return _parse_route(data)
+    except UpstreamError as e:
+        logger.warning("routing failed waypoints=%d error=%s", len(coords_list), e)
+    return None
+
+
+def _route_local(coords_list, timeout=None):
+    """Route on the bundled road graph (ROAD_GRAPH_PATH); None if unset or unroutable."""
+    path = getattr(settings, "ROAD_GRAPH_PATH", None)
+    if not path:
+        return None
+    try:
+        graph = load_graph(path)
+    except (OSError, ValueError) as e:
+        logger.warning("road graph unavailable path=%s error=%s", path, e)
+        return None
+    try:
+        route = graph.route(
+            coords_list,
+            max_snap_m=getattr(settings, "ROAD_GRAPH_MAX_SNAP_M", None),
+            max_settled=getattr(settings, "ROAD_GRAPH_MAX_SETTLED", None),
+        )
+    except Exception:
+        logger.exception("local routing failed waypoints=%d", len(coords_list))
+        return None
+    if route is None:
+        logger.info("local routing found no path waypoints=%d", len(coords_list))
+    return route
+
+
+async def _aroute_local(coords_list, timeout=None):
+    # CPU-bound search; keep it off the event loop
+    return await asyncio.to_thread(_route_local, coords_list)
+
+
+# ROUTING_BACKENDS name -> (sync fetcher, async fetcher)
+_BACKENDS = {
+    "local": (_route_local, _aroute_local),
+    "mapbox": (_route_mapbox, _aroute_mapbox),
+}
+
+
+def _backends():
+    names = getattr(settings, "ROUTING_BACKENDS", None) or ["mapbox"]
+    unknown = [name for name in names if name not in _BACKENDS]
+    if unknown:
+        raise ImproperlyConfigured(f"Unknown routing backend(s): {', '.join(unknown)}")
+    return [_BACKENDS[name] for name in names]
+
+
+def _fetch_route(coords_list, timeout=10):
+    """Try each configured backend in order; the first route found wins."""
+    for fetch, _ in _backends():
+        route = fetch(coords_list, timeout=timeout)
+        if route:
+            return route
+    return None
+
+
+async def _afetch_route(coords_list, timeout=10):
+    for _, afetch in _backends():
+        route = await afetch(coords_list, timeout=timeout)
+        if route:
+            return route
+    return None
+
+
+def _remember_row(key, row):
+    if row is None:
+        return None
+    fetched_at = row.updated_at.timestamp()
+    if time.time() - fetched_at >= ROUTE_CACHE_TTL + ROUTE_CACHE_STALE_TTL:
+        return None
+    route = {
+        "distance_m": row.distance_m,
+        "duration_s": row.duration_s,
+        "geometry": unpack_geometry(row.geometry),
+    }
+    _memory_cache.set(key, (fetched_at, route))
+    return fetched_at, route
 
+
+def _read_db_cache(key):
+    return _remember_row(key, RouteCache.objects.filter(key=key).first())
+
+
+def _row_defaults(route):
+    return {
+        "distance_m": route["distance_m"],
+        "duration_s": route["duration_s"],
+        "geometry": pack_geometry(route["geometry"]),
+    }
+
+
+def _write_cache(key, route):
+    _memory_cache.set(key, (time.time(), route))
+    RouteCache.objects.update_or_create(key=key, defaults=_row_defaults(route))
+
+
+def _refresh(key, coords_list):
     try:
-        resp = requests.get(url, params=params, timeout=10)
-        resp.raise_for_status()
-        data = resp.json()
-        if data.get("routes"):
-            route = data["routes"][0]
-            geometry = route["geometry"]["coordinates"]  # [ [lon, lat], ... ]
-            geometry_latlon = [[lat, lon] for lon, lat in geometry]
-            return {
-                "distance_m": route["distance"],
-                "duration_s": route["duration"],
-                "geometry": geometry_latlon,
-            }
-    except Exception as e:
-        print(f"Mapbox routing failed: {e}")
+        route = _fetch_route(coords_list)
+        if route:
+            _write_cache(key, route)
+    finally:
+        with _refreshing_lock:
+            _refreshing.discard(key)
+        close_old_connections()
+
+
+def _schedule_refresh(key, coords_list):
+    with _refreshing_lock:
+        if key in _refreshing:
+            return
+        _refreshing.add(key)
+    io_pool().submit(_refresh, key, list(coords_list))
+
+
+def get_mapbox_route(coords_list, timeout=10):
+    """
+    coords_list: [(lat, lon), ...]
+    Returns: {'distance_m', 'duration_s', 'geometry': [[lat, lon], ...]}
+
+    Routes come from the ROUTING_BACKENDS in order ("local" road graph, "mapbox").
+    Results are cached on the quantized waypoints, in memory and in the RouteCache
+    table. A stale entry is returned immediately while a background refresh runs.
+    """
+    if not coords_list or len(coords_list) < 2:
         return None
+
+    key = route_cache_key(coords_list)
+    cached = _memory_cache.get(key) or _read_db_cache(key)
+    if cached is not None:
+        fetched_at, route = cached
+        if time.time() - fetched_at < ROUTE_CACHE_TTL:
+            return route
+        if ROUTE_CACHE_STALE_TTL > 0:
+            _schedule_refresh(key, coords_list)
+            return route
+
+    route = _fetch_route(coords_list, timeout=timeout)
+    if route:
+        _write_cache(key, route)
+    return route
+
+
+async def get_mapbox_route_async(coords_list, timeout=10):
+    """Coroutine counterpart of get_mapbox_route, sharing its caches."""
+    if not coords_list or len(coords_list) < 2:
+        return None
+
+    key = route_cache_key(coords_list)
+    cached = _memory_cache.get(key)
+    if cached is None:
+        cached = _remember_row(key, await RouteCache.objects.filter(key=key).afirst())
+    if cached is not None:
+        fetched_at, route = cached
+        if time.time() - fetched_at < ROUTE_CACHE_TTL:
+            return route
+        if ROUTE_CACHE_STALE_TTL > 0:
+            _schedule_refresh(key, coords_list)
+            return route
+
+    route = await _afetch_route(coords_list, timeout=timeout)
+    if route:
+        _memory_cache.set(key, (time.time(), route))
+        await RouteCache.objects.aupdate_or_create(key=key, defaults=_row_defaults(route))
+    return route
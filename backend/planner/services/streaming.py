@@ -0,0 +1,70 @@
+"""
+Wire formats for streamed plan events: newline-delimited JSON or server-sent
+events, optionally gzipped with a flush after every event so compression
+never holds an event back.
+"""
+
+import json
+import logging
+import zlib
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+
+logger = logging.getLogger(__name__)
+
+NDJSON_CONTENT_TYPE = "application/x-ndjson"
+SSE_CONTENT_TYPE = "text/event-stream"
+
+_DONE = object()
+
+
+def _dumps(event):
+    return json.dumps(event, cls=DjangoJSONEncoder, separators=(",", ":"))
+
+
+def guard_events(events):
+    """
+    Pass events through; if producing one raises, end the stream with an
+    {"event": "error"} instead. Headers are already sent, so a status code can't.
+    """
+    try:
+        yield from events
+    except Exception:
+        logger.exception("streamed plan failed")
+        yield {"event": "error", "error": "Planning failed"}
+
+
+def ndjson_lines(events):
+    for event in events:
+        yield (_dumps(event) + "\n").encode()
+
+
+def sse_messages(events):
+    for event in events:
+        yield f"event: {event['event']}\ndata: {_dumps(event)}\n\n".encode()
+
+
+def gzip_chunks(chunks):
+    """Gzip a byte stream, sync-flushing after each chunk so it can be decoded as it arrives."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # 31: gzip container
+    for chunk in chunks:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+async def async_chunks(chunks):
+    """
+    A sync byte stream as an async iterator for ASGI, which would otherwise read
+    a sync iterator to the end before sending anything. Each chunk is produced on
+    the sync thread (thread_sensitive), where the ORM expects to run.
+    """
+    chunks = iter(chunks)
+    next_chunk = sync_to_async(next)
+    try:
+        while (chunk := await next_chunk(chunks, _DONE)) is not _DONE:
+            yield chunk
+    finally:
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            await sync_to_async(close)()
@@ -0,0 +1,59 @@
+"""
+Cached JSON for trip detail responses, keyed by trip and response options and
+validated against Trip.updated_at, so any save of a trip invalidates it.
+"""
+
+import hashlib
+
+from django.conf import settings
+from django.utils.http import parse_etags
+from rest_framework.renderers import JSONRenderer
+
+from .cache import TTLCache
+
+_response_cache = TTLCache(
+    maxsize=getattr(settings, "TRIP_CACHE_SIZE", 512),
+    ttl=getattr(settings, "TRIP_CACHE_TTL", 3600),
+)
+
+
+def options_key(geometry_options):
+    if not geometry_options:
+        return ""
+    return "{format}:{tolerance_m}:{zoom}".format(**geometry_options)
+
+
+def make_etag(*parts):
+    """Strong ETag from the version fields that determine a response body."""
+    digest = hashlib.blake2b("|".join(str(p) for p in parts).encode(), digest_size=12)
+    return f'"{digest.hexdigest()}"'
+
+
+def trip_etag(trip_id, updated_at, geometry_options=None):
+    return make_etag("trip", trip_id, updated_at.isoformat(), options_key(geometry_options))
+
+
+def not_modified(request, etag):
+    """True if the request's If-None-Match already names this ETag."""
+    header = request.headers.get("If-None-Match")
+    if not header:
+        return False
+    etags = parse_etags(header)
+    return "*" in etags or etag in etags or f"W/{etag}" in etags
+
+
+def cached_trip_json(trip_id, etag, build):
+    """
+    Rendered JSON bytes for a trip response. `build()` returns the response data
+    and is only called when no entry exists for this trip with the same ETag.
+    """
+    key = ("trip", trip_id, etag)
+    body = _response_cache.get(key)
+    if body is None:
+        body = JSONRenderer().render(build())
+        _response_cache.set(key, body)
+    return body
+
+
+def trip_cache_stats():
+    return _response_cache.stats()
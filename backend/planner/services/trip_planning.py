@@ -0,0 +1,527 @@
+"""
+The plan pipeline shared by the plan endpoints: validate input, geocode,
+route, lay out the HOS plan in memory, then persist and serialize.
+"""
+
+import logging
+import math
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+from rest_framework import serializers
+
+from planner.models import Trip
+from planner.serializers import (
+    LogSheetSerializer,
+    StopSerializer,
+    TripSerializer,
+    TripSummarySerializer,
+)
+
+from .codec import encode_polyline
+from .concurrency import map_with_deadline, remaining
+from .event_planning import TripPlan
+from .geocoding import geocode_locations, geocode_locations_async
+from .geometry import RouteGeometry, meters_per_pixel, simplify_geometry
+from .hos import iter_plan_route, plan_route
+from .instrumentation import span
+from .persistence import save_plan, stored_route, with_plan
+from .poi_index import load_poi_index
+from .routing import get_mapbox_route, get_mapbox_route_async, route_cache_key
+
+logger = logging.getLogger(__name__)
+
+LOCATION_FIELDS = ("current_location", "pickup_location", "dropoff_location")
+# Renders datetimes exactly as the trip serializers do
+_datetime_field = serializers.DateTimeField()
+GEOMETRY_FORMATS = ("coords", "polyline")
+MAX_ZOOM = 22
+
+
+class PlanInputError(ValueError):
+    pass
+
+
+def parse_trip_input(data):
+    """Validate one trip's input; returns a clean dict or raises PlanInputError."""
+    if not isinstance(data, dict):
+        raise PlanInputError("Trip input must be an object")
+    trip_input = {field: data.get(field) for field in LOCATION_FIELDS}
+    if not all(trip_input.values()):
+        raise PlanInputError("Missing required fields")
+    if not all(isinstance(value, str) for value in trip_input.values()):
+        raise PlanInputError("Locations must be strings")
+    try:
+        trip_input["current_cycle_used"] = float(data.get("current_cycle_used", 0) or 0)
+    except (TypeError, ValueError):
+        raise PlanInputError("current_cycle_used must be a number of hours")
+    return trip_input
+
+
+def parse_geometry_options(params):
+    """
+    Route geometry options from query params: ?geometry=coords|polyline, plus
+    ?tolerance=<meters> or ?zoom=<map zoom> to simplify the line before sending.
+    """
+    options = {"format": params.get("geometry") or "coords", "tolerance_m": 0.0, "zoom": None}
+    if options["format"] not in GEOMETRY_FORMATS:
+        raise PlanInputError(f"geometry must be one of: {', '.join(GEOMETRY_FORMATS)}")
+    try:
+        if params.get("tolerance"):
+            options["tolerance_m"] = max(_finite(params["tolerance"]), 0.0)
+        elif params.get("zoom"):
+            options["zoom"] = min(max(_finite(params["zoom"]), 0.0), MAX_ZOOM)
+    except ValueError:
+        raise PlanInputError("tolerance and zoom must be finite numbers")
+    return options
+
+
+def _finite(value):
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError(value)
+    return number
+
+
+def route_geometry_fields(route, options=None):
+    """route_geometry for a response, simplified and encoded as `options` ask."""
+    geometry = route["geometry"] if route else []
+    options = options or {"format": "coords", "tolerance_m": 0.0, "zoom": None}
+
+    tolerance_m = options["tolerance_m"]
+    if options["zoom"] is not None and len(geometry):
+        # One screen pixel at that zoom, measured mid-route
+        tolerance_m = meters_per_pixel(options["zoom"], geometry[len(geometry) // 2][0])
+    if tolerance_m and len(geometry) > 2:
+        geometry = simplify_geometry(geometry, tolerance_m)
+
+    if options["format"] == "polyline":
+        return {"route_geometry": encode_polyline(geometry), "route_geometry_format": "polyline"}
+    if hasattr(geometry, "tolist"):
+        geometry = geometry.tolist()  # stored routes load as arrays
+    return {"route_geometry": geometry, "route_geometry_format": "coords"}
+
+
+def default_start_time():
+    """Trips start tomorrow at 7 AM."""
+    return timezone.now().replace(hour=7, minute=0, second=0, microsecond=0) + timedelta(days=1)
+
+
+def has_coords(*coords):
+    return all(lat is not None and lon is not None for lat, lon in coords)
+
+
+def log_plan(plan):
+    """Every planned segment at DEBUG; skipped entirely at higher levels."""
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    lines = []
+    for sheet in plan.sheets:
+        lines.append(f"date={sheet.date}")
+        for e in sheet.segments:
+            lines.append(
+                f"  status={e.status} start={e.start_time.isoformat()}"
+                f" end={e.end_time.isoformat()} note={e.note!r}"
+            )
+    logger.debug("planned events\n%s", "\n".join(lines))
+
+
+def log_coords(trip_input, coords):
+    logger.debug(
+        "geocoded current=%s pickup=%s dropoff=%s",
+        *(f"{trip_input[field]!r}@{latlon}" for field, latlon in zip(LOCATION_FIELDS, coords)),
+    )
+
+
+def log_saved(trip, plan):
+    logger.info(
+        "trip planned id=%s stops=%d days=%d",
+        trip.id,
+        len(plan.stops) if plan else 0,
+        len(plan.sheets) if plan else 0,
+    )
+
+
+def new_trip(trip_input):
+    return Trip(
+        current_location=trip_input["current_location"],
+        pickup_location=trip_input["pickup_location"],
+        dropoff_location=trip_input["dropoff_location"],
+        current_cycle_used=trip_input["current_cycle_used"],
+    )
+
+
+def poi_index():
+    """The truck stop PoiIndex at POI_INDEX_PATH, or None if unset or unreadable."""
+    path = getattr(settings, "POI_INDEX_PATH", None)
+    if not path:
+        return None
+    try:
+        return load_poi_index(path)
+    except (OSError, ValueError) as e:
+        logger.warning("poi index unavailable path=%s error=%s", path, e)
+        return None
+
+
+def route_pois(route):
+    """The poi_index.Corridor of truck stops along a route, or None without an index."""
+    index = poi_index()
+    # Stored routes carry their geometry as an array, so no truth test on it
+    if index is None or not route or route.get("geometry") is None or not len(route["geometry"]):
+        return None
+    with span("pois"):
+        route_geom = RouteGeometry(route["geometry"], route["distance_m"], route["duration_s"])
+        return index.corridor(
+            route_geom,
+            getattr(settings, "POI_DETOUR_M", 3000),
+            getattr(settings, "POI_MAX_BACKTRACK_M", 40000),
+        )
+
+
+def plan_route_args(trip_input, coords, route, start_time):
+    """Positional arguments for hos.plan_route (kept plain so they pickle cheaply)."""
+    current_coords, pickup_coords, dropoff_coords = coords
+    return (
+        route,
+        (trip_input["current_location"], current_coords),
+        (trip_input["pickup_location"], pickup_coords),
+        (trip_input["dropoff_location"], dropoff_coords),
+        start_time,
+        trip_input["current_cycle_used"],
+        route_pois(route),
+    )
+
+
+def build_trip_plan(trip_input, coords, route, start_time):
+    return plan_route(*plan_route_args(trip_input, coords, route, start_time))
+
+
+def trip_response(trip, route=None, geometry_options=None):
+    """
+    Serialized trip with stops + log sheets, plus route metadata.
+    Without a route, the one stored on the trip is used.
+    """
+    if route is None:
+        route = stored_route(trip)
+    trip_data = TripSerializer(trip).data
+    trip_data.update(route_fields(route, geometry_options))
+    return trip_data
+
+
+def route_fields(route, geometry_options=None):
+    fields = route_geometry_fields(route, geometry_options)
+    fields["route_distance_m"] = route["distance_m"] if route else None
+    fields["route_duration_s"] = route["duration_s"] if route else None
+    return fields
+
+
+def prepare_single_trip(trip_input, timeout):
+    """
+    Geocode, route and plan one trip in memory within `timeout` seconds of
+    outbound I/O. Returns (trip, plan, route) with the trip not yet saved; plan
+    and route are None if a location can't be resolved.
+    """
+    # One budget for all outbound calls made by this request
+    deadline = time.monotonic() + timeout
+
+    # Geocode locations concurrently
+    with span("geocode"):
+        coords = geocode_locations(
+            [trip_input[field] for field in LOCATION_FIELDS], timeout=remaining(deadline)
+        )
+    log_coords(trip_input, coords)
+
+    trip = new_trip(trip_input)
+    route = None
+    plan = None
+    if has_coords(*coords):
+        with span("route"):
+            route = get_mapbox_route(list(coords), timeout=remaining(deadline, cap=10))
+        plan = build_trip_plan(trip_input, coords, route, default_start_time())
+        if plan:
+            log_plan(plan)
+    return trip, plan, route
+
+
+def stop_json(stop):
+    """A PlannedStop as StopSerializer renders a saved Stop, less the id."""
+    return {
+        "type": stop.type,
+        "location": stop.location,
+        "arrival_time": _datetime_field.to_representation(stop.arrival_time),
+        "duration_hours": stop.duration_hours,
+        "order_index": stop.order_index,
+        "lat": stop.lat,
+        "lon": stop.lon,
+        "added": stop.added,
+    }
+
+
+def stream_single_trip(trip_input, timeout, geometry_options=None):
+    """
+    plan_single_trip as a generator of events, so a client can render the trip
+    while it is still being planned:
+
+      {"event": "geocoded", "locations": [{"field", "query", "lat", "lon"}, ...]}
+      {"event": "route", "route_geometry", "route_distance_m", ...}
+      {"event": "stop", "stop": {...}}           as each stop is placed
+      {"event": "logsheet", "logsheet": {...}}   as each day is completed
+      {"event": "trip", "trip": {...}}           once saved, as TripSummarySerializer
+
+    "route", "stop" and "logsheet" are skipped if a location can't be resolved.
+    """
+    deadline = time.monotonic() + timeout
+    with span("geocode"):
+        coords = geocode_locations(
+            [trip_input[field] for field in LOCATION_FIELDS], timeout=remaining(deadline)
+        )
+    log_coords(trip_input, coords)
+    yield {
+        "event": "geocoded",
+        "locations": [
+            {"field": field, "query": trip_input[field], "lat": lat, "lon": lon}
+            for field, (lat, lon) in zip(LOCATION_FIELDS, coords)
+        ],
+    }
+
+    trip = new_trip(trip_input)
+    route = None
+    plan = TripPlan(stops=[], segments=[], sheets=[])
+    if has_coords(*coords):
+        with span("route"):
+            route = get_mapbox_route(list(coords), timeout=remaining(deadline, cap=10))
+        if route:
+            yield {"event": "route", **route_fields(route, geometry_options)}
+        args = plan_route_args(trip_input, coords, route, default_start_time())
+        for kind, item in iter_plan_route(*args):
+            plan.add(kind, item)
+            if kind == "stop":
+                yield {"event": "stop", "stop": stop_json(item)}
+            elif kind == "sheet":
+                sheet = {"date": item.date, "sheet_json": item.to_json()}
+                yield {"event": "logsheet", "logsheet": sheet}
+
+    plan = plan if plan.stops else None
+    with span("persist"):
+        save_plan(trip, plan, route)
+    log_saved(trip, plan)
+    yield {"event": "trip", "trip": TripSummarySerializer(trip).data}
+
+
+def saved_trip_events(trip, geometry_options=None):
+    """
+    stream_single_trip's events for a trip already saved, with its plan
+    prefetched: the route, stops, log sheets and trip, but no "geocoded".
+    """
+    route = stored_route(trip)
+    if route:
+        yield {"event": "route", **route_fields(route, geometry_options)}
+    for stop in StopSerializer(trip.stops.all(), many=True).data:
+        yield {"event": "stop", "stop": stop}
+    for sheet in LogSheetSerializer(trip.logsheets.all(), many=True).data:
+        yield {"event": "logsheet", "logsheet": sheet}
+    yield {"event": "trip", "trip": TripSummarySerializer(trip).data}
+
+
+def plan_single_trip(trip_input, timeout):
+    """
+    Plan and persist one trip within `timeout` seconds of outbound I/O.
+    Returns (trip, route); if a location can't be resolved the trip is still
+    saved, without stops, and route is None.
+    """
+    trip, plan, route = prepare_single_trip(trip_input, timeout)
+    with span("persist"):
+        save_plan(trip, plan, route)
+    log_saved(trip, plan)
+    return trip, route
+
+
+async def plan_single_trip_async(trip_input, timeout):
+    """
+    Coroutine version of plan_single_trip for the ASGI endpoint. Outbound calls
+    are awaited on the event loop; planning and persistence run in worker threads.
+    """
+    deadline = time.monotonic() + timeout
+
+    with span("geocode"):
+        coords = await geocode_locations_async(
+            [trip_input[field] for field in LOCATION_FIELDS], timeout=remaining(deadline)
+        )
+    log_coords(trip_input, coords)
+
+    trip = new_trip(trip_input)
+    route = None
+    plan = None
+    if has_coords(*coords):
+        with span("route"):
+            route = await get_mapbox_route_async(list(coords), timeout=remaining(deadline, cap=10))
+        plan = await sync_to_async(build_trip_plan, thread_sensitive=False)(
+            trip_input, coords, route, default_start_time()
+        )
+        if plan:
+            log_plan(plan)
+
+    with span("persist"):
+        await sync_to_async(save_plan)(trip, plan, route)
+    log_saved(trip, plan)
+    return trip, route
+
+
+# ---- Batch planning ----
+
+_cpu_pool = None
+_cpu_pool_lock = threading.Lock()
+
+
+def cpu_pool():
+    """Process pool for CPU-bound planning; started on first use and kept for reuse."""
+    global _cpu_pool
+    with _cpu_pool_lock:
+        if _cpu_pool is None:
+            # spawn rather than fork: the web process has threads and open DB connections
+            _cpu_pool = ProcessPoolExecutor(
+                max_workers=getattr(settings, "PLANNER_CPU_WORKERS", 1),
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _cpu_pool
+
+
+def _fetch_route(coords_list, deadline):
+    try:
+        return get_mapbox_route(coords_list, timeout=remaining(deadline, cap=10))
+    finally:
+        close_old_connections()
+
+
+def plan_batch(trip_inputs, timeout, geometry_options=None):
+    """
+    Plan many trips at once. `trip_inputs` holds parsed inputs, or PlanInputErrors
+    for entries that failed validation. Locations and routes shared between trips
+    are fetched once; route fetches run concurrently (the HTTP client applies the
+    Mapbox rate limit) and planning runs on the process pool.
+    Returns ([{"index", "trip"} or {"index", "error"}, ...], timing).
+    """
+    deadline = time.monotonic() + timeout
+    started = time.perf_counter()
+    timing = {}
+    results = [None] * len(trip_inputs)
+    pending = []  # indices still being planned
+
+    for i, trip_input in enumerate(trip_inputs):
+        if isinstance(trip_input, PlanInputError):
+            results[i] = {"index": i, "error": str(trip_input)}
+        else:
+            pending.append(i)
+
+    # Geocode every distinct location once
+    with span("geocode") as stage:
+        names = [trip_inputs[i][field] for i in pending for field in LOCATION_FIELDS]
+        flat = geocode_locations(names, timeout=remaining(deadline))
+        coords = {i: tuple(flat[n * 3 : n * 3 + 3]) for n, i in enumerate(pending)}
+    timing["geocode_ms"] = stage.ms
+
+    for i in list(pending):
+        missing = [
+            trip_inputs[i][field]
+            for field, (lat, lon) in zip(LOCATION_FIELDS, coords[i])
+            if lat is None or lon is None
+        ]
+        if missing:
+            results[i] = {"index": i, "error": f"Could not geocode: {', '.join(missing)}"}
+            pending.remove(i)
+
+    # Fetch every distinct route once, concurrently
+    with span("route") as stage:
+        route_keys = {i: route_cache_key(coords[i]) for i in pending}
+        unique = {}
+        for i in pending:
+            unique.setdefault(route_keys[i], list(coords[i]))
+        fetched = map_with_deadline(
+            lambda coords_list: _fetch_route(coords_list, deadline),
+            list(unique.values()),
+            deadline,
+        )
+        routes_by_key = dict(zip(unique, fetched))
+        routes = {i: routes_by_key[route_keys[i]] for i in pending}
+    timing["route_ms"] = stage.ms
+
+    for i in list(pending):
+        if not routes[i] or not routes[i]["geometry"]:
+            results[i] = {"index": i, "error": "No route found"}
+            pending.remove(i)
+
+    # CPU-bound planning across processes
+    with span("plan") as stage:
+        start_time = default_start_time()
+        plans = {}
+        failed = set()
+        if len(pending) > 1 and getattr(settings, "PLANNER_CPU_WORKERS", 1) > 1:
+            # Submit hos.plan_route itself: workers import only the pure planning modules
+            futures = {
+                i: cpu_pool().submit(
+                    plan_route, *plan_route_args(trip_inputs[i], coords[i], routes[i], start_time)
+                )
+                for i in pending
+            }
+            wait(futures.values(), timeout=remaining(deadline))
+            for i, future in futures.items():
+                if not future.done():
+                    future.cancel()
+                elif future.exception() is not None:
+                    logger.error("batch plan failed index=%d", i, exc_info=future.exception())
+                    failed.add(i)
+                else:
+                    plans[i] = future.result()
+        else:
+            for i in pending:
+                try:
+                    plans[i] = build_trip_plan(trip_inputs[i], coords[i], routes[i], start_time)
+                except Exception:
+                    logger.exception("batch plan failed index=%d", i)
+                    failed.add(i)
+    timing["plan_ms"] = stage.ms
+
+    for i in list(pending):
+        if i in failed:
+            results[i] = {"index": i, "error": "Planning failed"}
+            pending.remove(i)
+        elif plans.get(i) is None:
+            results[i] = {"index": i, "error": "Planning did not finish in time"}
+            pending.remove(i)
+
+    # Persist, one transaction per trip
+    with span("persist") as stage:
+        trips = {}
+        for i in pending:
+            trips[i] = save_plan(new_trip(trip_inputs[i]), plans[i], routes[i])
+    timing["persist_ms"] = stage.ms
+
+    # Serialize with the related rows for every trip loaded in a few queries
+    with span("serialize") as stage:
+        loaded = with_plan(
+            # route_geometry is already in memory as routes[i]
+            Trip.objects.filter(id__in=[t.id for t in trips.values()]).defer("route_geometry")
+        )
+        loaded = {t.id: t for t in loaded}
+        for i, trip in trips.items():
+            results[i] = {
+                "index": i,
+                "trip": trip_response(loaded[trip.id], routes[i], geometry_options),
+            }
+    timing["serialize_ms"] = stage.ms
+
+    timing["total_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    logger.info(
+        "batch planned trips=%d failed=%d total_ms=%s",
+        len(trips),
+        len(results) - len(trips),
+        timing["total_ms"],
+    )
+    return results, timing
@@ -1,3 +1,1080 @@
-from django.test import TestCase
+import asyncio
+import json
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+from io import StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+import httpx
+import numpy as np
+import requests
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.test import APIClient
+from rest_framework.throttling import AnonRateThrottle
+
+from planner import benchmarks
+from planner.models import Event, GeocodeCache, LogSheet, PlanJob, PlanRequest, Stop, Trip
+from planner.services import (
+    dedupe,
+    gazetteer,
+    geocoding,
+    hos,
+    http_client,
+    mapbox,
+    plan_jobs,
+    poi_index,
+    road_graph,
+    routing,
+    trip_planning,
+)
+from planner.services.codec import (
+    decode_polyline,
+    encode_polyline,
+    pack_geometry,
+    unpack_geometry,
+    unpack_geometry_array,
+)
+from planner.services.event_planning import plan_trip
+from planner.services.geometry import EARTH_RADIUS_M, RouteGeometry, simplify_indices
+from planner.services.mock_mapbox import make_server
+from planner.services.persistence import stored_route
+from planner.services.replanning import planned_stop
+from planner.services.streaming import async_chunks
+from planner.services.trip_planning import PlanInputError, parse_trip_input
+from planner.views import PlanTripView
+
+
+PLACES = {
+    "denver, co": (39.74, -104.99),
+    "omaha, ne": (41.26, -95.94),
+    "chicago, il": (41.88, -87.63),
+}
+LONG_TRIP = [(40.0, -120.0), (40.0, -110.0), (35.0, -80.0)]  # about 2300 miles
+START = datetime(2026, 1, 5, 8, tzinfo=dt_timezone.utc)
+
+
+def straight_route(waypoints, points_per_leg=500):
+    """A route dict running straight between waypoints, driven at 25 m/s."""
+    geometry = []
+    for (lat1, lon1), (lat2, lon2) in zip(waypoints, waypoints[1:]):
+        for t in np.linspace(0, 1, points_per_leg, endpoint=False):
+            geometry.append([lat1 + (lat2 - lat1) * t, lon1 + (lon2 - lon1) * t])
+    geometry.append(list(waypoints[-1]))
+    distance_m = RouteGeometry(geometry).total_distance_m
+    return {"distance_m": distance_m, "duration_s": distance_m / 25.0, "geometry": geometry}
+
+
+def fake_geocode(name, timeout=10):
+    return PLACES.get(geocoding.normalize_location(name), (None, None))
+
+
+async def afake_geocode(name, timeout=10):
+    return fake_geocode(name)
+
+
+def fake_route(coords_list, timeout=10):
+    return straight_route(coords_list)
+
+
+async def afake_route(coords_list, timeout=10):
+    return fake_route(coords_list)
+
+
+def hos_violations(plan):
+    """Driving segments that break the 8-hour break or 11-hour driving rule."""
+    since_break = since_rest = not_driving = 0.0
+    violations = []
+    for seg in plan.segments:
+        hours = (seg.end_time - seg.start_time).total_seconds() / 3600
+        if seg.status != "driving":
+            not_driving += hours
+            if not_driving >= 0.5 - 1e-9:
+                since_break = 0.0
+            if not_driving >= 10 - 1e-9:
+                since_rest = 0.0
+            continue
+        not_driving = 0.0
+        since_break += hours
+        since_rest += hours
+        if since_break > 8 + 1e-6 or since_rest > 11 + 1e-6:
+            violations.append(seg)
+    return violations
+
+
+class PlannerTestCase(TestCase):
+    """Plans against fake geocoding and routing: straight lines between PLACES."""
+
+    def setUp(self):
+        geocoding._memory_cache.clear()
+        routing._memory_cache.clear()
+        for target, name, fake in (
+            (geocoding, "_fetch_geocode", fake_geocode),
+            (geocoding, "_afetch_geocode", afake_geocode),
+            (routing, "_fetch_route", fake_route),
+            (routing, "_afetch_route", afake_route),
+        ):
+            patcher = mock.patch.object(target, name, side_effect=fake)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.client = APIClient()
+
+    def plan(self, **overrides):
+        return self.client.post("/api/plan/", trip_body(**overrides), format="json")
+
+
+def trip_body(**overrides):
+    body = {
+        "current_location": "Denver, CO",
+        "pickup_location": "Omaha, NE",
+        "dropoff_location": "Chicago, IL",
+        "current_cycle_used": 10,
+    }
+    body.update(overrides)
+    return body
+
+
+class GeocodeCacheTests(TestCase):
+    def setUp(self):
+        geocoding._memory_cache.clear()
+
+    def test_normalize_location(self):
+        self.assertEqual(geocoding.normalize_location("  Denver ,CO  "), "denver, co")
+        self.assertEqual(geocoding.normalize_location("New   York,, NY"), "new york, ny")
+        self.assertEqual(geocoding.normalize_location(" , "), "")
+
+    def test_lookup_is_cached_in_memory_then_database(self):
+        with mock.patch.object(geocoding, "_fetch_geocode", return_value=(39.7, -105.0)) as fetch:
+            self.assertEqual(geocoding.geocode_location("Denver, CO"), (39.7, -105.0))
+            self.assertEqual(geocoding.geocode_location("denver,  co"), (39.7, -105.0))
+            geocoding._memory_cache.clear()
+            self.assertEqual(geocoding.geocode_location("DENVER, CO"), (39.7, -105.0))
+        fetch.assert_called_once_with("Denver, CO")
+        self.assertTrue(GeocodeCache.objects.filter(query="denver, co").exists())
+
+    def test_failed_lookup_is_not_cached(self):
+        with mock.patch.object(geocoding, "_fetch_geocode", return_value=(None, None)) as fetch:
+            self.assertEqual(geocoding.geocode_location("Nowhere"), (None, None))
+            self.assertEqual(geocoding.geocode_location("Nowhere"), (None, None))
+        self.assertEqual(fetch.call_count, 2)
+        self.assertFalse(GeocodeCache.objects.exists())
+
+    def test_path_encodes_reserved_characters(self):
+        name = "Exit 5 / I-80? Joe's #2"
+        path = geocoding._geocode_path(name)
+        self.assertEqual(path.count("/"), 4)
+        self.assertNotIn("?", path)
+        self.assertNotIn("#", path)
+        server = make_server({}, synthesize=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        base_url = "http://%s:%d" % server.server_address
+        served = requests.get(base_url + path, params={"limit": 1}, timeout=5).json()
+        self.assertEqual(served["features"][0]["place_name"], name)
+
+    def test_batch_lookup_fetches_each_distinct_name_once(self):
+        with mock.patch.object(geocoding, "_fetch_geocode", return_value=(41.3, -96.0)) as fetch:
+            coords = geocoding.geocode_locations(["Omaha, NE", "omaha,ne", ""], timeout=5)
+        self.assertEqual(coords, [(41.3, -96.0), (41.3, -96.0), (None, None)])
+        self.assertEqual(fetch.call_count, 1)
+
+
+class TripInputTests(TestCase):
+    def test_parse_trip_input(self):
+        trip_input = parse_trip_input(trip_body(current_cycle_used="10.5"))
+        self.assertEqual(trip_input["current_cycle_used"], 10.5)
+        self.assertEqual(trip_input["pickup_location"], "Omaha, NE")
+
+    def test_rejects_missing_and_non_string_locations(self):
+        for body in (trip_body(pickup_location=""), trip_body(current_location=123), []):
+            with self.assertRaises(PlanInputError):
+                parse_trip_input(body)
+
+    def test_plan_endpoint_rejects_non_string_location(self):
+        response = APIClient().post("/api/plan/", trip_body(current_location=123), format="json")
+        self.assertEqual(response.status_code, 400)
+
+
+class CircuitBreakerTests(TestCase):
+    def setUp(self):
+        self.breaker = http_client.CircuitBreaker(failure_threshold=2, reset_timeout=60)
+
+    def open_breaker(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.breaker.opened_at -= 60  # reset timeout elapsed: half-open
+
+    def test_opens_after_threshold_and_allows_one_trial(self):
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, "closed")
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, "open")
+        self.assertFalse(self.breaker.allow())
+        self.breaker.opened_at -= 60
+        self.assertEqual(self.breaker.state, "half_open")
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, "closed")
+
+    def test_rate_limit_give_up_releases_half_open_trial(self):
+        self.open_breaker()
+        limiter = mock.Mock(acquire=mock.Mock(return_value=False))
+        parts = (self.breaker, http_client.EndpointMetrics("test"), limiter)
+        with mock.patch.object(http_client, "_for_endpoint", return_value=parts):
+            with self.assertRaises(http_client.UpstreamError):
+                http_client.get_json("test", "http://upstream.invalid/", timeout=1)
+        self.assertEqual(self.breaker.state, "half_open")
+        self.assertTrue(self.breaker.allow())
+
+
+class HttpClientTests(TestCase):
+    def setUp(self):
+        self.breaker = http_client.CircuitBreaker(failure_threshold=1, reset_timeout=60)
+        parts = (self.breaker, http_client.EndpointMetrics("test"), None)
+        patcher = mock.patch.object(http_client, "_for_endpoint", return_value=parts)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_json(self, error=None, response=None):
+        session = mock.Mock(get=mock.Mock(side_effect=error, return_value=response))
+        with mock.patch.object(http_client, "get_session", return_value=session):
+            return http_client.get_json("test", "http://upstream.invalid/", max_retries=0)
+
+    def test_broken_response_is_an_upstream_failure(self):
+        with self.assertRaises(http_client.UpstreamError):
+            self.get_json(requests.exceptions.ChunkedEncodingError("connection broken"))
+        self.assertEqual(self.breaker.state, "open")
+
+    def test_undecodable_body_is_an_upstream_failure(self):
+        response = requests.Response()
+        response.status_code, response._content = 200, b"<html>maintenance</html>"
+        with self.assertRaises(http_client.UpstreamError):
+            self.get_json(response=response)
+        self.assertEqual(self.breaker.state, "open")
+
+    def test_client_error_status_leaves_the_breaker_closed(self):
+        response = requests.Response()
+        response.status_code, response._content = 422, b'{"message": "bad query"}'
+        with self.assertRaises(http_client.UpstreamError):
+            self.get_json(response=response)
+        self.assertEqual(self.breaker.state, "closed")
+
+    def test_unexpected_error_releases_half_open_trial(self):
+        self.breaker.record_failure()
+        self.breaker.opened_at -= 60
+        with self.assertRaises(RuntimeError):
+            self.get_json(RuntimeError("boom"))
+        self.assertTrue(self.breaker.allow())
+
+    def test_async_client_is_shared_per_loop_and_closed_with_it(self):
+        async def clients():
+            return http_client.get_async_client(), http_client.get_async_client()
+
+        first, again = asyncio.run(clients())
+        self.assertIs(first, again)
+        self.assertTrue(first.is_closed)
+        self.assertFalse(http_client._async_clients)
+        self.assertIsNot(asyncio.run(clients())[0], first)
+
+    def test_async_transport_error_is_an_upstream_failure(self):
+        client = mock.Mock(get=mock.AsyncMock(side_effect=httpx.RemoteProtocolError("eof")))
+        with mock.patch.object(http_client, "get_async_client", return_value=client):
+            with self.assertRaises(http_client.UpstreamError):
+                asyncio.run(
+                    http_client.async_get_json("test", "http://upstream.invalid/", max_retries=0)
+                )
+        self.assertEqual(self.breaker.state, "open")
+
+
+def random_walk(rng, n, step=0.01):
+    points = np.cumsum(rng.normal(0, step, size=(n, 2)), axis=0) + (40.0, -100.0)
+    points[rng.integers(1, n, size=n // 20)] = points[rng.integers(0, n, size=n // 20)]
+    return points
+
+
+class RouteGeometryTests(TestCase):
+    """The binary search and SpatialGrid lookups against plain linear scans."""
+
+    def test_nearest_index_matches_linear_scan(self):
+        rng = np.random.default_rng(6)
+        for n in (2, 50, 3000):
+            route = RouteGeometry(random_walk(rng, n))
+            lo, hi = route.points.min(axis=0) - 0.5, route.points.max(axis=0) + 0.5
+            queries = np.vstack([rng.uniform(lo, hi, size=(200, 2)), route.points[:50]])
+            expected = []
+            for lat, lon in queries:
+                d2 = (route.points[:, 0] - lat) ** 2 + (route.points[:, 1] - lon) ** 2
+                expected.append(int(np.argmin(d2)))
+                self.assertEqual(route.nearest_index(lat, lon), expected[-1])
+            self.assertEqual(route.nearest_indices(queries[:, 0], queries[:, 1]).tolist(), expected)
+
+    def test_indices_at_distances_match_linear_scan(self):
+        rng = np.random.default_rng(7)
+        route = RouteGeometry(random_walk(rng, 3000))
+        targets = np.concatenate(
+            [rng.uniform(-1000, route.total_distance_m + 1000, 500), route.cum_dist[::97]]
+        )
+        expected = [int(np.argmin(np.abs(route.cum_dist - t))) for t in targets]
+        self.assertEqual(route.indices_at_distances(targets).tolist(), expected)
+
+    def test_points_every(self):
+        route = RouteGeometry([[40.0, -100.0 + i / 100] for i in range(101)])
+        stops = route.points_every(route.total_distance_m / 4)
+        self.assertEqual([s["geometry_idx"] for s in stops], [25, 50, 75, 100])
+        self.assertEqual(route.points_every(0), [])
+
+
+class HosSimulatorTests(TestCase):
+    def simulate(self, waypoints, cycle_used_hours=0):
+        route = straight_route(waypoints)
+        route_geom = RouteGeometry(route["geometry"], route["distance_m"], route["duration_s"])
+        current, pickup, dropoff = (("A", waypoints[0]), ("B", waypoints[1]), ("C", waypoints[2]))
+        return hos.simulate_trip(route_geom, current, pickup, dropoff, START, cycle_used_hours)
+
+    def test_long_trip_is_legal(self):
+        stops = self.simulate(LONG_TRIP)
+        types = [s.type for s in stops]
+        self.assertEqual(types[0], "current")
+        self.assertEqual(types[-1], "dropoff")
+        self.assertEqual(types.count("pickup"), 1)
+        self.assertIn("rest", types)
+        self.assertIn("break", types)
+        self.assertIn("fuel", types)
+        self.assertEqual(hos_violations(plan_trip(stops)), [])
+        arrivals = [s.arrival_time for s in stops]
+        self.assertEqual(arrivals, sorted(arrivals))
+
+    def test_fuel_at_least_every_1000_miles(self):
+        stops = self.simulate(LONG_TRIP)
+        route = RouteGeometry(straight_route(LONG_TRIP)["geometry"])
+        along = [route.cum_dist[s.geometry_idx] for s in stops if s.type in ("current", "fuel")]
+        along.append(route.total_distance_m)
+        self.assertLessEqual(max(np.diff(along)), hos.FUEL_INTERVAL_M + 1000)
+
+    def test_cycle_limit_forces_restart(self):
+        fresh = self.simulate([(40.0, -105.0), (40.0, -100.0), (40.0, -95.0)], 0)
+        tired = self.simulate([(40.0, -105.0), (40.0, -100.0), (40.0, -95.0)], 65)
+        self.assertNotIn("restart", [s.type for s in fresh])
+        self.assertIn("restart", [s.type for s in tired])
+        self.assertGreater(tired[-1].arrival_time, fresh[-1].arrival_time)
+
+
+class PlanEndpointTests(PlannerTestCase):
+    def test_plan_saves_trip_with_fractional_cycle_hours(self):
+        response = self.plan(current_cycle_used=10.7)
+        self.assertEqual(response.status_code, 201)
+        trip = Trip.objects.get(pk=response.data["id"])
+        self.assertEqual(trip.current_cycle_used, 10.7)
+        self.assertEqual(response.data["current_cycle_used"], 10.7)
+        self.assertIn("pickup", [s["type"] for s in response.data["stops"]])
+        self.assertEqual(trip.stops.count(), len(response.data["stops"]))
+
+    def test_unresolved_location(self):
+        response = self.plan(dropoff_location="Atlantis")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["stops"], [])
+
+
+class BatchPlanTests(PlannerTestCase):
+    def setUp(self):
+        super().setUp()
+        # Fetch routes inline: I/O pool threads can't write through the test transaction
+        patcher = mock.patch.object(
+            trip_planning,
+            "map_with_deadline",
+            side_effect=lambda fn, items, deadline: [fn(item) for item in items],
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def plan_with_one_failure(self, name, starts_in_omaha):
+        real = getattr(trip_planning, name)
+
+        def flaky(*args):
+            if starts_in_omaha(args):
+                raise ValueError("boom")
+            return real(*args)
+
+        inputs = [
+            parse_trip_input(trip_body()),
+            parse_trip_input(trip_body(current_location="Omaha, NE")),
+        ]
+        with mock.patch.object(trip_planning, name, side_effect=flaky):
+            with self.assertLogs("planner.services.trip_planning", "ERROR"):
+                results, _ = trip_planning.plan_batch(inputs, timeout=30)
+        self.assertIn("trip", results[0])
+        self.assertEqual(results[1], {"index": 1, "error": "Planning failed"})
+
+    def test_serial_failure_only_fails_its_trip(self):
+        self.plan_with_one_failure(
+            "build_trip_plan", lambda args: args[0]["current_location"] == "Omaha, NE"
+        )
+
+    @override_settings(PLANNER_CPU_WORKERS=2)
+    def test_worker_failure_is_logged_not_reported_as_timeout(self):
+        pool = ThreadPoolExecutor(2)
+        self.addCleanup(pool.shutdown)
+        with mock.patch.object(trip_planning, "cpu_pool", return_value=pool):
+            self.plan_with_one_failure("plan_route", lambda args: args[1][0] == "Omaha, NE")
+
+
+class OnePerMinute(AnonRateThrottle):
+    rate = "1/min"
+
+
+class PlanViewPolicyTests(PlannerTestCase):
+    """The plain Django plan views apply the same DRF policies as /api/plan/."""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()  # throttle history
+
+    def test_permissions_apply_to_async_and_stream_views(self):
+        with mock.patch.object(PlanTripView, "permission_classes", [IsAuthenticated]):
+            for url in ("/api/plan/", "/api/plan/async/", "/api/plan/stream/"):
+                response = self.client.post(url, trip_body(), format="json")
+                self.assertEqual(response.status_code, 403, url)
+                self.assertIn("detail", response.json())
+        self.assertFalse(Trip.objects.exists())
+
+    def test_throttles_apply_to_async_and_stream_views(self):
+        with mock.patch.object(PlanTripView, "throttle_classes", [OnePerMinute]):
+            for url in ("/api/plan/async/", "/api/plan/stream/"):
+                cache.clear()
+                self.assertNotEqual(self.client.post(url, {}, format="json").status_code, 429)
+                response = self.client.post(url, trip_body(), format="json")
+                self.assertEqual(response.status_code, 429, url)
+                self.assertIn("Retry-After", response)
+
+
+class PolylineTests(TestCase):
+    def test_encode_matches_reference(self):
+        # The worked example from Google's polyline algorithm documentation
+        points = [[38.5, -120.2], [40.7, -120.95], [43.252, -126.453]]
+        self.assertEqual(encode_polyline(points), "_p~iF~ps|U_ulLnnqC_mqNvxq`@")
+        self.assertEqual(decode_polyline("_p~iF~ps|U_ulLnnqC_mqNvxq`@"), points)
+        self.assertEqual(encode_polyline([]), "")
+
+    def test_round_trip(self):
+        points = random_walk(np.random.default_rng(12), 2000, step=0.3)
+        decoded = np.array(decode_polyline(encode_polyline(points)))
+        self.assertLessEqual(np.abs(decoded - points).max(), 0.5e-5 + 1e-9)
+        decoded = np.array(decode_polyline(encode_polyline(points, precision=6), precision=6))
+        self.assertLessEqual(np.abs(decoded - points).max(), 0.5e-6 + 1e-9)
+
+    def test_simplify_stays_within_tolerance(self):
+        points = random_walk(np.random.default_rng(13), 2000, step=0.001)
+        kept = simplify_indices(points, 50.0)
+        self.assertEqual((kept[0], kept[-1]), (0, len(points) - 1))
+        self.assertLess(len(kept), len(points))
+        # Offsets in a local flat projection, as simplify_indices measures them
+        xy = np.radians(points[:, ::-1]) * EARTH_RADIUS_M
+        xy[:, 0] *= np.cos(np.radians(points[:, 0].mean()))
+        for start, end in zip(kept, kept[1:]):
+            seg = xy[end] - xy[start]
+            rel = xy[start + 1 : end] - xy[start]
+            t = np.clip(rel @ seg / max(seg @ seg, 1e-12), 0.0, 1.0)
+            offsets = np.hypot(*(rel - t[:, None] * seg).T)
+            self.assertTrue((offsets <= 50.0 + 1e-6).all())
+
+
+class RouteGeometryOptionsTests(PlannerTestCase):
+    def test_polyline_and_simplified_geometry(self):
+        full = self.plan().data
+        self.assertEqual(full["route_geometry_format"], "coords")
+        trip_id = full["id"]
+        response = self.client.get(f"/api/trips/{trip_id}/?geometry=polyline&zoom=6")
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["route_geometry_format"], "polyline")
+        decoded = decode_polyline(data["route_geometry"])
+        self.assertLess(len(decoded), len(full["route_geometry"]))
+        self.assertEqual(decoded[0], [round(v, 5) for v in full["route_geometry"][0]])
+
+    def test_rejects_bad_options(self):
+        for query in ("geometry=wkt", "tolerance=far", "zoom=close", "tolerance=nan", "zoom=inf"):
+            response = self.client.post(f"/api/plan/?{query}", trip_body(), format="json")
+            self.assertEqual(response.status_code, 400, query)
+
+
+class PackedGeometryTests(PlannerTestCase):
+    def test_pack_round_trip(self):
+        points = random_walk(np.random.default_rng(13), 1000, step=0.5)
+        blob = pack_geometry(points.tolist())
+        self.assertEqual(len(blob), 8 * len(points))
+        unpacked = unpack_geometry_array(blob)
+        self.assertLessEqual(np.abs(unpacked - points).max(), 0.5e-6 + 1e-12)
+        self.assertEqual(unpack_geometry(blob), unpacked.tolist())
+        self.assertEqual(unpack_geometry(pack_geometry([])), [])
+
+    def test_trip_is_rendered_from_its_stored_route(self):
+        planned = self.plan().data
+        with mock.patch.object(routing, "_fetch_route") as fetch:
+            response = self.client.get(f"/api/trips/{planned['id']}/")
+        fetch.assert_not_called()
+        stored = response.json()
+        self.assertEqual(stored["route_distance_m"], planned["route_distance_m"])
+        self.assertEqual(len(stored["route_geometry"]), len(planned["route_geometry"]))
+        self.assertLessEqual(
+            np.abs(np.array(stored["route_geometry"]) - planned["route_geometry"]).max(), 1e-6
+        )
+
+
+class QueryPlanTests(TestCase):
+    """The planner's hot queries use their indexes (migration 0010)."""
+
+    def setUp(self):
+        if connection.vendor == "postgresql":
+            # Small tables get sequential scans regardless; ask whether the index is usable
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+
+    def assertUsesIndex(self, queryset, *index_names):
+        plan = queryset.explain()
+        self.assertTrue(any(name in plan for name in index_names), plan)
+
+    def test_trip_list(self):
+        since = timezone.now() - timedelta(days=7)
+        self.assertUsesIndex(Trip.objects.order_by("-created_at", "-id")[:50], "trip_created_idx")
+        self.assertUsesIndex(Trip.objects.filter(created_at__gte=since), "trip_created_idx")
+
+    def test_trip_plan_rows(self):
+        since = timezone.now() - timedelta(days=7)
+        self.assertUsesIndex(
+            Stop.objects.filter(trip_id=1).order_by("order_index"), "stop_trip_order_idx"
+        )
+        self.assertUsesIndex(
+            Event.objects.filter(trip_id=1).order_by("order_index"), "event_trip_order_idx"
+        )
+        self.assertUsesIndex(
+            Event.objects.filter(trip_id=1, start_time__gte=since).order_by("start_time"),
+            "event_trip_start_idx",
+        )
+        self.assertUsesIndex(
+            LogSheet.objects.filter(trip_id=1, date=since.date()),
+            # SQLite builds table-level UNIQUE constraints as autoindexes
+            "logsheet_trip_date_uniq",
+            "sqlite_autoindex_planner_logsheet",
+        )
+
+    def test_one_log_sheet_per_trip_day(self):
+        trip = Trip.objects.create(
+            current_location="A", pickup_location="B", dropoff_location="C", current_cycle_used=0
+        )
+        LogSheet.objects.create(trip=trip, date=START.date(), sheet_json={})
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            LogSheet.objects.create(trip=trip, date=START.date(), sheet_json={})
+
+
+def fake_mapbox_json(endpoint, url, params=None, timeout=10):
+    if endpoint == "geocoding":
+        return {"features": [{"center": [-95.94, 41.26]}]}
+    return {
+        "routes": [
+            {
+                "distance": 1000.0,
+                "duration": 40.0,
+                "geometry": {"coordinates": [[-95.94, 41.26], [-95.9, 41.3]]},
+            }
+        ]
+    }
+
+
+class MapboxFixtureTests(TestCase):
+    def test_record_fixtures_to_given_directory(self):
+        trips = {"trips": [trip_body()]}
+        with tempfile.TemporaryDirectory() as out:
+            trips_file = Path(out) / "trips.json"
+            trips_file.write_text(json.dumps(trips))
+            with mock.patch.object(mapbox, "get_json", side_effect=fake_mapbox_json):
+                call_command("record_mapbox_fixtures", str(trips_file), out=out, stdout=StringIO())
+            self.assertEqual(len(list(Path(out).glob("geocoding/*.json"))), 3)
+            self.assertEqual(len(list(Path(out).glob("directions/*.json"))), 1)
+            path, params = routing._directions_request([(41.26, -95.94)] * 3)
+            fixture = json.loads(mapbox.fixture_path(out, "directions", path, params).read_text())
+            self.assertEqual(fixture["response"]["routes"][0]["distance"], 1000.0)
+
+
+class BenchmarkTests(TestCase):
+    def test_compare_flags_slowdowns_above_threshold_and_noise(self):
+        def report(**medians):
+            return {"results": [{"case": c, "median_ms": ms} for c, ms in medians.items()]}
+
+        rows = benchmarks.compare(
+            report(a=10.0, b=10.0, c=0.01, d=5.0), report(a=10.5, b=12.0, c=0.03, e=1.0)
+        )
+        self.assertEqual(
+            {row["case"]: row["regressed"] for row in rows}, {"a": False, "b": True, "c": False}
+        )
+
+    def test_local_route_benchmark_crosses_the_grid(self):
+        setup, run = benchmarks.bench_local_route(20, 90)
+        route = run(setup())
+        self.assertIsNotNone(route)
+        self.assertGreater(route["distance_m"], 0)
+
+    def test_endpoint_benchmark_refuses_configured_database(self):
+        with self.assertRaises(RuntimeError):
+            benchmarks.time_case(lambda: benchmarks.bench_plan_endpoint(10, 1, "warm"))
+
+    @override_settings(ALLOWED_HOSTS=["localhost"])
+    def test_endpoint_benchmark_runs_under_default_hosts(self):
+        # The test database stands in for scratch_database() here
+        with mock.patch.object(benchmarks, "_scratch_database", True):
+            stats = benchmarks.time_case(
+                lambda: benchmarks.bench_plan_endpoint(50, 1, "cold"), repeat=1, warmup=0
+            )
+        self.assertEqual(stats["runs"], 1)
+        self.assertFalse(Trip.objects.exists())
+
+    def test_mock_server_serves_fixtures_then_synthesizes(self):
+        route = benchmarks.synthetic_route(20, 1)
+        with benchmarks.MockMapbox(route) as server:
+            name, (lat, lon) = server.waypoints[0]
+            url = server.base_url + geocoding._geocode_path(name)
+            served = requests.get(url, params={"limit": 1}, timeout=5).json()
+            self.assertEqual(served["features"][0]["center"], [lon, lat])
+            missing = requests.get(url, params={"limit": 2}, timeout=5)
+            self.assertEqual(missing.status_code, 404)
+            self.assertEqual(server.server.stats["fixture"], 1)
+
+
+class MetricsViewTests(TestCase):
+    def get(self, **headers):
+        return self.client.get("/api/metrics/", headers=headers)
+
+    @override_settings(METRICS_TOKEN=None, DEBUG=False)
+    def test_disabled_without_token_outside_debug(self):
+        self.assertEqual(self.get().status_code, 403)
+
+    @override_settings(METRICS_TOKEN=None, DEBUG=True)
+    def test_open_without_token_in_debug(self):
+        self.assertEqual(self.get().status_code, 200)
+
+    @override_settings(METRICS_TOKEN="s3cret", DEBUG=False)
+    def test_requires_bearer_token(self):
+        self.assertEqual(self.get().status_code, 401)
+        self.assertEqual(self.get(Authorization="Bearer wrong").status_code, 401)
+        self.assertEqual(self.get(Authorization="Bearer s3cret").status_code, 200)
+
+
+# A fast two-way road and a one-way spur, with a slow road as the way back
+SMALL_ROADS = [
+    ([(0.0, 0.0), (0.0, 0.01), (0.0, 0.02)], 105 * road_graph.KPH, 0),
+    ([(0.0, 0.02), (0.01, 0.02)], 105 * road_graph.KPH, 1),
+    ([(0.0, 0.0), (0.01, 0.0), (0.01, 0.02)], 50 * road_graph.KPH, 0),
+]
+
+
+class RoadGraphTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.built = road_graph.build_graph(SMALL_ROADS)
+        road_graph.write_graph(Path(tmp.name) / "roads.graph", *self.built)
+        self.graph = road_graph.RoadGraph.open(Path(tmp.name) / "roads.graph")
+
+    def test_file_round_trip(self):
+        arrays, meta = self.built
+        self.assertEqual(self.graph.meta["nodes"], 3)
+        for name, array in arrays.items():
+            np.testing.assert_array_equal(getattr(self.graph, name), array)
+
+    def test_takes_fastest_path(self):
+        route = self.graph.route([(0.0, 0.0), (0.01, 0.02)])
+        self.assertEqual(route["geometry"][0], [0.0, 0.0])
+        self.assertEqual(route["geometry"][-1], [0.01, 0.02])
+        self.assertIn([0.0, 0.01], route["geometry"])
+        self.assertAlmostEqual(route["distance_m"], 0.03 * 111_195, delta=50)
+
+    def test_one_way_road_is_not_driven_backwards(self):
+        route = self.graph.route([(0.01, 0.02), (0.0, 0.02)])
+        self.assertIn([0.01, 0.0], route["geometry"])
+        self.assertGreater(route["distance_m"], 0.05 * 111_195 - 50)
+
+    def test_search_bound_and_snap_distance(self):
+        self.assertIsNone(self.graph.route([(0.0, 0.0), (0.01, 0.02)], max_settled=0))
+        self.assertIsNone(self.graph.route([(0.0, 0.0), (0.5, 0.5)], max_snap_m=5000))
+
+    @override_settings(ROUTING_BACKENDS=["local", "mapbox"], ROAD_GRAPH_PATH="roads.graph")
+    def test_local_failure_falls_through_to_mapbox(self):
+        broken = mock.Mock(route=mock.Mock(side_effect=IndexError("bad graph")))
+        fallback = mock.Mock(return_value={"distance_m": 1.0})
+        with mock.patch.object(routing, "load_graph", return_value=broken), mock.patch.dict(
+            routing._BACKENDS, {"mapbox": (fallback, None)}
+        ), self.assertLogs("planner.services.routing", "ERROR"):
+            self.assertEqual(routing._fetch_route([(0.0, 0.0), (0.0, 0.02)]), {"distance_m": 1.0})
+
+
+CENSUS_PLACES = """USPS\tGEOID\tNAME\tPOP\tINTPTLAT\tINTPTLONG
+IL\t1714000\tChicago city\t2746388\t41.837551\t-87.681844
+IL\t1714026\tChicago Heights city\t27480\t41.510967\t-87.638512
+NV\t3209700\tCarson City\t58639\t39.151638\t-119.743695
+OH\t3914000\tChicago CDP\t100\t41.0\t-82.0
+XX\t0000000\tNowhere city\t1\t0.0\t0.0
+"""
+
+
+class GazetteerTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        source = Path(tmp.name) / "places.txt"
+        source.write_text(CENSUS_PLACES)
+        self.path = Path(tmp.name) / "places.gaz"
+        gazetteer.write_gazetteer(
+            self.path, *gazetteer.build_gazetteer(gazetteer.rows_from_file(source))
+        )
+        self.index = gazetteer.Gazetteer.open(self.path)
+
+    def test_rows_from_plain_csv(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False) as f:
+            f.write("name,state,lat,lon\nAspen,co,39.19,-106.82\n")
+        self.addCleanup(Path(f.name).unlink)
+        rows = list(gazetteer.rows_from_file(f.name))
+        self.assertEqual(rows, [("Aspen", "CO", 39.19, -106.82, 0)])
+
+    def test_exact_lookup(self):
+        self.assertEqual(self.index.meta["places"], 4)
+        for query in ("Chicago, IL", "chicago il", "CHICAGO IL, USA", "Chicago,Illinois"):
+            self.assertEqual(self.index.lookup(query), (41.837551, -87.681844), query)
+        self.assertEqual(self.index.lookup("Carson City, NV"), (39.151638, -119.743695))
+        self.assertIsNone(self.index.lookup("Chicago"))
+        self.assertIsNone(self.index.lookup("Nowhere, XX"))
+
+    def test_prefix_completion_most_populous_first(self):
+        names = [place["name"] for place in self.index.complete("chica")]
+        self.assertEqual(names, ["Chicago, IL", "Chicago Heights, IL", "Chicago, OH"])
+        self.assertEqual(len(self.index.complete("chicago", limit=1)), 1)
+        self.assertEqual(self.index.complete("zzz"), [])
+
+    def test_geocoding_and_places_view_use_it(self):
+        geocoding._memory_cache.clear()
+        with override_settings(GAZETTEER_PATH=str(self.path)), mock.patch.object(
+            geocoding, "_fetch_geocode"
+        ) as fetch:
+            self.assertEqual(geocoding.geocode_location("Chicago IL"), (41.837551, -87.681844))
+            response = self.client.get("/api/places/", {"q": "carson", "limit": 3})
+        fetch.assert_not_called()
+        self.assertEqual(response.json()["results"][0]["name"], "Carson City, NV")
+
+
+class PlanJobTests(PlannerTestCase):
+    def enqueue(self):
+        return plan_jobs.enqueue_plan_job(parse_trip_input(trip_body()))
+
+    def expire(self, job):
+        PlanJob.objects.filter(id=job.id).update(lease_expires_at=timezone.now() - timedelta(1))
+
+    def test_claim_and_run(self):
+        queued = self.enqueue()
+        job = plan_jobs.claim_job()
+        self.assertEqual((job.id, job.status, job.attempts), (queued.id, PlanJob.RUNNING, 1))
+        self.assertIsNone(plan_jobs.claim_job())
+        plan_jobs.run_job(job)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.lease_token), (PlanJob.SUCCEEDED, ""))
+        body = plan_jobs.job_status(job)
+        self.assertEqual(body["result"]["id"], job.trip_id)
+
+    def test_expired_lease_is_taken_over_and_late_result_discarded(self):
+        self.enqueue()
+        first = plan_jobs.claim_job()
+        self.expire(first)
+        second = plan_jobs.claim_job()
+        self.assertEqual((second.id, second.attempts), (first.id, 2))
+        self.assertNotEqual(second.lease_token, first.lease_token)
+        with self.assertLogs("planner.services.plan_jobs", "WARNING"):
+            plan_jobs.run_job(first)
+        self.assertFalse(Trip.objects.exists())
+        plan_jobs.run_job(second)
+        self.assertEqual(Trip.objects.count(), 1)
+
+    def test_error_is_retried_without_leaking_details(self):
+        self.enqueue()
+        job = plan_jobs.claim_job()
+        failure = RuntimeError("password=hunter2")
+        with mock.patch.object(plan_jobs, "prepare_single_trip", side_effect=failure):
+            with self.assertLogs("planner.services.plan_jobs", "ERROR") as logs:
+                plan_jobs.run_job(job)
+        job.refresh_from_db()
+        self.assertEqual(job.status, PlanJob.QUEUED)
+        self.assertNotIn("hunter2", job.error)
+        self.assertIn("hunter2", "\n".join(logs.output))
+
+    def test_abandoned_job_fails_after_last_attempt(self):
+        job = self.enqueue()
+        PlanJob.objects.filter(id=job.id).update(status=PlanJob.RUNNING, attempts=job.max_attempts)
+        self.expire(job)
+        self.assertIsNone(plan_jobs.claim_job())
+        self.assertEqual(plan_jobs.fail_abandoned_jobs(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, PlanJob.FAILED)
+
+
+def ndjson_events(chunks):
+    return [json.loads(line) for line in b"".join(chunks).decode().splitlines()]
+
+
+class StreamPlanTests(PlannerTestCase):
+    def test_streams_events_under_wsgi(self):
+        response = self.client.post("/api/plan/stream/", trip_body(), format="json")
+        self.assertFalse(response.is_async)
+        events = ndjson_events(response.streaming_content)
+        self.assertEqual(events[0]["event"], "geocoded")
+        self.assertEqual(events[-1]["event"], "trip")
+        self.assertTrue(Trip.objects.filter(pk=events[-1]["trip"]["id"]).exists())
+
+    async def test_streams_async_iterator_under_asgi(self):
+        response = await self.async_client.post(
+            "/api/plan/stream/", trip_body(), content_type="application/json"
+        )
+        self.assertTrue(response.is_async)
+        events = ndjson_events([chunk async for chunk in response.streaming_content])
+        self.assertEqual(events[-1]["event"], "trip")
+
+    def test_async_chunks_closes_source_when_abandoned(self):
+        closed = []
+
+        def source():
+            try:
+                yield b"a"
+                yield b"b"
+            finally:
+                closed.append(True)
+
+        async def first_only():
+            chunks = async_chunks(source())
+            first = await anext(chunks)
+            await chunks.aclose()
+            return first
+
+        self.assertEqual(asyncio.run(first_only()), b"a")
+        self.assertEqual(closed, [True])
+
+
+class ReplanTests(PlannerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.trip = self.plan().data
+        self.pickup = next(s for s in self.trip["stops"] if s["type"] == "pickup")
+
+    def replan(self, **changes):
+        return self.client.post(f"/api/trips/{self.trip['id']}/replan/", changes, format="json")
+
+    def assertPlanMatchesStops(self, trip_id):
+        """Stored events and day sheets are what planning the stored stops gives."""
+        trip = Trip.objects.get(pk=trip_id)
+        plan = plan_trip([planned_stop(s) for s in trip.stops.order_by("order_index")])
+        events = trip.events.order_by("order_index")
+        self.assertEqual(
+            [(e.status, e.start_time, e.end_time) for e in events],
+            [(seg.status, seg.start_time, seg.end_time) for seg in plan.segments],
+        )
+        sheets = trip.logsheets.order_by("date")
+        self.assertEqual(
+            [(sheet.date.isoformat(), sheet.sheet_json) for sheet in sheets],
+            [(sheet.date, sheet.to_json()) for sheet in plan.sheets],
+        )
+        self.assertEqual(hos_violations(plan), [])
+
+    def test_longer_wait_at_pickup_moves_later_stops(self):
+        index = self.pickup["order_index"]
+        kept = list(Stop.objects.filter(trip_id=self.trip["id"], order_index__lte=index))
+        response = self.replan(stop=index, duration_hours=self.pickup["duration_hours"] + 3)
+        self.assertEqual(response.status_code, 200)
+        stops = response.data["stops"]
+        self.assertEqual(stops[index - 1]["duration_hours"], self.pickup["duration_hours"] + 3)
+        # The wait also counts as the 30-minute break, so later stops move less
+        before = datetime.fromisoformat(self.trip["stops"][-1]["arrival_time"])
+        after = datetime.fromisoformat(stops[-1]["arrival_time"])
+        self.assertGreater(after, before)
+        self.assertEqual(
+            list(Stop.objects.filter(trip_id=self.trip["id"], order_index__lte=index)), kept
+        )
+        self.assertPlanMatchesStops(self.trip["id"])
+
+    def test_add_then_remove_a_fuel_stop(self):
+        geometry = stored_route(Trip.objects.get(pk=self.trip["id"]))["geometry"]
+        lat, lon = geometry[int(len(geometry) * 0.8)]
+        index = self.pickup["order_index"]
+        response = self.replan(stop=index, add_stops=[{"type": "fuel", "lat": lat, "lon": lon}])
+        self.assertEqual(response.status_code, 200)
+        added = [s for s in response.data["stops"] if s["added"]]
+        self.assertEqual([s["type"] for s in added], ["fuel"])
+        self.assertPlanMatchesStops(self.trip["id"])
+
+        response = self.replan(stop=index, remove_stops=[added[0]["order_index"]])
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(any(s["added"] for s in response.data["stops"]))
+        self.assertPlanMatchesStops(self.trip["id"])
+
+    def test_rejects_changes_that_do_not_fit(self):
+        index = self.pickup["order_index"]
+        for changes in (
+            {"stop": index},
+            {"stop": "x", "duration_hours": 1},
+            {"stop": 99, "duration_hours": 1},
+            {"stop": index, "arrival_time": "nope"},
+            {"stop": index, "remove_stops": [index + 1]},
+            {"stop": index, "add_stops": [{"type": "pickup", "lat": 1, "lon": 1}]},
+        ):
+            self.assertEqual(self.replan(**changes).status_code, 400, changes)
+        response = self.client.post(
+            "/api/trips/999/replan/", {"stop": 1, "duration_hours": 1}, format="json"
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class DedupeTests(PlannerTestCase):
+    def post(self, key=None, **overrides):
+        headers = {"Idempotency-Key": key} if key else {}
+        body = trip_body(**overrides)
+        return self.client.post("/api/plan/", body, format="json", headers=headers)
+
+    def test_idempotency_key_replays_the_trip(self):
+        first, again = self.post("k-1"), self.post("k-1")
+        self.assertEqual(first.data["id"], again.data["id"])
+        self.assertEqual(again["Idempotent-Replayed"], "true")
+        self.assertNotIn("Idempotent-Replayed", first)
+        self.assertEqual(Trip.objects.count(), 1)
+        self.assertEqual(self.post("k-1", current_cycle_used=20).status_code, 422)
+
+    def test_inputs_are_deduped_only_when_enabled(self):
+        self.assertNotEqual(self.post().data["id"], self.post().data["id"])
+        with mock.patch.object(dedupe, "PLAN_DEDUPE_INPUTS", True):
+            first = self.post(current_location="Denver, CO")
+            again = self.post(current_location="  denver,co ")
+        self.assertEqual(first.data["id"], again.data["id"])
+
+    def test_only_the_current_claim_can_settle_the_key(self):
+        key, fingerprint = dedupe.request_key(parse_trip_input(trip_body()), "k-2")
+        state, stale = dedupe.claim(key, fingerprint)
+        self.assertEqual(state, dedupe.LEAD)
+        PlanRequest.objects.filter(key=key).update(expires_at=timezone.now() - timedelta(1))
+        state, token = dedupe.claim(key, fingerprint)
+        self.assertEqual(state, dedupe.LEAD)
+        trip = self.plan().data["id"]
+        dedupe.finish(key, stale, trip)
+        dedupe.abandon(key, stale)
+        self.assertEqual(dedupe.claim(key, fingerprint), (dedupe.WAIT, None))
+        dedupe.finish(key, token, trip)
+        self.assertEqual(dedupe.claim(key, fingerprint), (dedupe.DONE, trip))
+
+    def test_waiter_backs_off_and_plans_within_its_timeout(self):
+        trip_input = parse_trip_input(trip_body())
+        key, fingerprint = dedupe.request_key(trip_input, "k-4")
+        dedupe.claim(key, fingerprint)  # a leader that never finishes
+        sleeps = []
+        real_sleep = dedupe.time.sleep
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            real_sleep(seconds)
+
+        with (
+            mock.patch.object(dedupe.time, "sleep", side_effect=sleep),
+            mock.patch.object(dedupe, "plan_single_trip", return_value=(None, None)) as plan,
+            self.assertLogs("planner.services.dedupe", "WARNING"),
+        ):
+            dedupe.plan_once(trip_input, 1.0, idempotency_key="k-4")
+        self.assertEqual(sleeps[:3], [0.05, 0.1, 0.2])
+        self.assertLessEqual(sum(sleeps), 1.0 * dedupe.WAIT_SHARE + 1e-6)
+        self.assertLessEqual(plan.call_args.args[1], 1.0 - sum(sleeps))
+
+    def test_stream_claims_only_once_read(self):
+        trip_input = parse_trip_input(trip_body())
+        events, replayed = dedupe.stream_once(trip_input, 10, idempotency_key="k-3")
+        self.assertFalse(replayed)
+        self.assertFalse(PlanRequest.objects.exists())
+        trip = list(events)[-1]["trip"]["id"]
+        self.assertEqual(PlanRequest.objects.get().trip_id, trip)
+        events, replayed = dedupe.stream_once(trip_input, 10, idempotency_key="k-3")
+        self.assertTrue(replayed)
+        self.assertEqual(list(events)[-1]["trip"]["id"], trip)
+
+
+POI_ROUTE = [(40.0, -100.0), (40.0, -99.9), (40.0, -90.0)]
+
+
+def poi_csv(path):
+    """A POI every ~17 km along POI_ROUTE, 1-2 km north of it, plus some too far off."""
+    lines = ["name,lat,lon,kind,city,state"]
+    for i in range(50):
+        lon = -100.0 + i * 0.2
+        kind = poi_index.KINDS[i % 3]
+        lines.append(f"Stop {i},{40.0 + 0.009 * (1 + i % 2)},{lon},{kind},Town {i},KS")
+        lines.append(f"Far {i},{40.1},{lon + 0.1},truck_stop,,")
+    lines.append("Shop,40.0,-99.0,grocery,,")
+    path.write_text("\n".join(lines) + "\n")
+
+
+class PoiIndexTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        source = Path(tmp.name) / "pois.csv"
+        poi_csv(source)
+        self.rows = list(poi_index.rows_from_file(str(source)))
+        index_path = Path(tmp.name) / "pois.idx"
+        poi_index.write_poi_index(index_path, *poi_index.build_poi_index(self.rows))
+        self.index = poi_index.PoiIndex.open(index_path)
+        route = straight_route(POI_ROUTE)
+        self.route = RouteGeometry(route["geometry"], route["distance_m"], route["duration_s"])
+        self.corridor = self.index.corridor(self.route, 3000, 40000)
+
+    def test_rows_from_csv(self):
+        self.assertEqual(len(self.rows), 100)
+        self.assertEqual(self.rows[0], ("Stop 0, Town 0, KS", 40.009, -100.0, "truck_stop"))
+        self.assertEqual(self.rows[1][0], "Far 0")
+
+    def test_corridor_holds_nearby_pois_in_route_order(self):
+        self.assertEqual(len(self.corridor), 50)
+        self.assertTrue(all(name.startswith("Stop ") for name in self.corridor.names))
+        self.assertTrue(np.all(np.diff(self.corridor.along_m) >= 0))
+        numbers = [int(name.split(",")[0].removeprefix("Stop ")) for name in self.corridor.names]
+        offsets = [1000.0 * (1 + i % 2) for i in numbers]
+        np.testing.assert_allclose(self.corridor.off_route_m, offsets, rtol=0.01)
+
+    def test_best_needs_a_suited_stop_whose_detour_fits(self):
+        kinds = poi_index.KINDS
+        corridor = poi_index.Corridor(
+            along_m=np.array([1000.0, 5000.0, 9000.0]),
+            off_route_m=np.array([100.0, 3000.0, 600.0]),
+            route_idx=np.zeros(3, dtype=np.int64),
+            lat=np.zeros(3),
+            lon=np.zeros(3),
+            kind=np.array([kinds.index("rest_area"), 0, 0], dtype=np.uint8),
+            names=["a", "b", "c"],
+            max_backtrack_m=20000,
+        )
+        # c and b can't be reached and left again in the driving given up
+        self.assertEqual(corridor.best("rest", 0, 10000).name, "a")
+        self.assertIsNone(corridor.best("fuel", 0, 10000))
+        self.assertEqual(corridor.best("fuel", 0, 11000).name, "c")
+        self.assertIsNone(corridor.best("rest", 2000, 10000))
+
+    def test_snapped_trip_is_legal_and_drives_the_detour(self):
+        timeline = hos.Timeline(self.route, START, 0, self.corridor)
+        first = next(timeline.drive_to(self.route.total_distance_m))
+        self.assertEqual(first.type, "break")
+        k = self.corridor.names.index(first.location)
+        driven = self.corridor.along_m[k] + 2 * self.corridor.off_route_m[k]
+        self.assertAlmostEqual(
+            (first.arrival_time - START).total_seconds(), driven / self.route.avg_speed_mps, 3
+        )
+
+        current, pickup, dropoff = (("A", POI_ROUTE[0]), ("B", POI_ROUTE[1]), ("C", POI_ROUTE[2]))
+        stops = hos.simulate_trip(self.route, current, pickup, dropoff, START, 0, self.corridor)
+        self.assertIn(first.location, [s.location for s in stops])
+        self.assertEqual(hos_violations(plan_trip(stops)), [])
@@ -1,7 +1,29 @@
 from django.urls import path
 
-from .views import PlanTripView
+from .views import (
+    AsyncPlanTripView,
+    BatchPlanTripView,
+    MetricsView,
+    PlanJobCreateView,
+    PlanJobDetailView,
+    PlacesView,
+    PlanTripView,
+    StreamPlanTripView,
+    TripDetailView,
+    TripListView,
+    TripReplanView,
+)
 
 urlpatterns = [
     path("plan/", PlanTripView.as_view(), name="plan-trip"),
+    path("plan/async/", AsyncPlanTripView.as_view(), name="plan-trip-async"),
+    path("plan/stream/", StreamPlanTripView.as_view(), name="plan-trip-stream"),
+    path("plan/batch/", BatchPlanTripView.as_view(), name="plan-trip-batch"),
+    path("plan/jobs/", PlanJobCreateView.as_view(), name="plan-job-create"),
+    path("plan/jobs/<int:pk>/", PlanJobDetailView.as_view(), name="plan-job-detail"),
+    path("trips/", TripListView.as_view(), name="trip-list"),
+    path("trips/<int:pk>/", TripDetailView.as_view(), name="trip-detail"),
+    path("trips/<int:pk>/replan/", TripReplanView.as_view(), name="trip-replan"),
+    path("places/", PlacesView.as_view(), name="places"),
+    path("metrics/", MetricsView.as_view(), name="metrics"),
 ]
@@ -1,282 +1,420 @@
-# Create your views here.
+import hmac
 import json
-from datetime import datetime, timedelta
-from math import atan2, cos, radians, sin, sqrt
 
-import requests
-from django.shortcuts import render
-from django.utils import timezone
-from rest_framework import status
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.cache import patch_vary_headers
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions, status
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from .models import Event, LogSheet, Stop, Trip
-from .serializers import TripSerializer
-from .services.event_planning import plan_trip
-from .services.geocoding import geocode_location
-from .services.routing import get_mapbox_route
+from .models import PlanJob, Trip
+from .pagination import TripCursorPagination
+from .serializers import TripSummarySerializer
+from .services.dedupe import IdempotencyConflict, plan_once, plan_once_async, stream_once
+from .services.geocoding import gazetteer
+from .services.instrumentation import span
+from .services.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+from .services.metrics import render_metrics
+from .services.persistence import with_plan
+from .services.plan_jobs import enqueue_plan_job, job_status
+from .services.replanning import parse_replan_input, replan_trip
+from .services.streaming import (
+    NDJSON_CONTENT_TYPE,
+    SSE_CONTENT_TYPE,
+    async_chunks,
+    guard_events,
+    gzip_chunks,
+    ndjson_lines,
+    sse_messages,
+)
+from .services.trip_cache import cached_trip_json, make_etag, not_modified, trip_etag
+from .services.trip_planning import (
+    PlanInputError,
+    parse_geometry_options,
+    parse_trip_input,
+    plan_batch,
+    trip_response,
+)
+
+IDEMPOTENCY_CONFLICT = "Idempotency-Key was already used for a different trip"
+
+
+def mark_replayed(response, replayed):
+    """Tell clients when a plan response is a trip planned by an identical request."""
+    if replayed:
+        response["Idempotent-Replayed"] = "true"
+    return response
 
 
 class PlanTripView(APIView):
     """
     Mock planner API
     Accepts trip input and returns a fake planned trip with stops, events, and logsheets.
+    Query params ?geometry=polyline and ?zoom= / ?tolerance= shrink route_geometry.
     """
 
     def post(self, request):
-        data = request.data
+        try:
+            trip_input = parse_trip_input(request.data)
+            geometry_options = parse_geometry_options(request.query_params)
+        except PlanInputError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            trip, route, replayed = plan_once(
+                trip_input,
+                timeout=getattr(settings, "PLAN_REQUEST_TIMEOUT", 20),
+                idempotency_key=request.headers.get("Idempotency-Key"),
+            )
+        except PlanInputError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except IdempotencyConflict:
+            return Response(
+                {"error": IDEMPOTENCY_CONFLICT}, status=status.HTTP_422_UNPROCESSABLE_ENTITY
+            )
+        with span("serialize"):
+            trip_data = trip_response(trip, route, geometry_options)
+
+        return mark_replayed(Response(trip_data, status=status.HTTP_201_CREATED), replayed)
+
+
+def api_policy_error(request):
+    """
+    PlanTripView's DRF authentication, permission and throttle checks, for the
+    plan views DRF can't serve itself (native async, streaming). Returns the
+    error response DRF would send, or None if the request may go ahead.
+    """
+    view = PlanTripView()
+    view.args, view.kwargs, view.headers = (), {}, {}
+    view.request = view.initialize_request(request)
+    try:
+        view.perform_authentication(view.request)
+        view.check_permissions(view.request)
+        view.check_throttles(view.request)
+    except exceptions.APIException as e:
+        response = view.handle_exception(e)
+        response.accepted_renderer = JSONRenderer()
+        response.accepted_media_type = JSONRenderer.media_type
+        response.renderer_context = view.get_renderer_context()
+        return response.render()
+    return None
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class AsyncPlanTripView(View):
+    """
+    Same contract as PlanTripView, as a native async view for ASGI servers.
+    While Mapbox calls are in flight the request holds no thread, so one worker
+    can serve many plans at once. DRF views are sync-only, hence plain Django,
+    with DRF's policies applied by api_policy_error.
+    """
 
-        # Extract input
-        current_location = data.get("current_location")
-        pickup_location = data.get("pickup_location")
-        dropoff_location = data.get("dropoff_location")
-        current_cycle_used = data.get("current_cycle_used", 0)
+    async def post(self, request):
+        error = await sync_to_async(api_policy_error)(request)
+        if error is not None:
+            return error
+        try:
+            data = json.loads(request.body or b"{}")
+            trip_input = parse_trip_input(data)
+            geometry_options = parse_geometry_options(request.GET)
+        except ValueError as e:  # includes PlanInputError and bad JSON
+            message = str(e) if isinstance(e, PlanInputError) else "Invalid JSON body"
+            return JsonResponse({"error": message}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            trip, route, replayed = await plan_once_async(
+                trip_input,
+                timeout=getattr(settings, "PLAN_REQUEST_TIMEOUT", 20),
+                idempotency_key=request.headers.get("Idempotency-Key"),
+            )
+        except PlanInputError as e:
+            return JsonResponse({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except IdempotencyConflict:
+            return JsonResponse(
+                {"error": IDEMPOTENCY_CONFLICT}, status=status.HTTP_422_UNPROCESSABLE_ENTITY
+            )
+        with span("serialize"):
+            trip_data = await sync_to_async(trip_response)(trip, route, geometry_options)
+        return mark_replayed(JsonResponse(trip_data, status=status.HTTP_201_CREATED), replayed)
 
-        if not all([current_location, pickup_location, dropoff_location]):
+
+@method_decorator(csrf_exempt, name="dispatch")
+class StreamPlanTripView(View):
+    """
+    Same input as PlanTripView, but the trip is streamed as it is planned: the
+    route first, then each stop and each day's log sheet, then the saved trip
+    (see trip_planning.stream_single_trip). Newline-delimited JSON by default;
+    server-sent events with ?format=sse or Accept: text/event-stream. Under ASGI
+    the body is an async iterator, so it streams there too.
+    Plain Django because DRF's content negotiation would reject those types;
+    DRF's policies are applied by api_policy_error.
+    """
+
+    def post(self, request):
+        error = api_policy_error(request)
+        if error is not None:
+            return error
+        try:
+            data = json.loads(request.body or b"{}")
+            trip_input = parse_trip_input(data)
+            geometry_options = parse_geometry_options(request.GET)
+        except ValueError as e:  # includes PlanInputError and bad JSON
+            message = str(e) if isinstance(e, PlanInputError) else "Invalid JSON body"
+            return JsonResponse({"error": message}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            events, replayed = stream_once(
+                trip_input,
+                timeout=getattr(settings, "PLAN_REQUEST_TIMEOUT", 20),
+                geometry_options=geometry_options,
+                idempotency_key=request.headers.get("Idempotency-Key"),
+            )
+        except PlanInputError as e:
+            return JsonResponse({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except IdempotencyConflict:
+            return JsonResponse(
+                {"error": IDEMPOTENCY_CONFLICT}, status=status.HTTP_422_UNPROCESSABLE_ENTITY
+            )
+        events = guard_events(events)
+        sse = request.GET.get("format") == "sse" or SSE_CONTENT_TYPE in request.headers.get(
+            "Accept", ""
+        )
+        chunks = sse_messages(events) if sse else ndjson_lines(events)
+        # GZipMiddleware would buffer the stream, so compress here with per-event flushes
+        gzip = "gzip" in request.headers.get("Accept-Encoding", "")
+        if gzip:
+            chunks = gzip_chunks(chunks)
+        if isinstance(request, ASGIRequest):
+            chunks = async_chunks(chunks)
+        response = StreamingHttpResponse(
+            chunks, content_type=SSE_CONTENT_TYPE if sse else NDJSON_CONTENT_TYPE
+        )
+        if gzip:
+            response["Content-Encoding"] = "gzip"
+        patch_vary_headers(response, ["Accept", "Accept-Encoding"])
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"  # tell nginx not to buffer
+        return mark_replayed(response, replayed)
+
+
+class BatchPlanTripView(APIView):
+    """
+    Plan many trips in one request.
+    Accepts {"trips": [<trip input>, ...]} and returns per-trip results or errors
+    in input order, plus aggregate stage timings.
+    """
+
+    def post(self, request):
+        trips = request.data.get("trips") if isinstance(request.data, dict) else None
+        if not isinstance(trips, list) or not trips:
             return Response(
-                {"error": "Missing required fields"},
+                {"error": "Expected a non-empty list under 'trips'"},
                 status=status.HTTP_400_BAD_REQUEST,
             )
+        max_trips = getattr(settings, "PLAN_BATCH_MAX_TRIPS", 500)
+        if len(trips) > max_trips:
+            return Response(
+                {"error": f"At most {max_trips} trips per batch"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            geometry_options = parse_geometry_options(request.query_params)
+        except PlanInputError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        trip_inputs = []
+        for data in trips:
+            try:
+                trip_inputs.append(parse_trip_input(data))
+            except PlanInputError as e:
+                trip_inputs.append(e)
+
+        results, timing = plan_batch(
+            trip_inputs,
+            timeout=getattr(settings, "PLAN_BATCH_TIMEOUT", 300),
+            geometry_options=geometry_options,
+        )
+        succeeded = sum(1 for r in results if "trip" in r)
+        return Response(
+            {
+                "results": results,
+                "count": len(results),
+                "succeeded": succeeded,
+                "failed": len(results) - succeeded,
+                "timing": timing,
+            },
+            status=status.HTTP_200_OK,
+        )
+
+
+def not_modified_response(etag):
+    return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
 
-        # Geocode locations
-        current_coords = geocode_location(current_location)
-        pickup_coords = geocode_location(pickup_location)
-        dropoff_coords = geocode_location(dropoff_location)
-
-        print("Current coords:", current_coords)
-        print("Pickup coords:", pickup_coords)
-        print("Dropoff coords:", dropoff_coords)
-
-        # Create trip
-        trip = Trip.objects.create(
-            current_location=current_location,
-            pickup_location=pickup_location,
-            dropoff_location=dropoff_location,
-            current_cycle_used=current_cycle_used,
+class PlanJobCreateView(APIView):
+    """
+    Queue a plan instead of running it in the request. Same body and geometry
+    query params as /api/plan/; returns 202 with the job's status URL.
+    """
+
+    def post(self, request):
+        try:
+            trip_input = parse_trip_input(request.data)
+            geometry_options = parse_geometry_options(request.query_params)
+        except PlanInputError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        job = enqueue_plan_job(trip_input, geometry_options)
+        url = request.build_absolute_uri(reverse("plan-job-detail", args=[job.id]))
+        response = Response(
+            {"id": job.id, "status": job.status, "url": url}, status=status.HTTP_202_ACCEPTED
         )
+        response["Location"] = url
+        return response
+
 
-        # Trip start time: tomorrow at 7 AM
-        start_time = timezone.now().replace(hour=7, minute=0, second=0, microsecond=0) + timedelta(
-            days=1
+class PlanJobDetailView(APIView):
+    """Job status; once succeeded, "result" holds the trip as /api/plan/ returns it."""
+
+    def get(self, request, pk):
+        job = PlanJob.objects.filter(pk=pk).first()
+        if job is None:
+            return Response({"error": "Job not found"}, status=status.HTTP_404_NOT_FOUND)
+        with span("serialize"):
+            body = job_status(job)
+        response = Response(body)
+        if job.status in (PlanJob.QUEUED, PlanJob.RUNNING):
+            response["Retry-After"] = "1"
+        return response
+
+
+class TripListView(APIView):
+    """
+    Saved trips, newest first, cursor-paginated (?cursor=, ?page_size=).
+    Rows are summaries without stops or sheets; fetch a trip for the full plan.
+    Responds 304 when the page is unchanged since the client's If-None-Match.
+    """
+
+    def get(self, request):
+        queryset = Trip.objects.only(*TripSummarySerializer.Meta.fields)
+        paginator = TripCursorPagination()
+        page = paginator.paginate_queryset(queryset, request, view=self)
+
+        etag = make_etag(
+            "trips", request.get_full_path(), *(f"{t.id}@{t.updated_at.isoformat()}" for t in page)
         )
+        if not_modified(request, etag):
+            return not_modified_response(etag)
 
-        # Fetch route geometry from OSRM
-        route = None
-        fuel_stops = []
-        break_stops = []
-
-        if all(
-            [
-                current_coords[0] is not None,
-                current_coords[1] is not None,
-                pickup_coords[0] is not None,
-                pickup_coords[1] is not None,
-                dropoff_coords[0] is not None,
-                dropoff_coords[1] is not None,
-            ]
-        ):
-            route = get_mapbox_route(
-                [
-                    current_coords,
-                    pickup_coords,
-                    dropoff_coords,
-                ]
+        response = paginator.get_paginated_response(TripSummarySerializer(page, many=True).data)
+        response["ETag"] = etag
+        response["Cache-Control"] = "private, no-cache"
+        return response
+
+
+class TripDetailView(APIView):
+    """
+    One saved trip with stops, log sheets and its stored route, in the same shape
+    as the plan response (same geometry query params). The rendered JSON is
+    cached per trip version; unchanged trips answer If-None-Match with 304.
+    """
+
+    def get(self, request, pk):
+        try:
+            geometry_options = parse_geometry_options(request.query_params)
+        except PlanInputError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        # One indexed lookup decides between 404, 304 and the cache
+        updated_at = Trip.objects.filter(pk=pk).values_list("updated_at", flat=True).first()
+        if updated_at is None:
+            return Response({"error": "Trip not found"}, status=status.HTTP_404_NOT_FOUND)
+        etag = trip_etag(pk, updated_at, geometry_options)
+        if not_modified(request, etag):
+            return not_modified_response(etag)
+
+        def build():
+            trip = with_plan(Trip.objects).get(pk=pk)
+            return trip_response(trip, geometry_options=geometry_options)
+
+        with span("serialize"):
+            body = cached_trip_json(pk, etag, build)
+        response = HttpResponse(body, content_type="application/json")
+        response["ETag"] = etag
+        response["Cache-Control"] = "private, no-cache"
+        return response
+
+
+class TripReplanView(APIView):
+    """
+    Replan a saved trip from a stop the driver has reached, e.g. after a late
+    arrival or a long wait at pickup, or to add or remove stops further on
+    (see services.replanning for the body). Reuses the stored route; returns
+    the updated trip as GET /api/trips/<id>/ does.
+    """
+
+    def post(self, request, pk):
+        try:
+            changes = parse_replan_input(request.data)
+            geometry_options = parse_geometry_options(request.query_params)
+            trip = replan_trip(pk, changes)
+        except PlanInputError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if trip is None:
+            return Response({"error": "Trip not found"}, status=status.HTTP_404_NOT_FOUND)
+        with span("serialize"):
+            trip_data = trip_response(trip, geometry_options=geometry_options)
+        return Response(trip_data)
+
+
+PLACES_MAX_LIMIT = 25
+
+
+class PlacesView(APIView):
+    """
+    Place-name autocomplete from the offline gazetteer: ?q=chica&limit=8 returns
+    {"results": [{"name": "Chicago, IL", "lat", "lon"}, ...]}, most populous first.
+    Empty when no gazetteer is configured.
+    """
+
+    def get(self, request):
+        try:
+            limit = min(max(int(request.query_params.get("limit", 8)), 1), PLACES_MAX_LIMIT)
+        except ValueError:
+            return Response(
+                {"error": "limit must be an integer"}, status=status.HTTP_400_BAD_REQUEST
             )
+        query = request.query_params.get("q", "")
+        index = gazetteer()
+        results = index.complete(query, limit) if index and query.strip() else []
+        response = Response({"results": results})
+        # The gazetteer only changes on deploy
+        response["Cache-Control"] = "public, max-age=3600"
+        return response
+
 
-            """
-            Place fuel and break stops along the route
-            """
-
-            def haversine(lat1, lon1, lat2, lon2):
-                """Return distance in meters between two lat/lon points using the Haversine formula."""
-                R = 6371000  # Earth radius in meters
-                phi1, phi2 = radians(lat1), radians(lat2)
-                dphi = radians(lat2 - lat1)
-                dlambda = radians(lon2 - lon1)
-                a = sin(dphi / 2) ** 2 + cos(phi1) * cos(phi2) * sin(dlambda / 2) ** 2
-                return R * 2 * atan2(sqrt(a), sqrt(1 - a))
-
-            def place_stops_along_route(geometry, interval_m):
-                # Compute cumulative distances
-                cum_dist = [0]
-                for i in range(1, len(geometry)):
-                    d = haversine(*geometry[i - 1], *geometry[i])
-                    cum_dist.append(cum_dist[-1] + d)
-
-                total_distance = cum_dist[-1]
-                num_stops = int(total_distance // interval_m)
-
-                stops = []
-                for i in range(1, num_stops + 1):
-                    target = i * interval_m
-                    # Find nearest point in geometry
-                    idx = min(range(len(cum_dist)), key=lambda j: abs(cum_dist[j] - target))
-                    lat, lon = geometry[idx]
-                    stops.append({"lat": lat, "lon": lon, "order_index": i})
-                return stops
-
-            # Add fuel stops every 1000 miles (1609.34 meters per mile)
-
-            # --- Main logic ---
-            if route and route["geometry"]:
-                total_distance_m = route["distance_m"]
-                total_duration_s = route["duration_s"]
-                geometry = route["geometry"]
-
-                # Fuel stops: every 1000 miles
-                fuel_interval_m = 1000 * 1609.34
-                fuel_stops = place_stops_along_route(geometry, fuel_interval_m)
-
-                # Average speed in meters per second
-                avg_speed_mps = total_distance_m / total_duration_s if total_duration_s > 0 else 0
-
-                # Break stops: every 8 hours
-                break_interval_m = avg_speed_mps * 8 * 3600
-                break_stops = place_stops_along_route(geometry, break_interval_m)
-
-                # ------------------------------
-                # Build unified list of all stops
-                # ------------------------------
-                stops_info = []
-
-                # Current
-                current_lat, current_lon = current_coords
-                stops_info.append(
-                    {
-                        "type": "current",
-                        "location": current_location,
-                        "geometry_idx": 0,
-                        "duration_hours": 0.0,
-                        "lat": current_lat,
-                        "lon": current_lon,
-                    }
-                )
-
-                # Pickup
-                pickup_lat, pickup_lon = pickup_coords
-                pickup_idx = min(
-                    range(len(geometry)),
-                    key=lambda i: (geometry[i][0] - pickup_lat) ** 2
-                    + (geometry[i][1] - pickup_lon) ** 2,
-                )
-
-                stops_info.append(
-                    {
-                        "type": "pickup",
-                        "location": pickup_location,
-                        "geometry_idx": pickup_idx,
-                        "duration_hours": 1.0,
-                        "lat": pickup_lat,
-                        "lon": pickup_lon,
-                    }
-                )
-
-                # Dropoff
-                drop_lat, drop_lon = dropoff_coords
-                dropoff_idx = min(
-                    range(len(geometry)),
-                    key=lambda i: (geometry[i][0] - drop_lat) ** 2
-                    + (geometry[i][1] - drop_lon) ** 2,
-                )
-
-                stops_info.append(
-                    {
-                        "type": "dropoff",
-                        "location": dropoff_location,
-                        "geometry_idx": dropoff_idx,
-                        "duration_hours": 1.0,
-                        "lat": drop_lat,
-                        "lon": drop_lon,
-                    }
-                )
-
-                # Fuel stops
-                for fs in fuel_stops:
-                    lat, lon = fs["lat"], fs["lon"]
-                    idx = min(
-                        range(len(geometry)),
-                        key=lambda i: abs(geometry[i][0] - lat) + abs(geometry[i][1] - lon),
-                    )
-                    stops_info.append(
-                        {
-                            "type": "fuel",
-                            "location": f"{lat},{lon}",
-                            "geometry_idx": idx,
-                            "duration_hours": 0.5,
-                            "lat": lat,
-                            "lon": lon,
-                        }
-                    )
-
-                # Break stops
-                for bs in break_stops:
-                    lat, lon = bs["lat"], bs["lon"]
-                    idx = min(
-                        range(len(geometry)),
-                        key=lambda i: abs(geometry[i][0] - lat) + abs(geometry[i][1] - lon),
-                    )
-                    stops_info.append(
-                        {
-                            "type": "break",
-                            "location": f"{lat},{lon}",
-                            "geometry_idx": idx,
-                            "duration_hours": 0.5,
-                            "lat": lat,
-                            "lon": lon,
-                        }
-                    )
-
-                # Sort all stops by their order along geometry
-                stops_info_sorted = sorted(stops_info, key=lambda s: s["geometry_idx"])
-
-                # ------------------------------
-                # Compute arrival times
-                # ------------------------------
-                prev_idx = 0
-                prev_time = start_time
-                all_stop_objs = []
-
-                for idx, stop in enumerate(stops_info_sorted, start=1):
-                    # Distance from prev stop to this stop
-                    seg_dist = 0
-                    for i in range(prev_idx, stop["geometry_idx"]):
-                        lat1, lon1 = geometry[i]
-                        lat2, lon2 = geometry[i + 1]
-                        seg_dist += haversine(lat1, lon1, lat2, lon2)
-
-                    # Travel time
-                    travel_time = (
-                        timedelta(seconds=seg_dist / avg_speed_mps)
-                        if avg_speed_mps > 0
-                        else timedelta(0)
-                    )
-                    arrival_time = prev_time + travel_time
-
-                    # Save Stop object
-                    stop_obj = Stop.objects.create(
-                        trip=trip,
-                        type=stop["type"],
-                        location=stop["location"],
-                        arrival_time=arrival_time,
-                        duration_hours=stop["duration_hours"],
-                        order_index=idx,
-                        lat=stop.get("lat"),
-                        lon=stop.get("lon"),
-                    )
-                    all_stop_objs.append(stop_obj)
-
-                    # Update prev time and index for next stop
-                    prev_time = arrival_time + timedelta(hours=stop["duration_hours"])
-                    prev_idx = stop["geometry_idx"]
-
-                plan_trip(all_stop_objs)
-
-        # Serialize trip with stops + log sheets
-        serializer = TripSerializer(trip)
-        trip_data = serializer.data
-        # Add route metadata
-        trip_data["route_geometry"] = route["geometry"] if route else []
-        trip_data["route_distance_m"] = route["distance_m"] if route else None
-        trip_data["route_duration_s"] = route["duration_s"] if route else None
-
-        return Response(trip_data, status=status.HTTP_201_CREATED)
+class MetricsView(APIView):
+    """
+    Prometheus text format: per-stage and per-view latency histograms, Mapbox
+    call counters and cache hit rates for this process. Requests must send
+    METRICS_TOKEN as a bearer token; without one set, only DEBUG serves it.
+    """
+
+    def get(self, request):
+        token = getattr(settings, "METRICS_TOKEN", None)
+        if not token:
+            if not settings.DEBUG:
+                return Response({"error": "Metrics disabled"}, status=status.HTTP_403_FORBIDDEN)
+        elif not hmac.compare_digest(
+            request.headers.get("Authorization", "").encode(), f"Bearer {token}".encode()
+        ):
+            return Response({"error": "Unauthorized"}, status=status.HTTP_401_UNAUTHORIZED)
+        return HttpResponse(render_metrics(), content_type=METRICS_CONTENT_TYPE)
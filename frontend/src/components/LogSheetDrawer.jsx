@@ -5,7 +5,7 @@ function LogSheetDrawer({ trip, onClose }) {
     const [currentSheetIndex, setCurrentSheetIndex] = useState(0);
     const dailyLogRef = useRef(null);
 
-    if (!trip || !trip.logsheets) return null;
+    if (!trip || !trip.logsheets || !trip.logsheets.length) return null;
 
     const currentSheet = trip.logsheets[currentSheetIndex];
 
@@ -2,6 +2,32 @@ import L from 'leaflet';
 import 'leaflet/dist/leaflet.css';
 import { MapContainer, Marker, Polyline, Popup, TileLayer } from 'react-leaflet';
 
+// Decode an encoded polyline (route_geometry_format === 'polyline') into [lat, lon] pairs
+function decodePolyline(encoded, precision = 5) {
+    const factor = 10 ** precision;
+    const coords = [];
+    let index = 0;
+    let lat = 0;
+    let lon = 0;
+    const nextValue = () => {
+        let result = 0;
+        let shift = 0;
+        let byte;
+        do {
+            byte = encoded.charCodeAt(index++) - 63;
+            result |= (byte & 0x1f) << shift;
+            shift += 5;
+        } while (byte >= 0x20);
+        return result & 1 ? ~(result >> 1) : result >> 1;
+    };
+    while (index < encoded.length) {
+        lat += nextValue();
+        lon += nextValue();
+        coords.push([lat / factor, lon / factor]);
+    }
+    return coords;
+}
+
 function MapView({ trip }) {
     // Custom marker icons
     const markerIcons = {
@@ -39,7 +65,9 @@ function MapView({ trip }) {
     if (!trip) return null;
 
     const stops = trip.stops || [];
-    const routeGeometry = trip.route_geometry || [];
+    const routeGeometry = typeof trip.route_geometry === 'string'
+        ? decodePolyline(trip.route_geometry)
+        : trip.route_geometry || [];
 
     // Center map on current location first
     let center = { lat: 0, lng: 0 };
@@ -124,11 +152,11 @@ function MapView({ trip }) {
                             if (stop.type === 'current') icon = markerIcons.current;
                             else if (stop.type === 'pickup') icon = markerIcons.pickup;
                             else if (stop.type === 'dropoff') icon = markerIcons.dropoff;
-                            else if (stop.type === 'break') icon = markerIcons.break;
+                            else if (stop.type === 'break' || stop.type === 'rest' || stop.type === 'restart') icon = markerIcons.break;
                             else if (stop.type === 'fuel') icon = markerIcons.fuel;
                             // fallback: if type is unknown, use grey
                             return (
-                                <Marker key={stop.id} position={{ lat: stop.lat, lng: stop.lon }} icon={icon}>
+                                <Marker key={stop.id ?? `stop-${stop.order_index}`} position={{ lat: stop.lat, lng: stop.lon }} icon={icon}>
                                     <Popup>
                                         {stop.type.charAt(0).toUpperCase() + stop.type.slice(1)} Stop<br />
                                         {stop.location} <br />
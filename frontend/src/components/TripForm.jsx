@@ -1,4 +1,6 @@
-import { useState } from "react";
+import { useRef, useState } from "react";
+
+const SUGGEST_DELAY_MS = 150;
 
 function TripForm({ onPlan }) {
     const [currentLocation, setCurrentLocation] = useState("");
@@ -6,6 +8,29 @@ function TripForm({ onPlan }) {
     const [dropoffLocation, setDropoffLocation] = useState("");
     const [cycleUsed, setCycleUsed] = useState("");
     const [isLoading, setIsLoading] = useState(false);
+    const [suggestions, setSuggestions] = useState([]);
+    const suggestTimer = useRef(null);
+
+    // Place autocomplete from the backend's offline gazetteer, debounced per keystroke
+    const suggestPlaces = (query) => {
+        clearTimeout(suggestTimer.current);
+        if (query.trim().length < 2) {
+            setSuggestions([]);
+            return;
+        }
+        suggestTimer.current = setTimeout(async () => {
+            try {
+                const API_URL = import.meta.env.VITE_API_URL;
+                const response = await fetch(`${API_URL}/api/places/?q=${encodeURIComponent(query)}&limit=8`);
+                if (response.ok) {
+                    const data = await response.json();
+                    setSuggestions(data.results.map((place) => place.name));
+                }
+            } catch {
+                // Suggestions are optional; typing still works without them
+            }
+        }, SUGGEST_DELAY_MS);
+    };
 
     const handleSubmit = async (e) => {
         e.preventDefault();
@@ -21,7 +46,9 @@ function TripForm({ onPlan }) {
         try {
             const API_URL = import.meta.env.VITE_API_URL;
             console.log("API URL:", API_URL);
-            const response = await fetch(`${API_URL}/api/plan/`, {
+            // Streamed plan (one JSON event per line) so the map and stops render as they
+            // arrive; compact route: encoded polyline, simplified for street zoom
+            const response = await fetch(`${API_URL}/api/plan/stream/?geometry=polyline&zoom=12`, {
                 method: "POST",
                 headers: { "Content-Type": "application/json" },
                 body: JSON.stringify(payload),
@@ -31,8 +58,36 @@ function TripForm({ onPlan }) {
                 throw new Error("Failed to plan trip");
             }
 
-            const data = await response.json();
-            onPlan(data); // send to parent
+            let trip = { ...payload, stops: [], logsheets: [], pending: true };
+            const applyEvent = (event) => {
+                if (event.event === "route") {
+                    const { event: _, ...route } = event;
+                    trip = { ...trip, ...route };
+                } else if (event.event === "stop") {
+                    trip = { ...trip, stops: [...trip.stops, event.stop] };
+                } else if (event.event === "logsheet") {
+                    trip = { ...trip, logsheets: [...trip.logsheets, event.logsheet] };
+                } else if (event.event === "trip") {
+                    trip = { ...trip, ...event.trip, pending: false };
+                } else if (event.event === "error") {
+                    throw new Error(event.error);
+                } else {
+                    return;
+                }
+                onPlan(trip); // send to parent
+            };
+
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffered = "";
+            for (;;) {
+                const { done, value } = await reader.read();
+                if (done) break;
+                buffered += decoder.decode(value, { stream: true });
+                const lines = buffered.split("\n");
+                buffered = lines.pop();
+                lines.filter((line) => line.trim()).forEach((line) => applyEvent(JSON.parse(line)));
+            }
         } catch (err) {
             console.error(err);
             alert("Error planning trip");
@@ -49,6 +104,12 @@ function TripForm({ onPlan }) {
             </div>
 
             <form onSubmit={handleSubmit} className="space-y-5">
+                <datalist id="place-suggestions">
+                    {suggestions.map((name) => (
+                        <option key={name} value={name} />
+                    ))}
+                </datalist>
+
                 {/* Current Location */}
                 <div className="space-y-2">
                     <label className="block text-sm font-medium text-gray-700">
@@ -58,7 +119,12 @@ function TripForm({ onPlan }) {
                         <input
                             type="text"
                             value={currentLocation}
-                            onChange={(e) => setCurrentLocation(e.target.value)}
+                            onChange={(e) => {
+                                setCurrentLocation(e.target.value);
+                                suggestPlaces(e.target.value);
+                            }}
+                            list="place-suggestions"
+                            autoComplete="off"
                             required
                             placeholder="e.g., Delhi"
                             className="w-full px-4 py-3 border border-gray-300 rounded-lg focus:ring-2 focus:ring-blue-500 focus:border-blue-500 transition-colors duration-200 placeholder-gray-400"
@@ -81,7 +147,12 @@ function TripForm({ onPlan }) {
                         <input
                             type="text"
                             value={pickupLocation}
-                            onChange={(e) => setPickupLocation(e.target.value)}
+                            onChange={(e) => {
+                                setPickupLocation(e.target.value);
+                                suggestPlaces(e.target.value);
+                            }}
+                            list="place-suggestions"
+                            autoComplete="off"
                             required
                             placeholder="e.g., Pune"
                             className="w-full px-4 py-3 border border-gray-300 rounded-lg focus:ring-2 focus:ring-green-500 focus:border-green-500 transition-colors duration-200 placeholder-gray-400"
@@ -103,7 +174,12 @@ function TripForm({ onPlan }) {
                         <input
                             type="text"
                             value={dropoffLocation}
-                            onChange={(e) => setDropoffLocation(e.target.value)}
+                            onChange={(e) => {
+                                setDropoffLocation(e.target.value);
+                                suggestPlaces(e.target.value);
+                            }}
+                            list="place-suggestions"
+                            autoComplete="off"
                             required
                             placeholder="e.g., Agra"
                             className="w-full px-4 py-3 border border-gray-300 rounded-lg focus:ring-2 focus:ring-red-500 focus:border-red-500 transition-colors duration-200 placeholder-gray-400"
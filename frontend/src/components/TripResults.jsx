@@ -23,16 +23,23 @@ function TripResults({ trip, onShowLogs }) {
             <div className="bg-white rounded-xl shadow-lg p-6">
                 <div className="flex items-center justify-between mb-4">
                     <h2 className="text-2xl font-bold text-gray-800">Trip Results</h2>
-                    <div className="flex items-center px-3 py-1 bg-green-100 text-green-800 rounded-full text-sm font-medium">
-                        <svg className="w-4 h-4 mr-1" fill="currentColor" viewBox="0 0 20 20">
-                            <path fillRule="evenodd" d="M10 18a8 8 0 100-16 8 8 0 000 16zm3.707-9.293a1 1 0 00-1.414-1.414L9 10.586 7.707 9.293a1 1 0 00-1.414 1.414l2 2a1 1 0 001.414 0l4-4z" clipRule="evenodd" />
-                        </svg>
-                        Planned
-                    </div>
+                    {trip.pending ? (
+                        // Still streaming in from /api/plan/stream/
+                        <div className="flex items-center px-3 py-1 bg-blue-100 text-blue-800 rounded-full text-sm font-medium">
+                            Planning...
+                        </div>
+                    ) : (
+                        <div className="flex items-center px-3 py-1 bg-green-100 text-green-800 rounded-full text-sm font-medium">
+                            <svg className="w-4 h-4 mr-1" fill="currentColor" viewBox="0 0 20 20">
+                                <path fillRule="evenodd" d="M10 18a8 8 0 100-16 8 8 0 000 16zm3.707-9.293a1 1 0 00-1.414-1.414L9 10.586 7.707 9.293a1 1 0 00-1.414 1.414l2 2a1 1 0 001.414 0l4-4z" clipRule="evenodd" />
+                            </svg>
+                            Planned
+                        </div>
+                    )}
                 </div>
 
                 <div className="text-sm text-gray-600">
-                    Trip ID: <span className="font-mono bg-gray-100 px-2 py-1 rounded text-xs">{trip.id}</span>
+                    Trip ID: <span className="font-mono bg-gray-100 px-2 py-1 rounded text-xs">{trip.id ?? "--"}</span>
                 </div>
             </div>
 